@@ -1,18 +1,30 @@
 import tkinter as tk
 import tkinter.font as tkFont
 from tkinter import ttk, messagebox
-from tkcalendar import DateEntry
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import queue
 from app import *
-from db_interface import raw_sql, create, read, update, delete, get_primary_key
+from db_interface import raw_sql, create, read, fetch_one, search_entries, read_page, update, delete, get_primary_key, get_table_columns, get_catalog_tables, DEFAULT_PAGE_SIZE, INTERNAL_TABLES
+from report_history import save_report, delete_reports
+
+logger = logging.getLogger("supplicore.gui")
+
+# Milliseconds to wait after the last key press before searching the entries combobox
+SEARCH_DELAY_MS = 250
 
 
 # Classes --------------------------
 
 class MultiPageApp(tk.Tk):
-    def __init__(self, cnx):
+    def __init__(self, cnx, timeline=None):
         super().__init__()
         self.cnx = cnx
+        self.timeline = timeline  # StartupTimeline from app.py, if --startup-profile was given
+
+        # Runs database calls in the background, so the window doesn't freeze while waiting on them
+        self.db_executor = DatabaseExecutor(self)
 
         # Define starting window dimensions
         page_width = 800
@@ -29,16 +41,11 @@ class MultiPageApp(tk.Tk):
         # Prevent the container from shrinking to fit the frames
         self.container.pack_propagate(False)
 
-        # Dictionary to hold references to frames
-        self.frames = {}
-        for F in (HomePage, PageDatabase, PageReportEditing, PageSettings):
-            page_name = F.__name__
-            # Pass None for `cnx` if it's not available
-            frame = F(parent=self.container, controller=self, cnx=self.cnx if self.cnx else None)
-            self.frames[page_name] = frame
+        # Pages are built the first time they are shown (see get_frame()), so startup only pays for the HomePage
+        self.pages = {F.__name__: F for F in (HomePage, PageDatabase, PageReportEditing, PageSettings)}
 
-            # Initially hide all frames
-            frame.pack_forget()
+        # Dictionary to hold references to frames that have been built
+        self.frames = {}
 
         # Show the HomePage by default
         self.show_frame("HomePage")
@@ -47,6 +54,13 @@ class MultiPageApp(tk.Tk):
         if self.cnx is None:
             show_limited_mode_message() 
 
+    def destroy(self):
+        """
+        Stops the database executor before closing the window.
+        """
+        self.db_executor.shutdown()
+        super().destroy()
+
     def handle_access_database(self, controller, source, destination):
         """
         Checks if database is accessible, shows error if it is not.
@@ -63,14 +77,28 @@ class MultiPageApp(tk.Tk):
         Show a frame for the given page name.
         Hides the current frame and shows the requested one.
         """
+        # Build the page first, so nothing is hidden if building it fails
+        frame = self.get_frame(page_name)
+
         # Hide all frames
-        for frame in self.frames.values():
-            frame.pack_forget()
+        for other_frame in self.frames.values():
+            other_frame.pack_forget()
 
         # Show the selected frame
-        frame = self.frames[page_name]
         frame.pack(fill="both", expand=True)
 
+    def get_frame(self, page_name):
+        """
+        Returns the frame for the given page name, building it on first use.
+        """
+        if page_name not in self.frames:
+            # Pass None for `cnx` if it's not available
+            self.frames[page_name] = self.pages[page_name](parent=self.container, controller=self, cnx=self.cnx if self.cnx else None)
+            if self.timeline:
+                self.timeline.mark(f"build {page_name}")
+
+        return self.frames[page_name]
+
 class HomePage(ttk.Frame):
     def __init__(self, parent, controller, cnx):
         super().__init__(parent)
@@ -154,21 +182,14 @@ class PageDatabase(ttk.Frame):
     def __init__(self, parent, controller, cnx):
         super().__init__(parent)
         self.cnx = cnx
+        self.db_executor = controller.db_executor
         font_type = "Calibri"
 
         # Configure the grid layout for the frame
         self.columnconfigure(0, weight=1)
         self.rowconfigure(2, weight=1)
 
-        # Add styles for buttons
-        style = ttk.Style()
-        style.configure(
-            "TopLeft.TButton",
-            font=(font_type, 12),
-            padding=(5, 5),
-            relief="flat"
-        )
-
+        # Buttons use the "TopLeft.TButton" style configured by HomePage
         # Home and Settings buttons
         top_left_frame = ttk.Frame(self)
         top_left_frame.grid(row=0, column=0, sticky="nw", padx=10, pady=10)
@@ -203,11 +224,18 @@ class PageDatabase(ttk.Frame):
         self.table_combobox.grid(row=0, column=1, padx=10, pady=5, sticky="w")
         self.table_combobox.bind("<<ComboboxSelected>>", self.on_table_selected)
 
-        # Entries combobox
+        # Entries combobox. Typing searches the table by ID or name.
         ttk.Label(table_frame, text="Entry:", font=(font_type, 12)).grid(row=1, column=0, padx=5, pady=5, sticky="w")
-        self.entry_combobox = ttk.Combobox(table_frame, state="readonly")
+        self.entry_combobox = ttk.Combobox(table_frame)
         self.entry_combobox.grid(row=1, column=1, padx=10, pady=5, sticky="w")
         self.entry_combobox.bind("<<ComboboxSelected>>", self.on_entry_selected)
+        self.entry_combobox.bind("<KeyRelease>", self.on_entry_typed)
+        self.entry_combobox.bind("<Return>", self.on_entry_submitted)
+        self.search_job = None  # pending after() call for the typed search
+
+        # Shown while entries are being loaded
+        self.loading_indicator = LoadingIndicator(table_frame)
+        self.loading_indicator.grid(row=2, column=0, columnspan=2, pady=5)
 
         # Frame for displaying entry details
         self.entry_display_frame = ttk.Frame(self, borderwidth=1, relief="solid")
@@ -249,6 +277,16 @@ class PageDatabase(ttk.Frame):
         )
         self.remove_button.pack(side="left", padx=10, pady=5)
 
+        self.browse_button = ttk.Button(
+            button_frame,
+            text="Browse Table",
+            command=self.on_browse_table,
+            state="disabled",
+            style="TopLeft.TButton",
+            width=len("Browse Table") + 2
+        )
+        self.browse_button.pack(side="left", padx=10, pady=5)
+
     def add_view_fields(self):
         """
         Add fields to the entry display frame
@@ -278,36 +316,89 @@ class PageDatabase(ttk.Frame):
 
     def update_tables(self):
         """
-        Fetch all table names from the database and populate the table ComboBox.
+        Fetch all table names from the schema catalog and populate the table ComboBox.
         """
-        tables = raw_sql(self.cnx, "SHOW TABLES")
-        table_list = tables.iloc[:, 0].tolist()
-        filtered_table_list = [table for table in table_list if '_has_' not in table]
+        table_list = get_catalog_tables(self.cnx)
+        filtered_table_list = [table for table in table_list
+                               if '_has_' not in table.lower() and table.lower() not in INTERNAL_TABLES]
 
         # Populate the ComboBox with table names
         self.table_combobox["values"] = filtered_table_list
 
     def update_entries(self, selected_table):
         """
-        Update the entries combobox with entries from the selected table.
+        Clears the entries combobox, and fills it with the first entries of the selected table.
         * Parameters:
             * selected_table: The table from which to fetch the entries
         """
-        # Fetch the first three columns of entries from the selected table
-        query = f"SELECT * FROM {selected_table}"
-        entries = raw_sql(self.cnx, query)
+        self.entry_combobox["values"] = []
+        self.entry_combobox.set("")
+        self.search_entries(selected_table)
+
+    def search_entries(self, selected_table=None):
+        """
+        Fills the entries combobox with the entries whose ID or name starts with the typed text.
+        Only the first DEFAULT_SEARCH_LIMIT matches are fetched, so this is fast for any table size.
+        * Parameters:
+            * selected_table: The table to search (default: the selected table)
+        """
+        self.search_job = None
+        selected_table = selected_table or self.table_combobox.get()
+        if not selected_table:
+            return
 
-        # Check if the result contains data
-        if not entries.empty:
-            # Convert the DataFrame to a list of formatted strings
-            # Assuming the first column is MRN and the second column is the first name
-            entry_list = entries.iloc[:, :3].apply(lambda row: f"{row.iloc[0]} | {row.iloc[1]}", axis=1).tolist()
+        # Search in the background. A newer search replaces this request.
+        self.db_executor.submit(
+            "entries",
+            search_entries, self.cnx, selected_table, self.entry_combobox.get(),
+            on_success=self.show_entries,
+            indicator=self.loading_indicator
+        )
 
-            # Populate the entry combobox
-            self.entry_combobox["values"] = entry_list
-            self.entry_combobox.set("")
-        else:
-            self.entry_combobox["values"] = []
+    def show_entries(self, entries):
+        """
+        Fills the entries combobox. Called with the result of the search made by search_entries().
+        * Parameters:
+            * entries: list of rows, as given by db_interface.search_entries()
+        """
+        self.entry_combobox["values"] = format_entry_list(entries)
+
+    def on_entry_typed(self, event):
+        """
+        Called when a key is released in the entries combobox. Searches once typing pauses for SEARCH_DELAY_MS.
+        """
+        if event.keysym in ("Return", "Escape", "Tab", "Up", "Down", "Left", "Right", "Home", "End"):
+            return
+
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(SEARCH_DELAY_MS, self.search_entries)
+
+    def on_browse_table(self):
+        """
+        Opens the selected table in a grid window. Double-clicking a row shows it on this page.
+        """
+        selected_table = self.table_combobox.get()
+        if selected_table:
+            TableGridWindow(self, self.cnx, self.db_executor, selected_table, on_open=self.open_grid_row)
+
+    def open_grid_row(self, table, row):
+        """
+        Shows a row chosen in the grid window. Called by TableGridWindow.
+        """
+        if table != self.table_combobox.get():
+            return
+        self.entry_combobox.set(format_entry_list([row])[0])
+        self.on_entry_selected(None)
+
+    def on_entry_submitted(self, event):
+        """
+        Called when Enter is pressed in the entries combobox. Selects the typed entry, or the first match.
+        """
+        values = self.entry_combobox["values"]
+        if values and self.entry_combobox.get() not in values:
+            self.entry_combobox.set(values[0])
+        self.on_entry_selected(event)
 
     def on_table_selected(self, event):
         """
@@ -316,6 +407,7 @@ class PageDatabase(ttk.Frame):
         selected_table = self.table_combobox.get()
         if selected_table:
             self.add_button["state"] = "normal"
+            self.browse_button["state"] = "normal"
             self.update_entries(selected_table)
 
     def on_entry_selected(self, event):
@@ -350,12 +442,28 @@ class PageDatabase(ttk.Frame):
             * selected_table: The table from which to fetch the entry
             * selected_entry_id: The ID of the entry to fetch (or another unique identifier)
         """
-        query = f"SELECT * FROM {selected_table} WHERE {primary_key} = '{entry_id}'"
-        entry_details = pd.read_sql(query, self.cnx)
+        # Fetch the entry in the background. A newer selection replaces this request.
+        self.db_executor.submit(
+            "entry",
+            fetch_one, self.cnx, selected_table,
+            where=f"{primary_key} = :entry_id", params={"entry_id": entry_id},
+            on_success=self.show_entry_details,
+            indicator=self.loading_indicator
+        )
+
+    def show_entry_details(self, entry_details):
+        """
+        Fills the Treeview with an entry. Called with the result of the query made by display_entry().
+        * Parameters:
+            * entry_details: the entry's row, as given by fetch_one()
+        """
+        # The Treeview is replaced while the add/update form is open
+        if entry_details is None or not self.tree.winfo_exists():
+            return
 
         # Clear the treeview and display the new entry details
         self.tree.delete(*self.tree.get_children())
-        for column, value in entry_details.iloc[0].items():
+        for column, value in zip(entry_details._fields, entry_details):
             self.tree.insert("", "end", values=(column, value))
     
     def on_add_entry(self, update_mode=False, entry_details=None, primary_key=None, entry_id=None):
@@ -370,8 +478,8 @@ class PageDatabase(ttk.Frame):
         for widget in self.entry_display_frame.winfo_children():
             widget.destroy()
 
-        # Fetch the structure of the selected table to display fields
-        columns = raw_sql(self.cnx, f"DESCRIBE {selected_table}")
+        # Get the structure of the selected table to display fields
+        columns = get_table_columns(self.cnx, selected_table)
 
         # Create a label at the top
         label_text = "Update Entry" if update_mode else "Add New Entry"
@@ -380,19 +488,16 @@ class PageDatabase(ttk.Frame):
 
         # Create form fields
         self.add_fields = {}
-        for column in columns.itertuples():
+        for column in columns:
             field_name = column.Field
-            field_type = column.Type
 
             if "auto_increment" not in column.Extra:
                 field_label = ttk.Label(self.entry_display_frame, text=f"{field_name}:")
                 field_label.pack(anchor="w", padx=5, pady=2)
 
                 # Detect ENUM type and create a dropdown list
-                if "enum" in field_type.lower():
-                    # Extract ENUM values (strip "enum(" and ")")
-                    enum_values = field_type[5:-1].replace("'", "").split(",")
-                    field_entry = ttk.Combobox(self.entry_display_frame, values=enum_values, state="readonly")
+                if column.enum_values:
+                    field_entry = ttk.Combobox(self.entry_display_frame, values=column.enum_values, state="readonly")
 
                     # Set default value if updating
                     if entry_details and field_name in entry_details:
@@ -440,11 +545,18 @@ class PageDatabase(ttk.Frame):
             primary_key = get_primary_key(self.cnx, selected_table)
 
             # Fetch the entry data
-            query = f"SELECT * FROM {selected_table} WHERE {primary_key} = '{selected_entry_id}'"
-            entry_details = pd.read_sql(query, self.cnx).iloc[0].to_dict()
+            entry_details = fetch_one(
+                self.cnx, selected_table,
+                where=f"{primary_key} = :entry_id", params={"entry_id": selected_entry_id}
+            )
+
+            # The entry box takes typed text, so the ID may not match an entry
+            if entry_details is None:
+                messagebox.showerror("Error", f"Entry with ID {selected_entry_id} does not exist in {selected_table}.")
+                return
 
             # Populate the form
-            self.on_add_entry(update_mode=True, entry_details=entry_details, primary_key=primary_key, entry_id=selected_entry_id)
+            self.on_add_entry(update_mode=True, entry_details=entry_details._asdict(), primary_key=primary_key, entry_id=selected_entry_id)
 
     def on_remove_entry(self):
         """
@@ -457,13 +569,33 @@ class PageDatabase(ttk.Frame):
             # Extract the unique identifier (ID) from the entry (assuming the first part before '|' is the ID)
             selected_entry_id = selected_entry.split(" | ")[0]
 
+            if selected_table.lower() == "reports":
+                # Report revisions can be the snapshot other revisions are saved against, see report_history.py
+                self.remove_report(selected_entry_id)
+                return
+
             # Get the primary key for the selected table
             primary_key = get_primary_key(self.cnx, selected_table)
 
             # Call the delete CRUD function, passing the correct primary key and the entry ID
             delete(self.cnx, self, selected_table, selected_entry_id, primary_key)
 
-            print(f"Entry {selected_entry_id} removed from {selected_table}")
+            logger.info("Entry %s removed from %s", selected_entry_id, selected_table)
+
+    def remove_report(self, report_id):
+        """
+        Deletes a report revision with delete_reports(), which keeps the revisions saved against it readable.
+        """
+        try:
+            if not delete_reports(self.cnx, [int(report_id)]):
+                raise ValueError(f"Entry with ID {report_id} does not exist in Reports.")
+        except Exception as e:
+            logger.error("Error during delete operation: %s", e)
+            messagebox.showerror("Error", f"Failed to delete entry: {str(e)}")
+            return
+
+        logger.info("Entry %s removed from Reports", report_id)
+        messagebox.showinfo("Success", f"Entry with ID {report_id} deleted successfully.")
 
     def submit_entry(self, update_mode, table, primary_key=None, entry_id=None):
         """
@@ -473,10 +605,10 @@ class PageDatabase(ttk.Frame):
             field_data = {field: entry.get() for field, entry in self.add_fields.items()}
 
             # Handle nullable or optional fields (like JSON fields)
-            columns = raw_sql(self.cnx, f"DESCRIBE {table}")
-            for column in columns.itertuples():
+            columns = get_table_columns(self.cnx, table)
+            for column in columns:
                 field_name = column.Field
-                if "json" in column.Type.lower() and field_name in field_data:
+                if column.data_type == "json" and field_name in field_data:
                     # Set nullable JSON fields to None if empty
                     if not field_data[field_name].strip():
                         field_data[field_name] = None
@@ -490,7 +622,7 @@ class PageDatabase(ttk.Frame):
 
             self.go_back()
         except Exception as e:
-            print(f"Error during submission: {e}")
+            logger.error("Error during submission: %s", e)
             messagebox.showerror("Error", str(e))
 
     def submit_new_entry(self):
@@ -506,8 +638,7 @@ class PageDatabase(ttk.Frame):
             # Gather data from input fields
             field_data = {field: entry.get() for field, entry in self.add_fields.items()}
 
-            # Debug: Print the raw collected data
-            print(f"Collected field data: {field_data}")
+            logger.debug("Collected field data: %s", field_data)
 
             # Convert date fields to the correct format
             if "DOB" in field_data:
@@ -520,8 +651,7 @@ class PageDatabase(ttk.Frame):
                     messagebox.showerror("Invalid Date", f"Invalid date format for 'DOB': {dob}. Expected MM/DD/YY.")
                     return
 
-            # Debug: Print the prepared field data
-            print(f"Final field data (after formatting): {field_data}")
+            logger.debug("Final field data (after formatting): %s", field_data)
 
             # Call the `create` function to insert data into the database
             create(self.cnx, self, selected_table, field_data)
@@ -533,8 +663,7 @@ class PageDatabase(ttk.Frame):
             self.go_back()
 
         except Exception as e:
-            # Debug: Print detailed error
-            print(f"Error during submission: {e}")
+            logger.error("Error during submission: %s", e)
             messagebox.showerror("Error", f"An error occurred while adding the entry: {str(e)}")
 
     def go_back(self):
@@ -551,6 +680,7 @@ class PageDatabase(ttk.Frame):
 class PageReportEditing(ttk.Frame):
     def __init__(self, parent, controller, cnx):
         super().__init__(parent)
+        self.db_executor = controller.db_executor
 
         font_type = "Helvetica"
 
@@ -648,6 +778,11 @@ class PageReportEditing(ttk.Frame):
             text="Save to Computer",
             command=lambda: save_report_JSON(self.get_report_input(cnx, report_labels, report_entries))
         )
+        save_as_PDF_button = ttk.Button(
+            button_frame,
+            text="Save as PDF",
+            command=lambda: save_report_PDF(self.get_report_input(cnx, report_labels, report_entries))
+        )
         save_to_database_button = ttk.Button(
             button_frame,
             text="Save to Database",
@@ -656,22 +791,39 @@ class PageReportEditing(ttk.Frame):
 
         fetch_button.pack(side="left", padx=10)
         save_to_computer_button.pack(side="left", padx=10)
+        save_as_PDF_button.pack(side="left", padx=10)
         save_to_database_button.pack(side="left", padx=10)
 
+        # Shown while fetching or saving
+        self.loading_indicator = LoadingIndicator(button_frame)
+        self.loading_indicator.pack(side="left", padx=10)
+
     def save_to_db(self, cnx, report_export):
         """
-        Saves the report to the database. Helps to format the call to create() correctly.
+        Saves the report to the database as a new revision of the patient's report (see report_history.py).
         Parameters:
             * cnx: the connection to the database
             * report_export: dict, as given by get_report_input()
         """
-        create(cnx, self, "reports", {
-            "MRN": int(report_export["MRN"]),
-            "date": datetime.strptime(report_export["current_date"], "%Y-%m-%d").strftime("%Y-%m-%d %H:%M:%S"),
-            "report": json.dumps(report_export)
-        })
+        # Check the MRN and date before asking to confirm
+        try:
+            int(report_export["MRN"])
+            datetime.strptime(report_export["current_date"], "%Y-%m-%d")
+        except ValueError as e:
+            messagebox.showerror("Invalid Input", str(e))
+            return
 
-        save_info_popup(info_text=f"Saved to database")
+        if not confirm_commit_popup(self):
+            return
+
+        # Save in the background. Saves are never superseded, so each one gets its own request.
+        self.db_executor.submit(
+            None,
+            save_report, cnx, report_export,
+            on_success=lambda report_id: save_info_popup(
+                info_text="Saved to database" if report_id else "No changes since the last save"),
+            indicator=self.loading_indicator
+        )
 
     def create_scrollable(self, parent):
         """
@@ -750,19 +902,37 @@ class PageReportEditing(ttk.Frame):
 
     def fetch(self, cnx, report_labels, report_entries):
         """
-        Fetch patient details and fill the report.
+        Fetch patient details, and the feeding plan from their latest saved report, and fill the report.
+        The report is generated in the background, and the fields are filled in by fill_fetched_report().
         
         Parameters:
             - cnx: Database connection
             - report_labels: Dictionary of Tkinter label widgets
             - report_entries: Dictionary of Tkinter entry widgets
-        
+        """
+        mrn = report_entries["header"]["MRN"].get()
+
+        self.db_executor.submit(
+            "fetch",
+            generate_report, cnx, mrn,
+            on_success=lambda report: self.fill_fetched_report(report, report_labels, report_entries),
+            indicator=self.loading_indicator
+        )
+
+    def fill_fetched_report(self, report, report_labels, report_entries):
+        """
+        Fills the report fields with a generated report, and recalculates the age. Called by fetch().
+
+        Parameters:
+            - report: dict, as given by generate_report()
+            - report_labels: Dictionary of Tkinter label widgets
+            - report_entries: Dictionary of Tkinter entry widgets
+
         Returns:
             - dict: The filled report.
         """
         try:
-            # Fetch the MRN and generate the report
-            report = fill_report(cnx, report_labels, report_entries)
+            fill_report_fields(report, report_labels, report_entries)
 
             # Validate and parse the current_date field
             current_date = report_entries["header"]["current_date"].get().strip()
@@ -792,7 +962,7 @@ class PageReportEditing(ttk.Frame):
         except ValueError as e:
             # Display an error message for invalid date formats or missing dates
             messagebox.showerror("Invalid Input", str(e))
-            print(f"Error: {e}")
+            logger.warning("Error: %s", e)
 
 
     def get_report_input(self, cnx, report_labels, report_entries):
@@ -877,6 +1047,344 @@ class PageSettings(ttk.Frame):
         ttk.Button(self, text="Cancel", command=lambda: fill_settings(settings_entries)).pack()
         ttk.Button(self, text="Apply", command=lambda: apply_settings(settings_entries)).pack()
 
+class LoadingIndicator(ttk.Label):
+    """
+    A label that shows "Loading..." while at least one background request is running.
+    """
+    def __init__(self, parent, text="Loading..."):
+        super().__init__(parent, text="", foreground="gray")
+        self.loading_text = text
+        self.pending = 0
+
+    def start(self):
+        self.pending += 1
+        self.config(text=self.loading_text)
+
+    def stop(self):
+        self.pending = max(self.pending - 1, 0)
+        if self.pending == 0 and self.winfo_exists():
+            self.config(text="")
+
+class TableGridWindow(tk.Toplevel):
+    """
+    A window for browsing a whole table, one page at a time. Only the rows on screen are fetched
+    (with db_interface.read_page()), so large tables open and scroll as quickly as small ones.
+    Click a column heading to sort by it, and type in the filter box to filter the rows. Both are done by the database.
+    """
+    def __init__(self, parent, cnx, db_executor, table_name, on_open=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        * Parameters:
+            * parent: The window that opened this one
+            * cnx: the connection to the database
+            * db_executor: The DatabaseExecutor that runs the queries
+            * table_name: The table to show
+            * on_open: Called with (table_name, row) when a row is double-clicked
+            * page_size: Rows per page, which is also the number of rows shown
+        """
+        super().__init__(parent)
+        self.cnx = cnx
+        self.db_executor = db_executor
+        self.table_name = table_name
+        self.on_open = on_open
+        self.page_size = page_size
+        self.request_key = ("grid", id(self))
+        self.filter_job = None
+
+        self.columns = get_table_columns(cnx, table_name)
+        self.sort_by = None
+        self.descending = False
+        self.page = None
+        self.page_start = 0  # position of the first row on the page, for the status text
+        self.has_previous = False
+        self.has_next = False
+
+        self.title(f"{table_name} - SuppliCore")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        # Filter
+        filter_frame = ttk.Frame(self)
+        filter_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
+        ttk.Label(filter_frame, text="Filter:").pack(side="left", padx=5)
+        self.filter_column = ttk.Combobox(filter_frame, state="readonly", values=[column.Field for column in self.columns])
+        self.filter_column.set(self.columns[0].Field)
+        self.filter_column.pack(side="left", padx=5)
+        self.filter_column.bind("<<ComboboxSelected>>", lambda event: self.load_first_page())
+        self.filter_entry = ttk.Entry(filter_frame)
+        self.filter_entry.pack(side="left", padx=5)
+        self.filter_entry.bind("<KeyRelease>", self.on_filter_typed)
+        ttk.Button(filter_frame, text="Clear", command=self.clear_filter).pack(side="left", padx=5)
+        self.loading_indicator = LoadingIndicator(filter_frame)
+        self.loading_indicator.pack(side="left", padx=10)
+
+        # Grid. Only NOT NULL columns can be sorted by, since keyset pages can't step over empty values.
+        grid_frame = ttk.Frame(self)
+        grid_frame.grid(row=1, column=0, sticky="nsew", padx=10)
+        self.tree = ttk.Treeview(grid_frame, columns=[column.Field for column in self.columns],
+                                 show="headings", height=page_size)
+        for column in self.columns:
+            sortable = column.Null == "NO"
+            self.tree.heading(column.Field, text=column.Field,
+                              command=(lambda field=column.Field: self.sort(field)) if sortable else "")
+            self.tree.column(column.Field, anchor=tk.W, width=120, stretch=True)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(grid_frame, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=scrollbar.set)
+        scrollbar.pack(side="bottom", fill="x")
+
+        self.tree.bind("<Double-1>", self.on_row_opened)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.previous_page())
+        self.tree.bind("<Button-5>", lambda event: self.next_page())
+        self.bind("<Next>", lambda event: self.next_page())
+        self.bind("<Prior>", lambda event: self.previous_page())
+
+        # Paging
+        page_frame = ttk.Frame(self)
+        page_frame.grid(row=2, column=0, pady=10)
+        self.first_button = ttk.Button(page_frame, text="<< First", command=self.load_first_page)
+        self.previous_button = ttk.Button(page_frame, text="< Previous", command=self.previous_page)
+        self.status_label = ttk.Label(page_frame, text="")
+        self.next_button = ttk.Button(page_frame, text="Next >", command=self.next_page)
+        for widget in (self.first_button, self.previous_button, self.status_label, self.next_button):
+            widget.pack(side="left", padx=5)
+
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.load_first_page()
+
+    def load_first_page(self):
+        self.page_start = 0
+        self.request_page(on_loaded=lambda page: self.show_page(page, has_previous=False, has_next=page.has_more))
+
+    def next_page(self):
+        if not self.has_next or self.page is None:
+            return
+        self.page_start += len(self.page.rows)
+        self.request_page(after=self.page.last_key,
+                          on_loaded=lambda page: self.show_page(page, has_previous=True, has_next=page.has_more))
+
+    def previous_page(self):
+        if not self.has_previous or self.page is None:
+            return
+        self.page_start = max(self.page_start - self.page_size, 0)
+        self.request_page(before=self.page.first_key,
+                          on_loaded=lambda page: self.show_page(page, has_previous=page.has_more, has_next=True))
+
+    def request_page(self, on_loaded, after=None, before=None):
+        """
+        Fetches a page in the background. A newer request replaces this one.
+        """
+        self.db_executor.submit(
+            self.request_key,
+            read_page, self.cnx, self.table_name,
+            sort_by=self.sort_by, descending=self.descending,
+            filter_column=self.filter_column.get(), filter_value=self.filter_entry.get(),
+            after=after, before=before, limit=self.page_size,
+            on_success=on_loaded,
+            on_error=lambda error: self.status_label.config(text=f"Error: {error}"),
+            indicator=self.loading_indicator
+        )
+
+    def show_page(self, page, has_previous, has_next):
+        """
+        Replaces the rows in the grid with a page. Called with the result of request_page().
+        """
+        if not self.winfo_exists():
+            return
+
+        self.page = page
+        self.has_previous = has_previous
+        self.has_next = has_next
+
+        self.tree.delete(*self.tree.get_children())
+        for row in page.rows:
+            self.tree.insert("", "end", values=[_grid_text(value) for value in row])
+
+        if page.rows:
+            self.status_label.config(text=f"Rows {self.page_start + 1}-{self.page_start + len(page.rows)}")
+        else:
+            self.status_label.config(text="No rows")
+        self.first_button["state"] = "normal" if has_previous else "disabled"
+        self.previous_button["state"] = "normal" if has_previous else "disabled"
+        self.next_button["state"] = "normal" if has_next else "disabled"
+
+    def sort(self, column_name):
+        """
+        Sorts by a column, or reverses the order if it's already sorted by it.
+        """
+        if self.sort_by == column_name:
+            self.descending = not self.descending
+        else:
+            self.sort_by = column_name
+            self.descending = False
+
+        for column in self.columns:
+            arrow = (" \u25bc" if self.descending else " \u25b2") if column.Field == self.sort_by else ""
+            self.tree.heading(column.Field, text=column.Field + arrow)
+
+        self.load_first_page()
+
+    def on_filter_typed(self, event):
+        """
+        Filters once typing pauses for SEARCH_DELAY_MS.
+        """
+        if self.filter_job is not None:
+            self.after_cancel(self.filter_job)
+        self.filter_job = self.after(SEARCH_DELAY_MS, self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_job = None
+        self.load_first_page()
+
+    def clear_filter(self):
+        self.filter_entry.delete(0, "end")
+        self.load_first_page()
+
+    def on_mousewheel(self, event):
+        if event.delta < 0:
+            self.next_page()
+        elif event.delta > 0:
+            self.previous_page()
+
+    def on_row_opened(self, event):
+        item = self.tree.identify_row(event.y)
+        if not item or self.on_open is None or self.page is None:
+            return
+        self.on_open(self.table_name, self.page.rows[self.tree.index(item)])
+
+    def close(self):
+        if self.filter_job is not None:
+            self.after_cancel(self.filter_job)
+        self.db_executor.cancel(self.request_key)
+        self.destroy()
+
+class DatabaseExecutor:
+    """
+    Runs database calls on a background thread pool, so the window stays responsive while they run.
+    Results are handed back on the Tk main thread by polling with after(), since Tk widgets
+    can only be used from the main thread.
+
+    Requests are grouped by key. Submitting a request cancels any earlier request with the
+    same key, and results of superseded requests are dropped.
+    """
+    def __init__(self, root, max_workers=4, poll_interval=50):
+        """
+        * Parameters:
+            * root: The Tk window, used to schedule polling
+            * max_workers: The number of database calls that can run at once
+            * poll_interval: Milliseconds between checks for finished calls
+        """
+        self.root = root
+        self.poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._results = queue.Queue()
+        self._requests = {}  # key -> (request id, future, indicator) of the latest request
+        self._next_id = 0
+        self._closed = False
+
+        self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, key, func, *args, on_success=None, on_error=None, indicator=None, **kwargs):
+        """
+        Runs func(*args, **kwargs) in the background.
+        * Parameters:
+            * key: Identifies the kind of request, e.g. "entries". A new request replaces the
+                pending one with the same key. None means the request is never replaced.
+            * func: The function to run
+            * on_success: Called on the main thread with func's return value
+            * on_error: Called on the main thread with the exception if func raises
+                (default: show an error popup)
+            * indicator: A LoadingIndicator to show while the request is running
+        * Returns:
+            * int: The request id
+        """
+        if self._closed:
+            return None
+
+        self._next_id += 1
+        request_id = self._next_id
+        if key is None:
+            key = ("unique", request_id)
+
+        self.cancel(key)
+
+        if indicator:
+            indicator.start()
+
+        callbacks = (on_success, on_error, indicator)
+        future = self._pool.submit(self._run, key, request_id, func, args, kwargs, callbacks)
+        self._requests[key] = (request_id, future, indicator)
+
+        return request_id
+
+    def cancel(self, key):
+        """
+        Cancels the pending request with this key. A call that already started still runs,
+        but its result is dropped.
+        """
+        request = self._requests.pop(key, None)
+        if request is None:
+            return
+
+        _, future, indicator = request
+        future.cancel()
+        if indicator:
+            indicator.stop()
+
+    def shutdown(self):
+        """
+        Stops accepting requests and drops any that haven't started.
+        """
+        self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, key, request_id, func, args, kwargs, callbacks):
+        """
+        Runs on a worker thread. Queues the outcome for _poll().
+        """
+        try:
+            result = func(*args, **kwargs)
+            self._results.put((key, request_id, result, None, callbacks))
+        except Exception as e:
+            self._results.put((key, request_id, None, e, callbacks))
+
+    def _poll(self):
+        """
+        Runs on the main thread. Delivers finished results, then schedules the next check.
+        """
+        if self._closed:
+            return
+
+        while True:
+            try:
+                key, request_id, result, error, callbacks = self._results.get_nowait()
+            except queue.Empty:
+                break
+
+            # Drop results of requests that were superseded or cancelled
+            request = self._requests.get(key)
+            if request is None or request[0] != request_id:
+                continue
+            del self._requests[key]
+
+            on_success, on_error, indicator = callbacks
+            if indicator:
+                indicator.stop()
+
+            try:
+                if error is not None:
+                    logger.error("Error during database request: %s", error)
+                    if on_error:
+                        on_error(error)
+                    else:
+                        messagebox.showerror("Database Error", str(error))
+                elif on_success:
+                    on_success(result)
+            except Exception as e:
+                logger.exception("Error handling database result: %s", e)
+
+        self.root.after(self.poll_interval, self._poll)
+
 # Functions --------------------
 
 def pack_common_buttons(page, controller):
@@ -899,6 +1407,26 @@ def pack_common_buttons(page, controller):
     for button in common_buttons.values():
         button.pack(anchor=tk.NW, side="left", padx=5, pady=10)
 
+def format_entry_list(entries):
+    """
+    Converts a table's entries into the "ID | name" strings shown in the entries combobox.
+    * Parameters:
+        * entries: list of rows, with the ID first and the name second
+    * Returns:
+        * list of str
+    """
+    # Assuming the first column is MRN and the second column is the first name
+    return [f"{row[0]} | {row[1]}" for row in entries]
+
+def _grid_text(value, max_length=100):
+    """
+    Formats a value for a grid cell, shortening long text such as JSON.
+    """
+    if value is None:
+        return ""
+    text = str(value)
+    return text if len(text) <= max_length else text[:max_length - 3] + "..."
+
 def pack_recursive(section, report_labels, report_entries):
     """
     Recursively pack the labels and entries from the dictionary, regardless of depth.
@@ -1031,6 +1559,20 @@ def fill_report(cnx, report_labels, report_entries):
     mrn = report_entries["header"]["MRN"].get()
     patient_report = generate_report(cnx, mrn)
 
+    return fill_report_fields(patient_report, report_labels, report_entries)
+
+def fill_report_fields(patient_report, report_labels, report_entries):
+    """
+    Fills report entries and labels with the values of a generated report.
+
+    Parameters:
+        - patient_report: dict, as given by generate_report()
+        - report_labels: Dictionary of Tkinter label widgets
+        - report_entries: Dictionary of Tkinter entry widgets
+
+    Returns:
+        - dict: The report
+    """
     # Fill header fields
     for field in ["name", "DOB", "sex", "weight_kg"]:
         report_entries["header"][field].delete(0, "end")
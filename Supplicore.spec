@@ -5,7 +5,7 @@ a = Analysis(
     ['app.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('db_setup_sqlite.sql', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
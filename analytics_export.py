@@ -0,0 +1,412 @@
+"""
+analytics_export.py
+Exports the Reports and Patients tables as columnar snapshots (Parquet or Arrow IPC files) in analytics/, for analysis with pandas or any Arrow reader.
+
+Each report is flattened into typed columns: the date, weight and calculations come from the Reports table's indexed columns,
+and the rest (name, sex, DOB, age, feeding, fluids and solids) from the report itself, with deltas and compressed reports
+rebuilt first (see report_history.py and report_codec.py). Reports are partitioned by report date, one folder per month
+(or per day), in the layout pandas, pyarrow and DuckDB read as one dataset:
+    analytics/reports/report_month=2024-06/part-0000012345.parquet
+    analytics/patients.parquet
+    analytics/snapshot_state.json
+
+Reports are only ever added to the Reports table, so each run after the first only appends the reports saved since the last one
+(the last exported Reports_id is kept in snapshot_state.json). The Patients snapshot is written whole every run.
+Every file is written under a temporary name and then renamed, and the state is saved last, so a stopped export
+is simply done again by the next run. Use --full to start over, e.g. after reports were deleted.
+
+Examples:
+$> python analytics_export.py
+$> python analytics_export.py --format arrow --partition day --out-dir nightly_analytics
+$> python analytics_export.py --full --sqlite scale_test.db
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+from db_interface import start_database, close_database, load_config, read_iter, get_table_info, DEFAULT_CHUNK_SIZE
+from db_instrumentation import setup_logging
+from report_history import rebuild_reports
+from bulk_io import INTEGER_TYPES, FLOAT_TYPES, DATETIME_TYPES, BLOB_TYPES
+from app import write_report_file, date_format
+
+# import pyarrow as pa # imported in the functions that write or read snapshots
+
+SNAPSHOT_DIR = "analytics"
+STATE_FILE = "snapshot_state.json"
+
+# Parquet is smaller on disk; Arrow IPC files are uncompressed, so they are read memory-mapped without being decoded
+FILE_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+# Partition column and folder name format, for each partition size
+PARTITIONS = {"month": ("report_month", "%Y-%m"), "day": ("report_day", "%Y-%m-%d")}
+
+# Folder name for reports without a date, which readers turn back into null
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Reports buffered before they are written, so each partition gets a few large files instead of one per chunk
+ROWS_PER_FLUSH = 250000
+
+# Read as they are from Reports: already typed, and filled in for every revision
+REPORT_TABLE_COLUMNS = ("Reports_id", "MRN", "date", "report_date", "weight_kg", "Holliday_Segar_m", "Holliday_Segar_s",
+                        "WHO_REE")
+
+# The reports' columns in the snapshot, with their types
+REPORT_COLUMNS = (
+    ("Reports_id", "int"),
+    ("MRN", "int"),
+    ("date", "timestamp"),
+    ("report_date", "date"),
+    ("name", "text"),
+    ("sex", "text"),
+    ("DOB", "date"),
+    ("age", "int"),
+    ("age_unit", "text"),
+    ("weight_kg", "float"),
+    ("feeding_schedule", "text"),
+    ("method_of_delivery", "text"),
+    ("home_recipe", "text"),
+    ("fluids", "text"),
+    ("solids", "text"),
+    ("Holliday_Segar_m", "float"),
+    ("Holliday_Segar_s", "float"),
+    ("WHO_REE", "float"),
+)
+
+# "Age: 4 years" as saved from the report page
+_AGE = re.compile(r"(\d+)\s*([A-Za-z]+)")
+
+def export_snapshot(cnx, out_dir: str = SNAPSHOT_DIR, file_format: str = "parquet", partition: str = "month",
+                    full: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Appends the reports saved since the last snapshot to out_dir, and writes a new snapshot of the Patients table.
+    * Parameters:
+        * cnx - the connection to the database
+        * out_dir: str - the folder, made if it doesn't exist
+        * file_format: str - "parquet" or "arrow"
+        * partition: str - "month" or "day"
+        * full: bool - export every report again, instead of only the new ones
+        * chunk_size: int - rows read from the database at a time
+    * Returns:
+        * dict - the saved state: "format", "partition", "last_Reports_id", "reports" (in the snapshot), "patients",
+          and "appended", "files" for this run
+    * Raises:
+        * ValueError: if file_format or partition isn't known, or doesn't match the existing snapshot (use full)
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unknown format {file_format!r}; use one of {', '.join(FILE_FORMATS)}")
+    if partition not in PARTITIONS:
+        raise ValueError(f"Unknown partition {partition!r}; use one of {', '.join(PARTITIONS)}")
+
+    state = None if full else load_state(out_dir)
+    if state and (state["format"], state["partition"]) != (file_format, partition):
+        raise ValueError(f"The snapshot in {out_dir} is {state['format']} by {state['partition']}; "
+                         "use the same --format and --partition, or --full to start over")
+
+    reports_dir = os.path.join(out_dir, "reports")
+    if not state and os.path.isdir(reports_dir):
+        shutil.rmtree(reports_dir)
+
+    after_id = state["last_Reports_id"] if state else 0
+    appended, last_id, files = export_reports_snapshot(cnx, reports_dir, file_format, partition, after_id, chunk_size)
+    patients = export_patients_snapshot(cnx, os.path.join(out_dir, "patients" + FILE_FORMATS[file_format]), file_format,
+                                        chunk_size)
+
+    new_state = {
+        "format": file_format,
+        "partition": partition,
+        "last_Reports_id": last_id,
+        "reports": (state["reports"] if state else 0) + appended,
+        "patients": patients,
+    }
+    write_report_file(new_state, filename=os.path.join(out_dir, STATE_FILE))
+    return {**new_state, "appended": appended, "files": files}
+
+def export_reports_snapshot(cnx, reports_dir: str, file_format: str = "parquet", partition: str = "month",
+                            after_id: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Writes the reports after a Reports_id to partitioned files in reports_dir, flattened by report_table().
+    Files are named after the first Reports_id in them, so running it again after a stop replaces the same files.
+    * Parameters:
+        * reports_dir: str - the folder, made if it doesn't exist
+        * after_id: int - only reports with a larger Reports_id are written
+        * the rest as in export_snapshot()
+    * Returns:
+        * int - the number of reports written
+        * int - the largest Reports_id written (after_id if there were none)
+        * int - the number of files written
+    """
+    import pyarrow as pa
+
+    select = ", ".join(REPORT_TABLE_COLUMNS + ("snapshot_id", "report", "report_data"))
+    buffered = []
+    count = 0
+    files = 0
+    last_id = after_id
+    for rows in read_iter(cnx, "Reports", select=select, where="Reports_id > :after_id", params={"after_id": after_id},
+                          chunk_size=chunk_size, as_frame=False):
+        buffered.append(report_table(cnx, rows))
+        count += len(rows)
+        last_id = rows[-1][0]
+        if sum(len(table) for table in buffered) >= ROWS_PER_FLUSH:
+            files += _write_partitions(pa.concat_tables(buffered), reports_dir, file_format, partition)
+            buffered = []
+    if buffered:
+        files += _write_partitions(pa.concat_tables(buffered), reports_dir, file_format, partition)
+    return count, last_id, files
+
+def export_patients_snapshot(cnx, path: str, file_format: str = "parquet", chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Writes the whole Patients table to one file, a chunk at a time, with column types from the schema catalog.
+    * Parameters:
+        * path: str - the file, replaced when it's done
+        * the rest as in export_snapshot()
+    * Returns:
+        * int - the number of patients written
+    """
+    import threading
+    import pyarrow as pa
+
+    columns = get_table_info(cnx, "Patients")["columns"]
+    schema = pa.schema([(column.Field, _column_type(column)) for column in columns])
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    count = 0
+    try:
+        with _file_writer(temp_path, schema, file_format) as writer:
+            for rows in read_iter(cnx, "Patients", select=", ".join(schema.names), chunk_size=chunk_size, as_frame=False):
+                values = list(zip(*rows))
+                writer.write_table(pa.table([_array(values[i], field.type) for i, field in enumerate(schema)], schema=schema))
+                count += len(rows)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+def report_table(cnx, rows):
+    """
+    Flattens Reports rows into an Arrow table with the columns in REPORT_COLUMNS.
+    Values that can't be read (such as a misspelled DOB) are left null.
+    * Parameters:
+        * cnx - the connection to the database
+        * rows: list of tuples - REPORT_TABLE_COLUMNS, then snapshot_id, report and report_data
+    * Returns:
+        * pyarrow.Table
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    reports = rebuild_reports(cnx, [(row[0], *row[-3:]) for row in rows])
+    table_values = dict(zip(REPORT_TABLE_COLUMNS, zip(*rows)))
+
+    ages = [_AGE.search(str(report.get("age") or "")) for report in reports]
+    values = {
+        "age": [int(match.group(1)) if match else None for match in ages],
+        "age_unit": [match.group(2) if match else None for match in ages],
+    }
+    for name, kind in REPORT_COLUMNS:
+        if name not in table_values and name not in values:
+            values[name] = [_text(report.get(name)) for report in reports]
+
+    arrays = []
+    for name, kind in REPORT_COLUMNS:
+        if name in table_values:
+            arrays.append(_array(table_values[name], _arrow_type(kind)))
+        elif kind == "date":
+            dates = pc.strptime(pa.array(values[name], pa.string()), format=date_format, unit="s", error_is_null=True)
+            arrays.append(dates.cast(pa.date32()))
+        else:
+            arrays.append(pa.array(values[name], _arrow_type(kind)))
+    return pa.table(arrays, names=[name for name, kind in REPORT_COLUMNS])
+
+def read_snapshot(out_dir: str = SNAPSHOT_DIR, table: str = "reports", columns: list = None, filter=None,
+                  as_frame: bool = True):
+    """
+    Reads a snapshot written by export_snapshot(). Files are memory-mapped, and only the columns and partitions asked for
+    are read, e.g. read_snapshot(columns=["MRN", "WHO_REE"], filter=pc.field("report_month") >= "2024-01").
+    * Parameters:
+        * out_dir: str - the snapshot's folder
+        * table: str - "reports" or "patients"
+        * columns: list of str - the columns to read (default: all of them)
+        * filter: pyarrow.compute.Expression - only read the rows it matches
+        * as_frame: bool - return a pandas DataFrame if True, otherwise a pyarrow.Table
+    * Returns:
+        * DataFrame or pyarrow.Table
+    * Raises:
+        * ValueError: if table isn't known, or there is no snapshot in out_dir
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+
+    if table not in ("reports", "patients"):
+        raise ValueError(f"Unknown table {table!r}; use reports or patients")
+    state = load_state(out_dir)
+    if not state:
+        raise ValueError(f"There is no snapshot in {out_dir}; run analytics_export.py first")
+
+    file_format = state["format"]
+    filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+    dataset_format = "ipc" if file_format == "arrow" else file_format
+    if table == "patients":
+        dataset = ds.dataset(os.path.abspath(os.path.join(out_dir, "patients" + FILE_FORMATS[file_format])),
+                             format=dataset_format, filesystem=filesystem)
+    else:
+        reports_dir = os.path.abspath(os.path.join(out_dir, "reports"))
+        if not os.path.isdir(reports_dir):
+            return _empty_reports(as_frame)
+        partition_column = PARTITIONS[state["partition"]][0]
+        partitioning = ds.partitioning(pa.schema([(partition_column, pa.string())]), flavor="hive")
+        dataset = ds.dataset(reports_dir, format=dataset_format, partitioning=partitioning, filesystem=filesystem,
+                             exclude_invalid_files=False)
+
+    result = dataset.to_table(columns=columns, filter=filter)
+    return result.to_pandas(date_as_object=False) if as_frame else result
+
+def load_state(out_dir: str = SNAPSHOT_DIR):
+    """
+    Returns the state saved by the last export_snapshot() to out_dir, or None if there isn't one.
+    """
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def _write_partitions(table, reports_dir, file_format, partition):
+    """
+    Writes table to one file per partition, named after the table's first Reports_id. Returns the number of files written.
+    """
+    import threading
+    import pyarrow.compute as pc
+
+    partition_column, folder_format = PARTITIONS[partition]
+    first_id = pc.min(table["Reports_id"]).as_py()
+    keys = pc.fill_null(pc.strftime(table["report_date"], format=folder_format), NULL_PARTITION)
+    table = table.append_column("_partition", keys).sort_by([("_partition", "ascending"), ("Reports_id", "ascending")])
+
+    files = 0
+    offset = 0
+    # value_counts() keeps the order the partitions first appear in, which is sorted here
+    for counts in pc.value_counts(table["_partition"]):
+        key = counts["values"].as_py()
+        length = counts["counts"].as_py()
+        folder = os.path.join(reports_dir, f"{partition_column}={key}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"part-{first_id:010d}{FILE_FORMATS[file_format]}")
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        part = table.slice(offset, length).drop_columns(["_partition"])
+        try:
+            with _file_writer(temp_path, part.schema, file_format) as writer:
+                writer.write_table(part)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        offset += length
+        files += 1
+    return files
+
+def _file_writer(path, schema, file_format):
+    """
+    Returns a writer for one Parquet or Arrow IPC file, to be used with "with".
+    """
+    if file_format == "arrow":
+        import pyarrow as pa
+        return pa.ipc.new_file(path, schema)
+    import pyarrow.parquet as pq
+    return pq.ParquetWriter(path, schema)
+
+def _empty_reports(as_frame):
+    """
+    Returns a snapshot of no reports, for a snapshot made before any reports were saved.
+    """
+    import pyarrow as pa
+    table = pa.table({name: pa.array([], _arrow_type(kind)) for name, kind in REPORT_COLUMNS})
+    return table.to_pandas(date_as_object=False) if as_frame else table
+
+def _array(values, arrow_type):
+    """
+    Returns an Arrow array of values from the database. Values Arrow doesn't convert directly
+    (such as dates SQLite returns as text, or MySQL DECIMALs) are converted to arrow_type with a cast.
+    """
+    import pyarrow as pa
+    try:
+        return pa.array(values, arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(values).cast(arrow_type)
+
+def _arrow_type(kind):
+    import pyarrow as pa
+    return {"int": pa.int64(), "float": pa.float64(), "date": pa.date32(), "timestamp": pa.timestamp("us"),
+            "text": pa.string(), "binary": pa.binary()}[kind]
+
+def _column_type(column):
+    """
+    Returns the Arrow type of a column in the schema catalog.
+    """
+    if column.data_type in INTEGER_TYPES:
+        return _arrow_type("int")
+    if column.data_type in FLOAT_TYPES:
+        return _arrow_type("float")
+    if column.data_type == "date":
+        return _arrow_type("date")
+    if column.data_type in DATETIME_TYPES:
+        return _arrow_type("timestamp")
+    if column.data_type in BLOB_TYPES:
+        return _arrow_type("binary")
+    return _arrow_type("text")
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export SuppliCore reports and patients as Parquet or Arrow snapshots.")
+    parser.add_argument("--out-dir", default=SNAPSHOT_DIR, help=f"the snapshot's folder (default: {SNAPSHOT_DIR})")
+    parser.add_argument("--format", choices=FILE_FORMATS, default="parquet", help="file format (default: parquet)")
+    parser.add_argument("--partition", choices=PARTITIONS, default="month",
+                        help="a folder of reports per month or per day of report date (default: month)")
+    parser.add_argument("--full", action="store_true", help="export every report again, instead of only the new ones")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite database at PATH instead of config.json")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"rows read from the database at a time (default: {DEFAULT_CHUNK_SIZE})")
+    args = parser.parse_args(argv)
+
+    setup_logging("WARNING")
+
+    config = {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1} if args.sqlite else load_config()
+    if not config:
+        parser.error("config.json couldn't be loaded; use --sqlite to pick a SQLite database")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database", file=sys.stderr)
+        return 1
+
+    try:
+        start = time.perf_counter()
+        state = export_snapshot(cnx, args.out_dir, args.format, args.partition, args.full, args.chunk_size)
+        seconds = time.perf_counter() - start
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    finally:
+        close_database(cnx)
+
+    print(f"Appended {state['appended']} reports in {state['files']} files ({state['reports']} in the snapshot, "
+          f"up to Reports_id {state['last_Reports_id']}) and {state['patients']} patients to {args.out_dir} "
+          f"in {seconds:.1f} s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
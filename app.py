@@ -10,14 +10,75 @@ $> pip install mysql-connector-python --upgrade
 
 
 """
+import time
+_startup_start = time.perf_counter()  # start of the --startup-profile timeline
+
 from db_interface import *
+from db_instrumentation import setup_logging
+from report_history import get_latest_reports
 #from GUI import MultiPageApp # imported in main
 import datetime as dt
 from datetime import datetime
+from itertools import islice
+import logging
+import os
 import sys
 
+_imports_done = time.perf_counter()
+
 date_format = "%Y-%m-%d"
 
+# The folder reports are saved to as JSON files
+REPORT_DIR = "report_out"
+
+# Fields filled in from the patient's latest saved report when a new report is made
+CARRIED_FIELDS = ("feeding_schedule", "method_of_delivery", "home_recipe", "fluids", "solids")
+
+logger = logging.getLogger("supplicore.app")
+
+class StartupTimeline:
+    """
+    Records how long each phase of startup takes. Enabled by running "python app.py --startup-profile".
+    "--startup-profile=MS" also warns if startup takes longer than MS milliseconds.
+    """
+    def __init__(self, budget_ms=None):
+        self.start = _startup_start
+        self.last = _startup_start
+        self.phases = []
+        self.budget_ms = budget_ms
+
+    def mark(self, phase, at=None):
+        """
+        Ends a phase, timing it from the end of the previous one.
+        * Parameters:
+            * phase: str - the name shown in the report
+            * at: float - the time.perf_counter() value the phase ended at (default: now)
+        """
+        now = at if at is not None else time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+
+    def total_ms(self):
+        return (self.last - self.start) * 1000
+
+    def report(self):
+        """
+        Prints the time taken by each phase to stdout, as a table that can be saved with a redirect
+        (the profile is only made when asked for), and logs whether startup was within budget.
+        """
+        print("Startup profile:")
+        elapsed = 0.0
+        for phase, duration in self.phases:
+            elapsed += duration
+            print(f"  {phase:<28} {duration:9.1f} ms  (at {elapsed:9.1f} ms)")
+        print(f"  {'total':<28} {self.total_ms():9.1f} ms")
+
+        if self.budget_ms is not None:
+            if self.total_ms() > self.budget_ms:
+                logger.warning("Startup took %.1f ms, over the budget of %.0f ms", self.total_ms(), self.budget_ms)
+            else:
+                logger.info("Startup is within the budget of %.0f ms", self.budget_ms)
+
 def test_fill(cnx):
     """
     fills the database with test data. For testing purposes only.
@@ -46,58 +107,191 @@ def test_fill(cnx):
     cnx.commit()
 
 def main():
-    from GUI import MultiPageApp
     import os
     import sys
 
-    try:
-        # Load config (login information)
-        if not os.path.exists("config.json"):
-            raise FileNotFoundError("config.json not found. Using default configuration.")
-        config = load_config()
-        print("Config loaded")
+    # --startup-profile[=budget_ms] prints how long each phase of startup took
+    timeline = None
+    profile_arg = next((arg for arg in sys.argv[1:] if arg.startswith("--startup-profile")), None)
+    if profile_arg:
+        budget = profile_arg.partition("=")[2]
+        timeline = StartupTimeline(float(budget) if budget else None)
+        timeline.mark("import app", at=_imports_done)
+
+    # Load config (login information). Without it, the GUI runs in limited mode, with no database.
+    config = load_config() if os.path.exists("config.json") else None
+    if timeline:
+        timeline.mark("load config")
+
+    # Log messages go to the console, through a background thread
+    setup_logging((config or {}).get("log_level", "INFO"))
+    if config is None:
+        logger.warning("config.json not found or not readable. Running in limited mode.")
+    else:
+        logger.info("Config loaded")
 
+    from GUI import MultiPageApp
+    if timeline:
+        timeline.mark("import GUI")
+
+    try:
         # Start database
-        try:
-            cnx = start_database(config)
-            print("Database started")
-        except Exception as db_error:
-            print(f"Database connection failed: {db_error}")
-            cnx = None  # Proceed with no database connection
-        
+        cnx = None
+        if config is not None:
+            try:
+                cnx = start_database(config)
+            except Exception as db_error:
+                logger.error("Database connection failed: %s", db_error)
+            if cnx:
+                logger.info("Database started")
+            if timeline:
+                timeline.mark("start database")
+
         # Open GUI
-        print("Starting GUI...")
-        app = MultiPageApp(cnx)  # Ensure MultiPageApp can handle cnx=None
+        logger.info("Starting GUI...")
+        app = MultiPageApp(cnx, timeline)  # MultiPageApp handles cnx=None
+        report_startup(app, timeline)
         app.mainloop()
-        
+
         # Close database if connected
         if cnx:
             close_database(cnx)
-            print("Database closed")
-    except FileNotFoundError as fnf_error:
-        print(f"Error: {fnf_error}")
-        print("Running in limited mode.")
-        # Add logic for GUI in limited mode
-        app = MultiPageApp(None)  # Initialize GUI without a database connection
-        app.mainloop()
+            logger.info("Database closed")
     except Exception as e:
-        print(f"Unhandled error: {e}")
+        logger.exception("Unhandled error: %s", e)
         input("Press Enter to exit...")
         sys.exit(1)
 
     # End program
-    print("TERMINATED")
+    logger.info("TERMINATED")
+
+def report_startup(app, timeline):
+    """
+    Finishes the startup timeline once the window has been drawn, and prints it.
+    Does nothing unless --startup-profile was given.
+    * Parameters:
+           * app - the MultiPageApp
+           * timeline - StartupTimeline, or None
+    """
+    if not timeline:
+        return
+
+    timeline.mark("build main window")
+    app.update_idletasks()
+    timeline.mark("first draw")
+    timeline.report()
     
 def generate_report(cnx, patient_MRN: int):
     """
-    creates a report
+    creates a report, with the feeding plan from the patient's latest saved report (see carry_over())
     * Parameters:
            * cnx - the connection to the database
            * patient_MRN: int - The MRN, used to identify the patient
     * Returns: 
            * report: dict
     """
-    report = {
+    report = empty_report()
+
+    # Import patient data
+    patient_data = fetch_one(cnx, "Patients", where="MRN = :MRN", params={"MRN": patient_MRN})
+    if patient_data is None:
+        raise ValueError(f"No patient found with MRN {patient_MRN}")
+
+    # Fill report with known data
+    report["header"]["MRN"] = patient_data.MRN
+    report["header"]["sex"] = patient_data.sex
+    report["header"]["weight_kg"] = patient_data.weight_kg
+    report["header"]["DOB"] = patient_data.DOB.strftime(date_format)
+    report["header"]["name"] = f"{patient_data.l_name}, {patient_data.f_name}"
+    carry_over(report, get_latest_reports(cnx, [patient_data.MRN]).get(patient_data.MRN))
+
+    # Current date and age
+    report["header"]["current_date"] = datetime.now().strftime(date_format)
+    curr_date = dt.datetime.strptime(report["header"]["current_date"], date_format)
+    DOB = dt.datetime.strptime(report["header"]["DOB"], date_format)
+    age_dict = calculate_age(DOB, curr_date)
+    report["header"]["age_unit"] = age_dict["age_unit"]
+    report["header"]["age"] = age_dict["age"]
+
+    apply_calculations(report)
+
+    return report
+
+def generate_reports(cnx, patient_MRNs, chunk_size: int = DEFAULT_BATCH_SIZE, curr_date=None):
+    """
+    Creates reports for many patients, like generate_report(), with one query for the patients, one for
+    their latest reports, and one vectorized calculation per chunk of patients instead of one per patient. Reports are yielded as they are made,
+    in the order of patient_MRNs. MRNs with no patient are logged and skipped.
+    * Parameters:
+           * cnx - the connection to the database
+           * patient_MRNs: iterable of int - the MRNs, used to identify the patients
+           * chunk_size: int - patients fetched and calculated together
+           * curr_date: date - the date the reports are for (default: today)
+    * Returns: 
+           * generator of report: dict
+    """
+    from calculations import calculate_ages, holliday_segar, who_ree # imported here, so NumPy doesn't slow down startup
+
+    curr_date = (curr_date or datetime.now()).strftime(date_format)
+    patient_MRNs = iter(patient_MRNs)
+
+    while True:
+        chunk = list(islice(patient_MRNs, chunk_size))
+        if not chunk:
+            return
+
+        patients_by_MRN = {patient.MRN: patient for patient in fetch_by_keys(cnx, "Patients", "MRN", set(chunk))}
+        patients = []
+        for MRN in chunk:
+            if MRN in patients_by_MRN:
+                patients.append(patients_by_MRN[MRN])
+            else:
+                logger.warning("No patient found with MRN %s", MRN)
+        if not patients:
+            continue
+        latest_reports = get_latest_reports(cnx, patients_by_MRN)
+
+        weights = [patient.weight_kg for patient in patients]
+        ages, age_units = calculate_ages([patient.DOB for patient in patients], dt.date.fromisoformat(curr_date))
+        maintenance, sick_day = holliday_segar(weights)
+        WHO_REE = who_ree(weights, [patient.sex for patient in patients], ages)
+
+        for i, patient in enumerate(patients):
+            report = empty_report()
+            report["header"]["MRN"] = patient.MRN
+            report["header"]["sex"] = patient.sex
+            report["header"]["weight_kg"] = patient.weight_kg
+            report["header"]["DOB"] = patient.DOB.strftime(date_format)
+            report["header"]["name"] = f"{patient.l_name}, {patient.f_name}"
+            report["header"]["current_date"] = curr_date
+            report["header"]["age"] = int(ages[i])
+            report["header"]["age_unit"] = str(age_units[i])
+            report["calculations"]["Holliday-Segar"]["maintenance"] = float(maintenance[i])
+            report["calculations"]["Holliday-Segar"]["sick_day"] = float(sick_day[i])
+            report["calculations"]["WHO_REE"] = float(WHO_REE[i])
+            carry_over(report, latest_reports.get(patient.MRN))
+            yield report
+
+def carry_over(report, latest_report):
+    """
+    Fills in the CARRIED_FIELDS of a new report from the patient's latest saved report, such as the feeding plan.
+    * Parameters:
+           * report: dict - as made by empty_report()
+           * latest_report: dict - as saved from the report page, or None if the patient has none
+    * Returns: none
+    """
+    if latest_report:
+        for key in CARRIED_FIELDS:
+            report["header"][key] = latest_report.get(key, "")
+
+def empty_report():
+    """
+    Returns a report with every field present and empty. Filled in by generate_report().
+    * Parameters: none
+    * Returns: 
+           * report: dict
+    """
+    return {
         "header": {
             "name": "",
             "sex": "",
@@ -127,25 +321,14 @@ def generate_report(cnx, patient_MRN: int):
         }
     }
 
-    # Import patient data, convert to dictionary
-    patient_data = read(cnx, "Patients", where=f"MRN = {patient_MRN}").to_dict()
-    for key in patient_data:
-        patient_data[key] = patient_data[key][0]
-
-    # Fill report with known data
-    for key in ["MRN", "DOB", "sex", "weight_kg"]:
-        report["header"][key] = patient_data[key]
-    report["header"]["DOB"] = dt.datetime.strftime(report["header"]["DOB"], date_format)
-    report["header"]["name"] = f"{patient_data['l_name']}, {patient_data['f_name']}"
-
-    # Current date and age
-    report["header"]["current_date"] = datetime.now().strftime(date_format)
-    curr_date = dt.datetime.strptime(report["header"]["current_date"], date_format)
-    DOB = dt.datetime.strptime(report["header"]["DOB"], date_format)
-    age_dict = calculate_age(DOB, curr_date)
-    report["header"]["age_unit"] = age_dict["age_unit"]
-    report["header"]["age"] = age_dict["age"]
-
+def apply_calculations(report: dict):
+    """
+    Fills in the report's calculations from its header (weight, sex and age). Called by generate_report().
+    * Parameters:
+           * report: dict - a report with its header filled in
+    * Returns: 
+           * report: dict - the same report
+    """
     # Holliday-Segar Formula
     weight = report["header"]["weight_kg"]
     if weight <= 10.0:
@@ -188,21 +371,76 @@ def save_report_JSON(report: dict):
     * Returns: None 
     """
     from GUI import save_info_popup
-    
-    try:
+
+    filename = write_report_file(report)
+
+    save_info_popup(info_text=f"Saved as {filename}")
+    logger.info("Saved as %s", filename)
+
+def save_report_PDF(report: dict):
+    """
+    Saves a report as a PDF file
+    * Parameters:
+           * report: dict - The report, as outputted by generate_report() or the report page
+    * Returns: None 
+    """
+    from GUI import save_info_popup
+    from report_pdf import render_report # imported here, so the PDF layout is only built when first used
+
+    filename = write_report_file(render_report(report), filename=report_filename(report, extension=".pdf"))
+
+    save_info_popup(info_text=f"Saved as {filename}")
+    logger.info("Saved as %s", filename)
+
+def report_filename(report: dict, out_dir: str = REPORT_DIR, extension: str = ".json"):
+    """
+    Returns the file a report is saved to: "<MRN>-(<date>).json" in out_dir.
+    * Parameters:
+           * report: dict - from generate_report(), or from the report page (PageReportEditing.get_report_input())
+           * out_dir: str - the folder
+           * extension: str - such as ".json" or ".pdf"
+    * Returns: 
+           * filename: str
+    """
+    if "header" in report:
         # if it comes from generate_report()
-        filename = f"report_out/{report['header']['MRN']}-({report['header']['current_date']}).json"
-    except:
+        name = f"{report['header']['MRN']}-({report['header']['current_date']}){extension}"
+    else:
         # if it comes from the GUI
-        filename = f"report_out/{report['MRN']}-({report['current_date']}).json"
-        print(report)
+        name = f"{report['MRN']}-({report['current_date']}){extension}"
+    return os.path.join(out_dir, name)
 
+def write_report_file(report, out_dir: str = REPORT_DIR, filename: str = None):
+    """
+    Writes a report to a file (JSON, unless it's given already rendered). The file is written under a temporary name and then renamed,
+    so a reader never sees a half-written report, even if the program stops partway through.
+    * Parameters:
+           * report: dict, or str of JSON already serialized, or bytes of a file already rendered (such as a PDF)
+           * out_dir: str - the folder, made if it doesn't exist
+           * filename: str - the file (default: report_filename())
+    * Returns: 
+           * filename: str
+    """
+    import threading
 
-    with open(filename, "w") as file: 
-        json.dump(report, file)
+    filename = filename or report_filename(report, out_dir)
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
 
-    save_info_popup(info_text=f"Saved as {filename}")
-    print(f"Saved as {filename}")
+    # Unique to this process and thread, so parallel writers never share a temporary file
+    temp_path = f"{filename}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb" if isinstance(report, bytes) else "w") as file:
+            if isinstance(report, (str, bytes)):
+                file.write(report)
+            else:
+                json.dump(report, file)
+        os.replace(temp_path, filename)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return filename
 
 def calculate_age(DOB: datetime, curr_date: datetime):
     """
@@ -212,7 +450,7 @@ def calculate_age(DOB: datetime, curr_date: datetime):
         * curr_date: datetime
     * Returns: 
            * dict
-                * age: float
+                * age: int
                 * age_unit: string
     """
     years = curr_date.year - DOB.year
@@ -239,6 +477,6 @@ if __name__ == "__main__":
     try:
         main()
     except Exception as e:
-        print(f"Unhandled error: {e}")
+        logger.exception("Unhandled error: %s", e)
         input("Press Enter to exit...")  # Keep the command window open after a crash
         sys.exit(1)
\ No newline at end of file
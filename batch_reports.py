@@ -0,0 +1,118 @@
+"""
+batch_reports.py
+Generates reports for many patients without the GUI, for nightly runs.
+
+MRNs are read one per line from a file, or from stdin when no file (or "-") is given.
+Blank lines and lines starting with "#" are skipped. Reports are written as JSON Lines,
+one report per line, to --output or to stdout.
+
+Examples:
+$> python batch_reports.py mrns.txt --output reports.jsonl
+$> python batch_reports.py --all --sqlite scale_test.db > reports.jsonl
+$> type mrns.txt | python batch_reports.py --date 2024-06-30
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+
+from db_interface import start_database, close_database, load_config, read_iter, DEFAULT_BATCH_SIZE
+from db_instrumentation import setup_logging
+from app import generate_reports
+
+def read_MRNs(lines):
+    """
+    Yields the MRNs in lines of text, one per line.
+    * Parameters:
+        * lines: iterable of str - such as an open file
+    * Returns:
+        * generator of int
+    * Raises:
+        * ValueError: if a line isn't an MRN
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield int(line)
+        except ValueError:
+            raise ValueError(f"Line {line_number} isn't an MRN: {line!r}") from None
+
+def all_MRNs(cnx):
+    """
+    Yields the MRN of every patient, streamed so that any number of patients uses constant memory.
+    """
+    for chunk in read_iter(cnx, "Patients", select="MRN", as_frame=False):
+        for row in chunk:
+            yield row[0]
+
+def write_reports(reports, output):
+    """
+    Writes reports to output as JSON Lines.
+    * Parameters:
+        * reports: iterable of dict - as made by generate_reports()
+        * output: a file open for writing text
+    * Returns:
+        * int - the number of reports written
+    """
+    count = 0
+    for report in reports:
+        output.write(json.dumps(report, default=str))
+        output.write("\n")
+        count += 1
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate SuppliCore reports for many patients as JSON Lines.")
+    parser.add_argument("mrn_file", nargs="?", default="-", help="file with one MRN per line (default: stdin)")
+    parser.add_argument("--all", action="store_true", help="generate a report for every patient")
+    parser.add_argument("--output", default="-", help="the .jsonl file the reports are written to (default: stdout)")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="the reports' date, as YYYY-MM-DD (default: today)")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite database at PATH instead of config.json")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"patients fetched and calculated together (default: {DEFAULT_BATCH_SIZE})")
+    args = parser.parse_args(argv)
+
+    # Log messages go to stderr, so they don't mix with reports written to stdout
+    setup_logging("WARNING")
+
+    config = {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1} if args.sqlite else load_config()
+    if not config:
+        parser.error("config.json couldn't be loaded; use --sqlite to pick a SQLite database")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database", file=sys.stderr)
+        return 1
+
+    mrn_file = None
+    output = None
+    try:
+        if args.all:
+            MRNs = all_MRNs(cnx)
+        else:
+            mrn_file = sys.stdin if args.mrn_file == "-" else open(args.mrn_file)
+            MRNs = read_MRNs(mrn_file)
+        output = sys.stdout if args.output == "-" else open(args.output, "w")
+
+        start = time.perf_counter()
+        count = write_reports(generate_reports(cnx, MRNs, args.chunk_size, args.date), output)
+        seconds = time.perf_counter() - start
+        print(f"Generated {count} reports in {seconds:.1f} s ({count / seconds if seconds else 0:.0f} reports/s)",
+              file=sys.stderr)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if mrn_file not in (None, sys.stdin):
+            mrn_file.close()
+        if output not in (None, sys.stdout):
+            output.close()
+        close_database(cnx)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""
+benchmark.py
+Benchmarks for report generation (one patient and batches), report rendering, compression and revisions, the CRUD functions, the entry search and the entry list formatting.
+
+Runs against a throwaway in-memory SQLite database by default, or against the database in config.json
+with --config. Rows made by the benchmarks are removed afterwards.
+
+Examples:
+$> python benchmark.py
+$> python benchmark.py --sizes 100,1000,10000 --save-baseline benchmark_baseline.json
+$> python benchmark.py --baseline benchmark_baseline.json --tolerance 0.25
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+from db_interface import (start_database, close_database, load_config, read, update, create_many, update_many,
+                          delete_many, fetch_all, fetch_one, search_entries)
+from db_instrumentation import export_metrics_json
+from app import generate_report, generate_reports, calculate_age
+
+# MRNs at and above this are made by the benchmarks, and are removed afterwards
+MRN_BASE = 900_000_000
+
+# Marks the rows made in tables without a known key, so they can be found and removed
+NAME_PREFIX = "benchmark-"
+
+# Percentage slower than the baseline allowed before a result counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+class BenchmarkRun:
+    """
+    Times benchmark functions and collects their results.
+    """
+    def __init__(self):
+        self.results = []
+
+    def measure(self, name, func, iterations, size=None, rows_per_call=1, calls_per_sample=1, warm_up=False):
+        """
+        Calls func(i) for i in range(iterations), timing each call.
+        * Parameters:
+            * name: str - the benchmark's name
+            * func: function taking the iteration number
+            * iterations: int - the number of timed calls
+            * size: int - the table size the benchmark ran at, if it depends on one
+            * rows_per_call: int - the rows handled by each call, for the rows/s figure
+            * calls_per_sample: int - calls timed together, for functions too fast to time one call at a time
+            * warm_up: bool - make one untimed call first (only for functions without side effects)
+        * Returns:
+            * dict - the benchmark's result
+        """
+        if warm_up:
+            func(0)
+
+        timings = []
+        for sample in range(iterations // calls_per_sample):
+            start = time.perf_counter()
+            for i in range(sample * calls_per_sample, (sample + 1) * calls_per_sample):
+                func(i)
+            timings.append((time.perf_counter() - start) / calls_per_sample)
+        iterations = len(timings) * calls_per_sample
+
+        total = sum(timings) * calls_per_sample
+        result = {
+            "name": name if size is None else f"{name}[{size}]",
+            "iterations": iterations,
+            "p50_ms": percentile(timings, 50) * 1000,
+            "p95_ms": percentile(timings, 95) * 1000,
+            "p99_ms": percentile(timings, 99) * 1000,
+            "mean_ms": total / iterations * 1000,
+            "ops_per_s": iterations / total if total else float("inf"),
+            "rows_per_s": iterations * rows_per_call / total if total else float("inf"),
+        }
+        self.results.append(result)
+        print_result(result)
+        return result
+
+    def to_dict(self, backend, label=None):
+        return {
+            "label": label or datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "backend": backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": {result["name"]: result for result in self.results},
+        }
+
+# Benchmarks ----------------------------
+def run_benchmarks(cnx, sizes, iterations, seed=0):
+    """
+    Runs every benchmark. The table sizes grow from smallest to largest, reusing the rows made for the smaller sizes.
+    * Parameters:
+        * cnx - the connection to the database
+        * sizes: list of int - the numbers of patients to benchmark read() and the formatting at
+        * iterations: int - the number of timed calls per benchmark
+        * seed: int - seed for the generated data, so runs are comparable
+    * Returns:
+        * BenchmarkRun
+    """
+    from GUI import format_entry_list
+
+    rng = random.Random(seed)
+    run = BenchmarkRun()
+
+    # calculate_age() on its own, over a spread of ages (days, months and years)
+    today = datetime.datetime(2024, 6, 15)
+    birth_dates = [today - datetime.timedelta(days=rng.randint(0, 365 * 18)) for _ in range(1000)]
+    run.measure("calculate_age", lambda i: calculate_age(birth_dates[i % len(birth_dates)], today),
+                iterations * 100, calls_per_sample=100)
+
+    # The vectorized calculations, over 100,000 patients per call
+    import numpy as np
+    from calculations import calculate_ages, holliday_segar, who_ree
+    cohort_DOB = np.datetime64("2024-06-15") - np.asarray([rng.randint(0, 365 * 18) for _ in range(100_000)])
+    cohort_weight = np.asarray([rng.uniform(2.0, 90.0) for _ in range(100_000)])
+    cohort_sex = np.asarray([rng.choice("MF") for _ in range(100_000)])
+
+    def calculate_cohort(i):
+        ages, _ = calculate_ages(cohort_DOB, today)
+        holliday_segar(cohort_weight)
+        who_ree(cohort_weight, cohort_sex, ages)
+
+    run.measure("calculate_cohort", calculate_cohort, max(iterations // 10, 5), rows_per_call=100_000, warm_up=True)
+
+    condition_id = _make_condition(cnx)
+    patient_count = 0
+
+    try:
+        # read() and the entry list formatting at each table size
+        for size in sorted(sizes):
+            create_many(cnx, "Patients", patient_rows(rng, patient_count, size - patient_count, condition_id))
+            patient_count = size
+
+            where = "MRN >= :low"
+            params = {"low": MRN_BASE}
+            read_iterations = max(3, min(iterations, 200_000 // size))
+            run.measure("read", lambda i: read(cnx, "Patients", where=where, params=params, use_cache=False),
+                        read_iterations, size=size, rows_per_call=size, warm_up=True)
+
+            entries = fetch_all(cnx, "Patients", select="MRN, f_name", where=where, params=params)
+            run.measure("format_entry_list", lambda i: format_entry_list(entries),
+                        read_iterations, size=size, rows_per_call=size, warm_up=True)
+
+            searches = [str(MRN_BASE + rng.randrange(size))[:6] if i % 2 else f"Last{rng.randrange(size)}"[:6]
+                        for i in range(iterations)]
+            run.measure("search_entries", lambda i: search_entries(cnx, "Patients", searches[i]),
+                        iterations, size=size, warm_up=True)
+
+        # generate_report() for random patients
+        mrns = [MRN_BASE + rng.randrange(patient_count) for _ in range(iterations)]
+        run.measure("generate_report", lambda i: generate_report(cnx, mrns[i]), iterations, warm_up=True)
+
+        # Rendering a generated report as a PDF, once the layout is cached
+        from report_pdf import render_report
+        pdf_reports = [generate_report(cnx, mrn) for mrn in mrns]
+        run.measure("render_report_pdf", lambda i: render_report(pdf_reports[i % len(pdf_reports)]),
+                    iterations * 10, calls_per_sample=10, warm_up=True)
+
+        # Compressing and decompressing a report, with a dictionary trained on the generated reports
+        from report_codec import ReportCodec, train_dictionary
+        codec = ReportCodec("zlib", train_dictionary(pdf_reports))
+        encoded_reports = [codec.encode(report) for report in pdf_reports]
+        run.measure("encode_report", lambda i: codec.encode(pdf_reports[i % len(pdf_reports)]),
+                    iterations * 10, calls_per_sample=10, warm_up=True)
+        run.measure("decode_report", lambda i: codec.decode(encoded_reports[i % len(encoded_reports)]),
+                    iterations * 10, calls_per_sample=10, warm_up=True)
+
+        # Saving a report from the report page with one field changed (mostly saved as a delta),
+        # and reading a patient's latest report
+        from report_history import save_report, get_latest_report
+        page_report = {"MRN": "", "name": "Last, First", "sex": "F", "DOB": "2020-01-01", "current_date": "2024-06-15",
+                       "age": "Age: 4 years", "weight_kg": "", "feeding_schedule": "Every 3 hours",
+                       "method_of_delivery": "PO", "home_recipe": "1 scoop formula in 60 mL water", "fluids": "Water",
+                       "solids": "Purees", "Holliday_Segar_m": "Maintenance: 1375.0",
+                       "Holliday_Segar_s": "Sick day: 2062.5", "WHO_REE": "WHO REE: 893.25"}
+        revision_mrns = mrns[:20]
+        run.measure("save_report",
+                    lambda i: save_report(cnx, dict(page_report, MRN=str(revision_mrns[i % len(revision_mrns)]),
+                                                    weight_kg=f"{15 + i / 100:.2f}")),
+                    iterations, warm_up=True)
+        run.measure("get_latest_report", lambda i: get_latest_report(cnx, revision_mrns[i % len(revision_mrns)]),
+                    iterations, warm_up=True)
+
+        # generate_reports() for a batch of random patients at a time
+        report_batch = 1000
+        batch_mrns = [[MRN_BASE + rng.randrange(patient_count) for _ in range(report_batch)]
+                      for _ in range(max(5, iterations // 10))]
+        run.measure("generate_reports", lambda i: list(generate_reports(cnx, batch_mrns[i])), len(batch_mrns),
+                    rows_per_call=report_batch, warm_up=True)
+
+        # Single-row and batched writes. create() and delete() ask for confirmation in a dialog,
+        # so single rows go through create_many() and delete_many(), which run the same statements.
+        batch_size = 100
+        batches = max(10, iterations // 10)
+
+        run.measure("create_single", lambda i: create_many(cnx, "Medications", [{"name": f"{NAME_PREFIX}single-{i}"}]),
+                    iterations)
+        run.measure("create_batched",
+                    lambda i: create_many(cnx, "Medications",
+                                          [{"name": f"{NAME_PREFIX}batch-{i}-{j}"} for j in range(batch_size)]),
+                    batches, rows_per_call=batch_size)
+
+        medication_ids = _benchmark_medication_ids(cnx)
+        rng.shuffle(medication_ids)
+
+        run.measure("update_single",
+                    lambda i: update(cnx, None, "Medications", medication_ids[i], {"name": f"{NAME_PREFIX}updated-{i}"}),
+                    iterations)
+        run.measure("update_batched",
+                    lambda i: update_many(cnx, "Medications",
+                                          [{"Medications_id": id, "name": f"{NAME_PREFIX}updated-{i}"}
+                                           for id in medication_ids[i * batch_size:(i + 1) * batch_size]]),
+                    batches, rows_per_call=batch_size)
+
+        single_ids = medication_ids[:iterations]
+        batched_ids = medication_ids[iterations:]
+        run.measure("delete_single", lambda i: delete_many(cnx, "Medications", [single_ids[i]]), iterations)
+        run.measure("delete_batched",
+                    lambda i: delete_many(cnx, "Medications", batched_ids[i * batch_size:(i + 1) * batch_size]),
+                    batches, rows_per_call=batch_size)
+    finally:
+        _clean_up(cnx, condition_id)
+
+    return run
+
+def patient_rows(rng, start, count, condition_id):
+    """
+    Makes count patient rows, with MRNs from MRN_BASE + start.
+    """
+    sexes = ("M", "F")
+    for i in range(start, start + count):
+        yield {
+            "MRN": MRN_BASE + i,
+            "f_name": f"First{i}",
+            "m_name": None,
+            "l_name": f"Last{i}",
+            "sex": rng.choice(sexes),
+            "DOB": datetime.date(2024, 1, 1) - datetime.timedelta(days=rng.randint(0, 365 * 18)),
+            "weight_kg": round(rng.uniform(2.5, 90.0), 1),
+            "Medical_conditions_id": condition_id,
+        }
+
+def _make_condition(cnx):
+    create_many(cnx, "Medical_conditions", [{"name": f"{NAME_PREFIX}condition"}])
+    row = fetch_one(cnx, "Medical_conditions", select="MAX(Medical_conditions_id) AS id",
+                    where="name = :name", params={"name": f"{NAME_PREFIX}condition"})
+    return row.id
+
+def _benchmark_medication_ids(cnx):
+    rows = fetch_all(cnx, "Medications", select="Medications_id", where="name LIKE :prefix",
+                     params={"prefix": f"{NAME_PREFIX}%"})
+    return [row.Medications_id for row in rows]
+
+def _clean_up(cnx, condition_id):
+    delete_many(cnx, "Medications", _benchmark_medication_ids(cnx))
+
+    # Reports saved as changes first, since they refer to the whole reports
+    for condition in ("snapshot_id IS NOT NULL", "snapshot_id IS NULL"):
+        report_ids = [row.Reports_id for row in fetch_all(cnx, "Reports", select="Reports_id",
+                                                          where=f"MRN >= :low AND {condition}", params={"low": MRN_BASE})]
+        delete_many(cnx, "Reports", report_ids)
+
+    mrns = [row.MRN for row in fetch_all(cnx, "Patients", select="MRN", where="MRN >= :low", params={"low": MRN_BASE})]
+    delete_many(cnx, "Patients", mrns)
+    delete_many(cnx, "Medical_conditions", [condition_id])
+
+# Baselines ----------------------------
+def compare_to_baseline(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the p50 and p95 latency of each benchmark against a baseline.
+    * Parameters:
+        * current: dict - from BenchmarkRun.to_dict()
+        * baseline: dict - a saved BenchmarkRun.to_dict()
+        * tolerance: float - the fraction slower than the baseline allowed
+    * Returns:
+        * list of str - one line per regression
+    """
+    regressions = []
+    print(f"\nCompared to baseline \"{baseline.get('label')}\" ({baseline.get('backend')}):")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"  {name:<28} (not in baseline)")
+            continue
+
+        changes = []
+        for stat in ("p50_ms", "p95_ms"):
+            change = (result[stat] - base[stat]) / base[stat] if base[stat] else 0.0
+            changes.append(f"{stat[:3]} {change:+.0%}")
+            if change > tolerance:
+                regressions.append(f"{name}: {stat} {base[stat]:.3f} ms -> {result[stat]:.3f} ms ({change:+.0%})")
+        print(f"  {name:<28} " + ", ".join(changes))
+
+    return regressions
+
+# Supporting functions ----------------------------
+def percentile(values, percent):
+    """
+    Returns the given percentile of values, interpolating between the closest two.
+    """
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+def print_result(result):
+    print(f"{result['name']:<28} {result['iterations']:>7} calls  "
+          f"p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms  "
+          f"{result['ops_per_s']:10.1f} ops/s  {result['rows_per_s']:12.1f} rows/s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark SuppliCore's report generation and CRUD functions.")
+    parser.add_argument("--config", action="store_true", help="use the database in config.json instead of in-memory SQLite")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma-separated patient table sizes (default: 100,1000,10000)")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per benchmark (default: 200)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated data (default: 0)")
+    parser.add_argument("--label", help="name stored with the results, such as a version number")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results to PATH as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare the results to the baseline in PATH")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction slower than the baseline that counts as a regression (default: 0.2)")
+    parser.add_argument("--metrics", metavar="PATH", help="also write the per-query metrics to PATH")
+    args = parser.parse_args(argv)
+
+    config = load_config() if args.config else {"backend": "sqlite", "sqlite_path": ":memory:", "pool_warmup": 1}
+    if not config:
+        parser.error("--config was given, but config.json couldn't be loaded")
+    backend = config.get("backend", "mysql")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database")
+        return 1
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+        run = run_benchmarks(cnx, sizes, args.iterations, args.seed)
+    finally:
+        close_database(cnx)
+
+    results = run.to_dict(backend, args.label)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(results, file, indent=1)
+    if args.metrics:
+        export_metrics_json(args.metrics)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions.")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""
+bulk_io.py
+Imports and exports any table as CSV or JSON Lines, in chunks, so files of any size use constant memory.
+
+Values are checked and converted a column at a time, using the column types in the schema catalog
+(INT, FLOAT, DATE, TIMESTAMP, ENUM, VARCHAR, JSON, and BLOB, written as base64 text). Rows that fail are written to an error file
+with the reason, and the rest are imported.
+
+Examples:
+$> python bulk_io.py import Supplements supplements.csv
+$> python bulk_io.py import Patients roster.jsonl --upsert --errors roster_rejected.jsonl
+$> python bulk_io.py export Reports reports.jsonl --sqlite scale_test.db
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import re
+import sys
+import time
+
+from db_interface import (start_database, close_database, load_config, create_many, upsert_many, read_iter,
+                          get_table_info, invalidate_cache, DEFAULT_CHUNK_SIZE)
+from report_history import refresh_latest_reports
+
+# import pandas as pd # imported in the functions that read or write files
+
+INTEGER_TYPES = {"int", "integer", "tinyint", "smallint", "mediumint", "bigint"}
+FLOAT_TYPES = {"float", "double", "decimal", "real", "numeric"}
+DATETIME_TYPES = {"datetime", "timestamp"}
+TEXT_TYPES = {"varchar", "char", "text", "tinytext", "mediumtext", "longtext"}
+BLOB_TYPES = {"blob", "tinyblob", "mediumblob", "longblob"}
+
+FILE_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+# Import ----------------------------
+def import_table(cnx, table_name: str, path: str, file_format: str = None, upsert: bool = False,
+                 error_path: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Imports a CSV or JSON Lines file into a table, one chunk (and one transaction) at a time.
+    Empty values are stored as NULL. Rows with invalid values, or that the database refuses
+    (such as a duplicate key or a missing foreign key), are written to the error file.
+    * Parameters:
+        * cnx - the connection to the database
+        * table_name: str - the table to import into
+        * path: str - the file to import. Its columns (or keys) must be columns of the table.
+        * file_format: str - "csv" or "jsonl" (default: from the file extension)
+        * upsert: bool - update entries whose key already exists, instead of rejecting them
+        * error_path: str - where rejected rows are written (default: path with ".errors" before the extension)
+        * chunk_size: int - rows read, checked and inserted at a time
+    * Returns:
+        * dict - "rows" read, "imported", "rejected", "seconds", "rows_per_s" and "error_path" (None if nothing was rejected)
+    * Raises:
+        * ValueError - if the table doesn't exist, or the file's columns don't match it
+    """
+    table = get_table_info(cnx, table_name)
+    columns = {column.Field.lower(): column for column in table["columns"]}
+    file_format = file_format or _file_format(path)
+    error_path = error_path or _error_path(path)
+
+    stats = {"rows": 0, "imported": 0, "rejected": 0}
+    start = time.perf_counter()
+    error_file = None
+
+    try:
+        for chunk, first_line in _read_chunks(path, file_format, chunk_size):
+            if stats["rows"] == 0:
+                _check_file_columns(table, columns, chunk.columns)
+
+            values, errors = coerce_chunk(chunk, columns)
+            valid = errors == ""
+            rows = _records(values[valid], columns)
+
+            refused = _insert_rows(cnx, table["name"], rows, upsert)
+            if refused:
+                valid_index = values.index[valid]
+                for position, message in refused.items():
+                    errors[valid_index[position]] = message
+                valid = errors == ""
+
+            stats["rows"] += len(chunk)
+            stats["imported"] += int(valid.sum())
+            rejected = chunk[~valid]
+            if not rejected.empty:
+                if error_file is None:
+                    error_file = open(error_path, "w", newline="", encoding="utf-8")
+                lines = first_line + chunk.index.get_indexer(rejected.index)
+                _write_errors(error_file, rejected, lines, errors[~valid], file_format,
+                              write_header=stats["rejected"] == 0)
+                stats["rejected"] += len(rejected)
+    finally:
+        if error_file is not None:
+            error_file.close()
+        invalidate_cache(table["name"])
+
+    # Imported reports didn't go through save_report(), so each patient's latest report is found again
+    if table["name"].lower() == "reports" and stats["imported"]:
+        refresh_latest_reports(cnx)
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_s"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    stats["error_path"] = error_path if stats["rejected"] else None
+    return stats
+
+def coerce_chunk(chunk, columns: dict):
+    """
+    Converts a chunk of file values to the types of their columns, a whole column at a time.
+    * Parameters:
+        * chunk: DataFrame - values as read from the file
+        * columns: dict - {lowercase column name: Column} from the schema catalog
+    * Returns:
+        * values: DataFrame - the converted values, with None for empty values
+        * errors: Series of str - the reasons each row is invalid ("" for valid rows)
+    """
+    import pandas as pd
+
+    values = pd.DataFrame(index=chunk.index)
+    errors = pd.Series("", index=chunk.index, dtype=object)
+
+    for name, series in chunk.items():
+        column = columns[name.lower()]
+        data_type = column.data_type
+        series = series.astype(object)
+        missing = series.isna() | (series.astype(str).str.strip() == "")
+        present = series.where(~missing)
+
+        if data_type in INTEGER_TYPES:
+            numbers = pd.to_numeric(present, errors="coerce")
+            invalid = ~missing & (numbers.isna() | (numbers % 1 != 0))
+            converted = numbers.where(~invalid).astype("Int64")
+        elif data_type in FLOAT_TYPES:
+            converted = pd.to_numeric(present, errors="coerce")
+            invalid = ~missing & converted.isna()
+        elif data_type == "date":
+            dates = pd.to_datetime(present, errors="coerce", format="ISO8601")
+            invalid = ~missing & dates.isna()
+            converted = dates.dt.date
+        elif data_type in DATETIME_TYPES:
+            converted = pd.to_datetime(present, errors="coerce", format="ISO8601")
+            invalid = ~missing & converted.isna()
+        elif data_type == "enum":
+            converted = present.astype("string").str.strip()
+            invalid = ~missing & ~converted.isin(column.enum_values)
+        elif data_type == "json":
+            converted = present.map(_json_text, na_action="ignore")
+            invalid = ~missing & converted.isna()
+        elif data_type in BLOB_TYPES:
+            converted = present.map(_blob_bytes, na_action="ignore")
+            invalid = ~missing & converted.isna()
+        else:
+            converted = present.astype("string")
+            length = _max_length(column)
+            invalid = ~missing & (converted.str.len() > length) if length else pd.Series(False, index=chunk.index)
+
+        if column.Null == "NO" and column.Default is None and "auto_increment" not in column.Extra:
+            required = missing
+        else:
+            required = pd.Series(False, index=chunk.index)
+
+        errors = errors.mask(invalid, errors + f"{column.Field}: not a valid {column.Type}; ")
+        errors = errors.mask(required, errors + f"{column.Field}: a value is required; ")
+        values[column.Field] = converted
+
+    return values, errors.str.rstrip("; ").where(errors != "", "")
+
+# Export ----------------------------
+def export_table(cnx, table_name: str, path: str, file_format: str = None, where: str = "*", params: dict = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Exports a table to a CSV or JSON Lines file, reading it in primary key order with read_iter().
+    Dates are written as YYYY-MM-DD, and JSON columns are written as nested objects in JSON Lines files.
+    * Parameters:
+        * cnx - the connection to the database
+        * table_name: str - the table to export
+        * path: str - the file to write
+        * file_format: str - "csv" or "jsonl" (default: from the file extension)
+        * where: str - only export rows matching this WHERE clause
+        * params: dict - values for any :name placeholders in where
+        * chunk_size: int - rows read and written at a time
+    * Returns:
+        * dict - "rows" written, "seconds" and "rows_per_s"
+    """
+    table = get_table_info(cnx, table_name)
+    columns = {column.Field.lower(): column for column in table["columns"]}
+    file_format = file_format or _file_format(path)
+
+    rows = 0
+    start = time.perf_counter()
+
+    # Only the columns in the catalog, so generated columns (which can't be imported) are left out
+    select = ", ".join(f"`{column.Field}`" for column in table["columns"])
+
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        for chunk in read_iter(cnx, table["name"], select=select, where=where, params=params, chunk_size=chunk_size):
+            chunk = _format_for_export(chunk, columns, file_format)
+            if file_format == "csv":
+                chunk.to_csv(file, header=rows == 0, index=False)
+            else:
+                for record in chunk.to_dict("records"):
+                    file.write(json.dumps(record, default=str) + "\n")
+            rows += len(chunk)
+
+    seconds = time.perf_counter() - start
+    return {"rows": rows, "seconds": seconds, "rows_per_s": rows / seconds if seconds else 0.0}
+
+# Supporting functions ----------------------------
+def _read_chunks(path, file_format, chunk_size):
+    """
+    Yields (DataFrame, line number of its first row) for each chunk of the file.
+    CSV values are read as text; conversion is done by coerce_chunk().
+    """
+    import pandas as pd
+
+    if file_format == "csv":
+        reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size, encoding="utf-8-sig")
+        first_line = 2  # after the header
+    else:
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False, convert_dates=False)
+        first_line = 1
+
+    with reader:
+        for chunk in reader:
+            yield chunk, first_line
+            first_line += len(chunk)
+
+def _check_file_columns(table, columns, file_columns):
+    unknown = [name for name in file_columns if str(name).lower() not in columns]
+    if unknown:
+        raise ValueError(f"{table['name']} has no columns named {unknown}")
+
+    file_columns = {str(name).lower() for name in file_columns}
+    missing = [column.Field for name, column in columns.items()
+               if name not in file_columns and column.Null == "NO" and column.Default is None
+               and "auto_increment" not in column.Extra]
+    if missing:
+        raise ValueError(f"The file is missing the required columns {missing}")
+
+def _records(values, columns):
+    """
+    Turns converted values into row dictionaries for create_many(), with None in place of missing values.
+    """
+    records = values.astype(object).where(values.notna(), None).to_dict("records")
+    datetime_columns = [name for name in values.columns if columns[name.lower()].data_type in DATETIME_TYPES]
+    for record in records:
+        for name in datetime_columns:
+            if record[name] is not None:
+                record[name] = record[name].to_pydatetime()
+    return records
+
+def _insert_rows(cnx, table_name, rows, upsert, offset=0):
+    """
+    Inserts a chunk of rows in one transaction. If the database refuses the chunk, it is split in half
+    and each half is tried again, down to single rows, to find the rows it refuses.
+    * Returns:
+        * dict - {position in rows: error message} for the refused rows
+    """
+    from sqlalchemy.exc import DBAPIError
+
+    if not rows:
+        return {}
+
+    try:
+        (upsert_many if upsert else create_many)(cnx, table_name, rows)
+        return {}
+    except DBAPIError as e:
+        if len(rows) == 1:
+            return {offset: str(e.orig).splitlines()[0]}
+
+    middle = len(rows) // 2
+    refused = _insert_rows(cnx, table_name, rows[:middle], upsert, offset)
+    refused.update(_insert_rows(cnx, table_name, rows[middle:], upsert, offset + middle))
+    return refused
+
+def _write_errors(file, rejected, lines, errors, file_format, write_header):
+    """
+    Writes rejected rows as they were in the file, followed by their line number and the reasons.
+    """
+    rejected = rejected.copy()
+    rejected["_line"] = lines
+    rejected["_error"] = errors.values
+
+    if file_format == "csv":
+        rejected.to_csv(file, header=write_header, index=False)
+    else:
+        for record in rejected.astype(object).where(rejected.notna(), None).to_dict("records"):
+            file.write(json.dumps(record, default=str) + "\n")
+
+def _format_for_export(chunk, columns, file_format):
+    """
+    Converts a chunk read from the database to the values written to the file.
+    """
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    for name in chunk.columns:
+        data_type = columns[name.lower()].data_type
+        if data_type == "date" or data_type in DATETIME_TYPES:
+            chunk[name] = chunk[name].map(_iso_format)
+        elif data_type == "json" and file_format == "jsonl":
+            chunk[name] = chunk[name].map(lambda value: json.loads(value) if isinstance(value, str) else value)
+        elif data_type in BLOB_TYPES:
+            chunk[name] = chunk[name].map(lambda value: base64.b64encode(value).decode("ascii") if value is not None else None)
+    return chunk
+
+def _iso_format(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+def _json_text(value):
+    """
+    Returns value as JSON text, or None if it isn't valid JSON. JSON Lines files can hold the value as an object.
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    try:
+        json.loads(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+def _blob_bytes(value):
+    """
+    Returns the bytes of a binary value, written to files as base64 text, or None if it isn't valid base64.
+    """
+    try:
+        return base64.b64decode(value, validate=True)
+    except (TypeError, ValueError):
+        return None
+
+def _max_length(column):
+    match = re.search(r"\((\d+)\)", column.Type)
+    return int(match.group(1)) if match and column.data_type in TEXT_TYPES else None
+
+def _file_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FILE_FORMATS:
+        raise ValueError(f"Can't tell the format of {path}; use a .csv or .jsonl file, or give the format")
+    return FILE_FORMATS[extension]
+
+def _error_path(path):
+    root, extension = os.path.splitext(path)
+    return f"{root}.errors{extension}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export a SuppliCore table as CSV or JSON Lines.")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("table", help="the table to import into or export")
+    parser.add_argument("path", help="the .csv or .jsonl file")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="the file format (default: from the extension)")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite database at PATH instead of config.json")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"rows handled at a time (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--upsert", action="store_true", help="import: update entries whose key already exists")
+    parser.add_argument("--errors", metavar="PATH", help="import: where rejected rows are written")
+    parser.add_argument("--where", default="*", help="export: only export rows matching this WHERE clause")
+    args = parser.parse_args(argv)
+
+    config = {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1} if args.sqlite else load_config()
+    if not config:
+        parser.error("config.json couldn't be loaded; use --sqlite to pick a SQLite database")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database")
+        return 1
+
+    try:
+        if args.command == "import":
+            stats = import_table(cnx, args.table, args.path, args.format, args.upsert, args.errors, args.chunk_size)
+            print(f"Imported {stats['imported']} of {stats['rows']} rows in {stats['seconds']:.1f} s "
+                  f"({stats['rows_per_s']:.0f} rows/s)")
+            if stats["rejected"]:
+                print(f"{stats['rejected']} rows were rejected, see {stats['error_path']}")
+        else:
+            stats = export_table(cnx, args.table, args.path, args.format, args.where, chunk_size=args.chunk_size)
+            print(f"Exported {stats['rows']} rows in {stats['seconds']:.1f} s ({stats['rows_per_s']:.0f} rows/s)")
+    finally:
+        close_database(cnx)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
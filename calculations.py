@@ -0,0 +1,101 @@
+"""
+calculations.py
+Nutrition calculations (Holliday-Segar, WHO REE) and age, for whole arrays of patients at once.
+
+The functions take NumPy arrays (or lists) and work on every patient in one pass, for batch runs such as
+generate_reports(). One patient at a time (the GUI and generate_report()), building arrays costs far more than
+the calculation, so app.py keeps plain Python versions, calculate_age() and apply_calculations(). test.py checks
+that both give the same results.
+"""
+import numpy as np
+
+AGE_UNITS = ("days", "months", "years")
+
+def holliday_segar(weight_kg):
+    """
+    Holliday-Segar maintenance and sick day fluids, in mL/day.
+    * Parameters:
+        * weight_kg: array of float
+    * Returns:
+        * maintenance: array of float
+        * sick_day: array of float - 1.5 times maintenance
+    """
+    weight = np.asarray(weight_kg, dtype=float)
+    maintenance = np.select(
+        [weight <= 10.0, weight <= 20.0],
+        [weight * 100.0, 1000 + (50 * (weight - 10))],
+        1500 + (20 * (weight - 20))
+    )
+    return maintenance, maintenance * 1.5
+
+def who_ree(weight_kg, sex, age):
+    """
+    WHO resting energy expenditure, in kcal/day. Unknown sexes get 0.0.
+    * Parameters:
+        * weight_kg: array of float
+        * sex: array of str - "M" or "F"
+        * age: array of int - the age number, as given by calculate_ages()
+    * Returns:
+        * array of float
+    """
+    weight = np.asarray(weight_kg, dtype=float)
+    sex = np.asarray(sex)
+    age = np.asarray(age)
+    male = sex == "M"
+    female = sex == "F"
+
+    # The age brackets compare the age number, whatever its unit, as generate_report() always has
+    return np.select(
+        [male & (age <= 3), male & (age <= 10), male,
+         female & (age <= 3), female & (age <= 10), female],
+        [(weight * 60.9) - 54, (weight * 22.7) + 495, (weight * 17.5) + 651,
+         (weight * 60.1) - 51, (weight * 22.5) + 499, (weight * 12.2) + 746],
+        0.0
+    )
+
+def calculate_ages(DOB, curr_date):
+    """
+    Ages in whole years, or in months if under a year, or in days if under a month.
+    * Parameters:
+        * DOB: array of dates (datetime64, or date/datetime objects; times are ignored)
+        * curr_date: array of dates, or a single date for every patient
+    * Returns:
+        * age: array of int
+        * age_unit: array of str - "days", "months" or "years"
+    """
+    DOB = _to_days(DOB)
+    curr_date = _to_days(curr_date)
+    birth_year, birth_month, birth_day = _split_dates(DOB)
+    curr_year, curr_month, curr_day = _split_dates(curr_date)
+
+    # Subtract a year if the birthday hasn't happened yet this year
+    before_birthday = (curr_month < birth_month) | ((curr_month == birth_month) & (curr_day < birth_day))
+    years = curr_year - birth_year - before_birthday
+
+    # Subtract a month if the day of the month hasn't happened yet
+    months = (curr_year - birth_year) * 12 + curr_month - birth_month - (curr_day < birth_day)
+    days = (curr_date - DOB).astype(np.int64)
+
+    in_days = (years < 1) & (months == 0)
+    in_months = (years < 1) & ~in_days
+    age = np.select([in_days, in_months], [days, months], years)
+    unit = np.select([in_days, in_months], [0, 1], 2)
+    return age, np.asarray(AGE_UNITS)[unit]
+
+# Supporting functions ----------------------------
+def _split_dates(dates):
+    """
+    Returns the year, month (1-12) and day (1-31) of an array of datetime64[D].
+    """
+    months_since_1970 = dates.astype("datetime64[M]").astype(np.int64)
+    year = months_since_1970 // 12 + 1970
+    month = months_since_1970 % 12 + 1
+    day = (dates - dates.astype("datetime64[M]")).astype(np.int64) + 1
+    return year, month, day
+
+def _to_days(dates):
+    """
+    Converts dates to an array of datetime64[D], dropping any times.
+    Goes through microseconds, since numpy won't convert datetime objects straight to days.
+    """
+    return np.asarray(dates, dtype="datetime64[us]").astype("datetime64[D]")
@@ -0,0 +1,299 @@
+"""
+db_instrumentation.py
+Query latency metrics, slow-query logging and log setup for the database layer
+"""
+
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache, wraps
+import atexit
+import inspect
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+
+logger = logging.getLogger("supplicore.db")
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+# Queries slower than this are logged as warnings, unless config.json sets "slow_query_ms"
+DEFAULT_SLOW_QUERY_MS = 500
+
+# The db_interface function currently running, set by track_call()
+_current_call = ContextVar("supplicore_db_call", default="other")
+
+_log_listener = None
+
+# Logging ----------------------------
+def setup_logging(level="INFO"):
+    """
+    Sends log messages from the program to the console through a background thread,
+    so that logging never blocks a database call or the GUI. Safe to call again to change the level.
+    * Parameters:
+        * level: str or int - the minimum level shown, such as "DEBUG", "INFO" or "WARNING"
+    * Returns: none
+    """
+    global _log_listener
+
+    app_logger = logging.getLogger("supplicore")
+    app_logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+    if _log_listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
+
+    _log_listener = logging.handlers.QueueListener(log_queue, console_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+# Metrics ----------------------------
+class Histogram:
+    """
+    Latency histogram with fixed buckets (LATENCY_BUCKETS), plus running totals.
+    """
+    __slots__ = ("bucket_counts", "count", "total_seconds", "max_seconds", "rows")
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+    def observe(self, seconds, rows=None):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if rows is not None and rows > 0:
+            self.rows += rows
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total_seconds * 1000,
+            "avg_ms": self.total_seconds / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max_seconds * 1000,
+            "rows": self.rows,
+            "buckets": {_bucket_label(bound): count for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts)},
+        }
+
+class QueryMetrics:
+    """
+    Collects per-statement latency, grouped by normalized SQL and by the db_interface function that ran it.
+    """
+    def __init__(self, slow_query_ms=DEFAULT_SLOW_QUERY_MS, slow_log_size=100):
+        self.slow_query_ms = slow_query_ms
+        self.by_statement = {}
+        self.by_caller = {}
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, statement, caller, seconds, rows=None):
+        """
+        Adds one executed statement to the metrics, and logs it if it was slow.
+        """
+        normalized = normalize_sql(statement)
+
+        with self._lock:
+            self.by_statement.setdefault(normalized, Histogram()).observe(seconds, rows)
+            self.by_caller.setdefault(caller, Histogram()).observe(seconds, rows)
+
+            is_slow = self.slow_query_ms is not None and seconds * 1000 >= self.slow_query_ms
+            if is_slow:
+                self.slow_queries.append({
+                    "time": time.time(),
+                    "caller": caller,
+                    "statement": normalized,
+                    "ms": seconds * 1000,
+                    "rows": rows,
+                })
+
+        if is_slow:
+            logger.warning("Slow query (%.1f ms, %s rows) in %s: %s", seconds * 1000, rows, caller, normalized)
+
+    def reset(self):
+        with self._lock:
+            self.by_statement.clear()
+            self.by_caller.clear()
+            self.slow_queries.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "slow_query_ms": self.slow_query_ms,
+                "by_caller": {caller: hist.to_dict() for caller, hist in self.by_caller.items()},
+                "by_statement": {statement: hist.to_dict() for statement, hist in self.by_statement.items()},
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def to_json(self, indent=1):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for group, label, histograms in (
+                ("caller", "caller", self.by_caller),
+                ("statement", "statement", self.by_statement),
+            ):
+                metric = f"supplicore_db_query_duration_seconds_by_{group}"
+                lines.append(f"# HELP {metric} Database statement latency, grouped by {group}.")
+                lines.append(f"# TYPE {metric} histogram")
+                for key, hist in histograms.items():
+                    label_value = _prometheus_escape(key)
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, hist.bucket_counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{label}="{label_value}",le="{_bucket_label(bound)}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{label}="{label_value}"}} {hist.total_seconds}')
+                    lines.append(f'{metric}_count{{{label}="{label_value}"}} {hist.count}')
+
+            metric = "supplicore_db_rows_total"
+            lines.append(f"# HELP {metric} Rows returned or affected, grouped by caller.")
+            lines.append(f"# TYPE {metric} counter")
+            for caller, hist in self.by_caller.items():
+                lines.append(f'{metric}{{caller="{_prometheus_escape(caller)}"}} {hist.rows}')
+
+            metric = "supplicore_db_slow_queries"
+            lines.append(f"# HELP {metric} Slow queries currently held in the slow query log.")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {len(self.slow_queries)}")
+
+        return "\n".join(lines) + "\n"
+
+# Metrics collected from every instrumented engine
+metrics = QueryMetrics()
+
+def instrument_engine(cnx, slow_query_ms=DEFAULT_SLOW_QUERY_MS):
+    """
+    Hooks the engine's cursor events, so every statement it runs is timed and added to `metrics`.
+    Called by start_database().
+    * Parameters:
+        * cnx - the connection to the database
+        * slow_query_ms: float - statements slower than this are logged as warnings (None turns this off)
+    * Returns: none
+    """
+    from sqlalchemy import event
+
+    metrics.slow_query_ms = slow_query_ms
+
+    if getattr(cnx, "_supplicore_instrumented", False):
+        return
+    cnx._supplicore_instrumented = True
+
+    @event.listens_for(cnx, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("supplicore_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(cnx, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["supplicore_query_start"].pop()
+        # rowcount is the rows affected for writes, and -1 when a driver can't tell (such as streamed reads)
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        metrics.record(statement, _current_call.get(), seconds, rows)
+
+    @event.listens_for(cnx, "handle_error")
+    def clear_timer(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("supplicore_query_start"):
+            connection.info["supplicore_query_start"].pop()
+
+def track_call(func):
+    """
+    Decorator for db_interface functions. Statements run while the function is running
+    are grouped under its name in the metrics.
+    """
+    name = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            generator = func(*args, **kwargs)
+            while True:
+                token = _current_call.set(name)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    _current_call.reset(token)
+                yield item
+
+        return generator_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_call.set(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_call.reset(token)
+
+    return wrapper
+
+def export_metrics_json(path=None):
+    """
+    Returns the collected metrics as JSON, and also writes them to path if one is given.
+    """
+    metrics_json = metrics.to_json()
+    if path:
+        with open(path, "w") as file:
+            file.write(metrics_json)
+    return metrics_json
+
+def export_metrics_prometheus(path=None):
+    """
+    Returns the collected metrics in Prometheus text format, and also writes them to path if one is given.
+    """
+    metrics_text = metrics.to_prometheus()
+    if path:
+        with open(path, "w") as file:
+            file.write(metrics_text)
+    return metrics_text
+
+# Supporting functions ----------------------------
+_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_SQL_NUMBER = re.compile(r"(?<![\w`])-?\d+(?:\.\d+)?(?![\w`])")
+_SQL_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+")
+_SQL_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SQL_VALUES_LIST = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def normalize_sql(statement):
+    """
+    Turns a statement into a grouping key, by replacing literals and placeholders with "?"
+    and collapsing lists, e.g. "SELECT * FROM Patients WHERE MRN IN (1, 2, 3)"
+    becomes "SELECT * FROM Patients WHERE MRN IN (...)".
+    """
+    normalized = _WHITESPACE.sub(" ", statement).strip().rstrip(";").strip()
+    normalized = _SQL_STRING.sub("?", normalized)
+    normalized = _SQL_PLACEHOLDER.sub("?", normalized)
+    normalized = _SQL_NUMBER.sub("?", normalized)
+    normalized = _SQL_LIST.sub("(...)", normalized)
+    normalized = _SQL_VALUES_LIST.sub(r"\1", normalized)
+    return normalized
+
+def _bucket_label(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def _prometheus_escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
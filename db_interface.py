@@ -3,23 +3,82 @@ db_interface.py
 Holds all the functions for interfacing with the database
 """
 
+# Heavy libraries (SQLAlchemy, pandas, tkinter) are imported inside the functions that use them,
+# so that importing this module at startup stays fast.
 # from GUI import confirm_commit_popup # imported in commit_db_changes
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError, OperationalError
-from sqlalchemy.orm import Session
-import pymysql
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import count, islice
+import datetime
 import json
-import pandas as pd
+import logging
+import os
+import re
+import threading
+import time
+import weakref
 import warnings
-from tkinter import messagebox
 
-# from sqlalchemy import create_engine # imported in start_database
+from db_instrumentation import track_call, instrument_engine, DEFAULT_SLOW_QUERY_MS
+
+# from sqlalchemy import create_engine # imported in start_database, create_sqlite_engine
+# from sqlalchemy import text, bindparam # imported in the functions that build queries
 # from sqlalchemy.exc import SQLAlchemyError, OperationalError # imported in start_database
-# from GUI import show_db_error_popup # imported in start_database
-# import logging # imported in start_database
+# from sqlalchemy.orm import Session # imported in commit_db_changes
+# import pandas as pd # imported in the functions that return DataFrames
+# from tkinter import messagebox # imported in create, delete
+# from GUI import show_db_error_popup # imported in _show_connection_error
+# from report_codec import configure_codec # imported in start_database, since report_codec imports this module
+
+logger = logging.getLogger("supplicore.db")
+
+# Connection pool settings, overridden by the matching keys in config.json
+POOL_DEFAULTS = {
+    "pool_size": 5,         # connections kept open in the pool
+    "max_overflow": 10,     # extra connections allowed above pool_size under load
+    "pool_recycle": 1800,   # seconds before a connection is replaced (avoids stale connections)
+    "pool_pre_ping": True,  # test connections on checkout, reconnecting if they went stale
+    "pool_timeout": 30,     # seconds to wait for a free connection before giving up
+    "pool_warmup": 2,       # connections opened by start_database() before the GUI is shown
+}
+
+# Rows sent per statement by the bulk functions, such as create_many()
+DEFAULT_BATCH_SIZE = 1000
+
+# Rows per chunk yielded by read_iter()
+DEFAULT_CHUNK_SIZE = 5000
+
+# Most rows returned by search_entries()
+DEFAULT_SEARCH_LIMIT = 50
+
+# Rows per page returned by read_page()
+DEFAULT_PAGE_SIZE = 25
+
+# Columns searched by search_entries(), in order, by lowercase table name.
+# Other tables search their primary key and their "name" column. All of these are indexed (see db_setup.sql).
+SEARCH_COLUMNS = {
+    "patients": ["MRN", "l_name", "f_name"],
+}
+
+# Range filters of find_reports(): (argument suffix, column). The columns are copied out of the report JSON
+# by the database and indexed (see the Reports table in db_setup.sql).
+REPORT_RANGE_COLUMNS = [("date", "report_date"), ("weight_kg", "weight_kg"), ("WHO_REE", "WHO_REE")]
+
+# Tables kept up to date by the program, which aren't listed for users to edit, by lowercase name
+# (see report_codec.py and report_history.py)
+INTERNAL_TABLES = {"report_dictionaries", "latest_reports"}
+
+# Statements raw_sql() can run without clearing the read() result cache
+_READ_ONLY_SQL = re.compile(r"\s*(SELECT|SHOW|DESCRIBE|DESC|EXPLAIN)\b", re.IGNORECASE)
+
+# Running totals for the time spent waiting on each connection's (engine's) pool, see checkout()
+_pool_waits = weakref.WeakKeyDictionary()
+_pool_wait_lock = threading.Lock()
 
 
 # General ----------------------------
+@track_call
 def raw_sql(cnx, query: str):
     """
     Runs a raw SQL query on the database.
@@ -34,11 +93,17 @@ def raw_sql(cnx, query: str):
     Raises:
         ValueError: If the database connection is not available.
     """
+    import pandas as pd
     if not cnx:
         raise ValueError("Database connection is not available.")
 
-    with cnx.connect() as connection:
-        query_result = pd.read_sql(query, connection)
+    try:
+        with checkout(cnx) as connection:
+            query_result = pd.read_sql(query, connection)
+    finally:
+        # The query may have changed any table, so cached read() results can't be trusted unless it only reads
+        if not _READ_ONLY_SQL.match(query):
+            invalidate_cache()
 
     return query_result
 
@@ -65,57 +130,294 @@ def create_new_database(config):
     # cnx.commit()
     # cnx.close()
 
-def start_database(config):
+def start_database(config, interactive: bool = True):
     """
     Initializes and connects to the database using the provided configuration.
 
     Parameters:
         config (dict): The database configuration dictionary.
+        interactive (bool): Show connection errors in popups, asking whether to create a missing database.
+            Command line tools pass False, so errors are only logged and nothing waits for an answer.
 
     Returns:
-        Engine: SQLAlchemy engine object for the database connection.
+        Engine: SQLAlchemy engine object for the database connection, or None if it couldn't connect.
 
     Logs:
-        Connection success or failure details.
+        Connection success or failure details, to the "supplicore.db" logger.
     """
     from sqlalchemy import create_engine
     from sqlalchemy.exc import SQLAlchemyError, OperationalError
-    from GUI import show_db_error_popup
-    import logging
-    logging.basicConfig()
-    logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
-    try:
-        # Extract database credentials and connection info
-        user = config['user']
-        password = config['password']
-        host = config['host']
-        database = config['database']
-        port = int(config.get('port', 3306))  # Ensure port is integer
-
-        # Create the SQLAlchemy engine (connection to the database)
-        cnx = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}")
-        print("Successfully connected to the database")
-        return cnx
+    cnx = None
 
-    except OperationalError as err:
-        if "Access denied" in str(err):
-            show_db_error_popup("access_denied")
-        elif "Unknown database" in str(err):
-            user_choice = show_db_error_popup("unknown_db")
-            if user_choice:
-                create_new_database(config)
-                print("Creating database")
-            else:
-                print("Database creation cancelled")
+    try:
+        if config.get("backend", "mysql") == "sqlite":
+            # Local file or in-memory database, created from db_setup_sqlite.sql if it's empty
+            cnx = create_sqlite_engine(config.get("sqlite_path", "supplicore.db"), config)
         else:
-            show_db_error_popup("generic", err)
+            # Extract database credentials and connection info
+            user = config['user']
+            password = config['password']
+            host = config['host']
+            database = config['database']
+            port = int(config.get('port', 3306))  # Ensure port is integer
+
+            # Create the SQLAlchemy engine (connection to the database)
+            cnx = create_engine(
+                f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}",
+                **get_pool_options(config)
+            )
+
+        # Open connections up front, so the first user action doesn't pay for the handshake
+        warm_up_pool(cnx, config.get("pool_warmup", POOL_DEFAULTS["pool_warmup"]))
+
+        # Time every statement, logging the ones slower than slow_query_ms
+        instrument_engine(cnx, config.get("slow_query_ms", DEFAULT_SLOW_QUERY_MS))
+
+        # Load table and column metadata once, instead of running SHOW KEYS / DESCRIBE per action
+        load_schema_catalog(cnx)
+
+        configure_result_cache(
+            enabled=bool(config.get("cache_enabled", False)),
+            max_entries=int(config.get("cache_size", 256)),
+            default_ttl=config.get("cache_default_ttl"),
+            table_ttl=config.get("cache_ttl"),
+        )
+
+        # Compress new reports if "report_codec" is set. Otherwise the codec is set up the first time a report needs it.
+        if config.get("report_codec"):
+            from report_codec import configure_codec
+            configure_codec(cnx, config["report_codec"], config.get("report_codec_level"))
+        logger.info("Successfully connected to the database")
+        return cnx
 
     except SQLAlchemyError as err:
+        logger.error("Couldn't connect to the database: %s", err)
+        if interactive:
+            _show_connection_error(config, err)
+
+    # The connection failed, so don't hand out an engine that can't connect
+    if cnx:
+        cnx.dispose()
+    return None
+
+def _show_connection_error(config, err):
+    """
+    Shows the popup for a start_database() error, offering to create the database if it doesn't exist.
+    """
+    from sqlalchemy.exc import OperationalError
+    from GUI import show_db_error_popup
+
+    if isinstance(err, OperationalError) and "Access denied" in str(err):
+        show_db_error_popup("access_denied")
+    elif isinstance(err, OperationalError) and "Unknown database" in str(err):
+        user_choice = show_db_error_popup("unknown_db")
+        if user_choice:
+            create_new_database(config)
+            logger.info("Creating database")
+        else:
+            logger.info("Database creation cancelled")
+    else:
         show_db_error_popup("generic", err)
 
+def create_sqlite_engine(path: str = ":memory:", config: dict = None):
+    """
+    Creates an engine for the embedded SQLite backend, and creates any tables and indexes the database is missing.
+    DATE and TIMESTAMP columns come back as date and datetime objects, as they do from MySQL.
+
+    Parameters:
+        path (str): The database file, or ":memory:" for a database that only lasts while the program runs.
+        config (dict): The database configuration dictionary, for the pool settings (default: POOL_DEFAULTS).
+
+    Returns:
+        Engine: SQLAlchemy engine object for the database connection.
+    """
+    import sqlite3
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import StaticPool
+
+    sqlite3.register_converter("DATE", lambda value: datetime.date.fromisoformat(value.decode()))
+    sqlite3.register_converter("TIMESTAMP", lambda value: datetime.datetime.fromisoformat(value.decode()))
+    connect_args = {"detect_types": sqlite3.PARSE_DECLTYPES, "check_same_thread": False}
+
+    if path == ":memory:":
+        # Every connection to :memory: is a new, empty database, so share a single connection
+        cnx = create_engine("sqlite://", connect_args=connect_args, poolclass=StaticPool)
+    else:
+        cnx = create_engine(f"sqlite:///{path}", connect_args=connect_args, **get_pool_options(config or {}))
+
+    @event.listens_for(cnx, "connect")
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+    # Every statement in the schema is IF NOT EXISTS, so this also adds indexes introduced since the file was made
+    try:
+        create_sqlite_schema(cnx)
+    except Exception:
+        # e.g. the file can't be opened; the caller never gets the engine, so close it here
+        cnx.dispose()
+        raise
+
     return cnx
 
+def create_sqlite_schema(cnx):
+    """
+    Creates the missing tables, columns and indexes in an SQLite database from db_setup_sqlite.sql, the SQLite version of db_setup.sql.
+
+    Parameters:
+        cnx: The database connection object.
+
+    Raises:
+        SQLAlchemyError: If the database can't be opened or changed, e.g. OperationalError for a file in a missing folder.
+    """
+    import sqlite3
+    from sqlalchemy.exc import DBAPIError
+
+    schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_setup_sqlite.sql")
+    with open(schema_path) as schema_file:
+        schema = schema_file.read()
+
+    # Connecting through the engine turns sqlite3 errors into SQLAlchemy's, as for every other query
+    with cnx.connect() as connection:
+        driver_connection = connection.connection.driver_connection
+        try:
+            # Columns must exist before the script makes indexes on them
+            _add_sqlite_columns(driver_connection, schema)
+            driver_connection.executescript(schema)
+        except sqlite3.Error as err:
+            raise DBAPIError.instance(None, None, err, sqlite3.Error) from err
+
+    invalidate_schema_catalog(cnx)
+
+def _add_sqlite_columns(connection, schema: str):
+    """
+    Adds columns that are in the schema script but missing from tables made by an older version of it,
+    since CREATE TABLE IF NOT EXISTS leaves existing tables as they are. Used by create_sqlite_schema().
+    """
+    for table_name, body in re.findall(r"CREATE TABLE IF NOT EXISTS `(\w+)` \((.*?)\n\);", schema, re.DOTALL):
+        existing = {row[1].lower() for row in connection.execute(f"PRAGMA table_xinfo(`{table_name}`)")}
+        if not existing:
+            continue  # a new table, made by the script
+
+        for definition in re.findall(r"^\s*(`\w+`.*?),?$", body, re.MULTILINE):
+            column_name = definition.split("`")[1]
+            if column_name.lower() not in existing:
+                logger.info("Adding column %s.%s", table_name, column_name)
+                connection.execute(f"ALTER TABLE `{table_name}` ADD COLUMN {definition}")
+
+def is_sqlite(cnx):
+    """
+    Returns True if the connection uses the embedded SQLite backend.
+    """
+    return cnx.dialect.name == "sqlite"
+
+def get_pool_options(config):
+    """
+    Builds the connection pool arguments for create_engine() from config.json.
+    Keys missing from the config fall back to POOL_DEFAULTS.
+
+    Parameters:
+        config (dict): The database configuration dictionary.
+
+    Returns:
+        dict: Keyword arguments for create_engine().
+    """
+    options = {key: config.get(key, default) for key, default in POOL_DEFAULTS.items()}
+
+    return {
+        "pool_size": int(options["pool_size"]),
+        "max_overflow": int(options["max_overflow"]),
+        "pool_recycle": int(options["pool_recycle"]),
+        "pool_pre_ping": bool(options["pool_pre_ping"]),
+        "pool_timeout": float(options["pool_timeout"]),
+    }
+
+@contextmanager
+def checkout(cnx):
+    """
+    Checks a connection out of the pool, recording how long the checkout took.
+    The connection is returned to the pool when the block exits.
+
+    Parameters:
+        cnx: The database connection object.
+
+    Yields:
+        Connection: A pooled connection.
+    """
+    start = time.perf_counter()
+    connection = cnx.connect()
+    wait = time.perf_counter() - start
+
+    with _pool_wait_lock:
+        pool_wait = _pool_waits.get(cnx)
+        if pool_wait is None:
+            pool_wait = _pool_waits[cnx] = {"checkouts": 0, "total_wait_s": 0.0, "max_wait_s": 0.0}
+        pool_wait["checkouts"] += 1
+        pool_wait["total_wait_s"] += wait
+        pool_wait["max_wait_s"] = max(pool_wait["max_wait_s"], wait)
+
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def warm_up_pool(cnx, num_connections: int):
+    """
+    Opens connections up front and returns them to the pool, so they are ready for use.
+
+    Parameters:
+        cnx: The database connection object.
+        num_connections (int): How many connections to open. Capped at the pool size,
+            since overflow connections are discarded when returned.
+
+    Returns:
+        int: The number of connections opened.
+    """
+    if not cnx or num_connections <= 0:
+        return 0
+
+    pool_size = _pool_call(cnx.pool, "size") or 1
+    num_connections = min(int(num_connections), pool_size)
+
+    connections = []
+    try:
+        for _ in range(num_connections):
+            connections.append(cnx.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+    return len(connections)
+
+def get_pool_stats(cnx):
+    """
+    Returns live statistics for the connection pool.
+
+    Parameters:
+        cnx: The database connection object.
+
+    Returns:
+        dict: pool size, checked out / idle / overflow connection counts,
+            and the average and longest time spent waiting for a connection from this pool.
+    """
+    if not cnx:
+        raise ValueError("Database connection is not available.")
+
+    pool = cnx.pool
+    with _pool_wait_lock:
+        pool_wait = dict(_pool_waits.get(cnx) or {"checkouts": 0, "total_wait_s": 0.0, "max_wait_s": 0.0})
+    checkouts = pool_wait["checkouts"]
+
+    return {
+        "size": _pool_call(pool, "size"),
+        "checked_out": _pool_call(pool, "checkedout"),
+        "idle": _pool_call(pool, "checkedin"),
+        "overflow": _pool_call(pool, "overflow"),
+        "checkouts": checkouts,
+        "avg_wait_ms": (pool_wait["total_wait_s"] / checkouts * 1000) if checkouts else 0.0,
+        "max_wait_ms": pool_wait["max_wait_s"] * 1000,
+    }
+
 def commit_db_changes(cnx, parent_window):
     """
     Prompts the user to confirm and commit database changes.
@@ -130,6 +432,7 @@ def commit_db_changes(cnx, parent_window):
     Raises:
         ValueError: If the database connection is not available.
     """
+    from sqlalchemy.orm import Session
     if not cnx:
         raise ValueError("Database connection is not available. Cannot commit changes.")
 
@@ -140,17 +443,17 @@ def commit_db_changes(cnx, parent_window):
         try:
             if isinstance(cnx, Session):
                 cnx.commit()
-                print("Changes successfully committed via session.")
+                logger.info("Changes successfully committed via session.")
             else:
-                with cnx.connect() as connection:
+                with checkout(cnx) as connection:
                     connection.commit()
-                print("Changes successfully committed via raw connection.")
+                logger.info("Changes successfully committed via raw connection.")
             return True
         except Exception as e:
-            print(f"Error committing changes: {e}")
+            logger.error("Error committing changes: %s", e)
             raise
     else:
-        print("Commit cancelled by the user.")
+        logger.info("Commit cancelled by the user.")
         return False
 
 
@@ -165,11 +468,19 @@ def close_database(cnx):
         A message indicating whether the connection was closed or absent.
     """
     if not cnx:
-        print("No active database connection to close.")
+        logger.info("No active database connection to close.")
         return
 
     cnx.dispose()
-    print("Database connection closed.")
+    invalidate_cache()
+    logger.info("Database connection closed.")
+
+def _pool_call(pool, name):
+    """
+    Calls a QueuePool statistics method, returning None for pool types that don't have it.
+    """
+    method = getattr(pool, name, None)
+    return method() if callable(method) else None
 
 # Database login -------------------------
 def configure_login():
@@ -191,26 +502,29 @@ def load_config():
             config = json.load(json_file)
     except:
         config = None
-        print("No config file detected")
+        logger.warning("No config file detected")
     
     return config
 
 def update_config(settings):
     """
-    Loads settings into config.json, replacing existing values
+    Loads settings into config.json, replacing existing values.
+    Keys that aren't in settings (such as the pool settings) are kept.
     * Parameters: 
         * settings: dict of values (such as str and int, not fields such as tk entry)
     * Returns: none
     """
+    config = load_config() or {}
+    config.update(settings)
+    config["raise_on_warnings"] = True
 
-    settings["raise_on_warnings"] = True
-
-    json_settings = json.dumps(settings, indent=1)
+    json_settings = json.dumps(config, indent=1)
 
     with open('config.json', "w") as json_file:
         json_file.write(json_settings)
 
 # CRUD functions ------------------------   
+@track_call
 def create(cnx, parent_window, table_name: str, content: dict):
     """
     Inserts a new entry into the specified table.
@@ -225,39 +539,181 @@ def create(cnx, parent_window, table_name: str, content: dict):
         ValueError: If the database connection is not available.
         Exception: If the insertion fails.
     """
+    from tkinter import messagebox
     if not cnx:
         raise ValueError("Database connection is not available. Cannot create entries.")
 
-    col_names = ", ".join(f"`{col}`" for col in content.keys())
-    placeholders = ", ".join([f":{col}" for col in content.keys()])
-
-    query = text(f"""
-        INSERT INTO {table_name} ({col_names}) 
-        VALUES ({placeholders})
-    """)
+    query = _insert_statement(table_name, content.keys())
 
     try:
-        with cnx.connect() as connection:
-            print(f"Executing query: {query}")
-            print(f"With data: {content}")
+        with checkout(cnx) as connection:
+            logger.debug("Executing query: %s, with data: %s", query, content)
             connection.execute(query, content)
             connection.commit()
+            invalidate_cache(table_name)
             commit_db_changes(cnx, parent_window)
-            print("Entry successfully inserted.")
+            logger.info("Entry successfully inserted.")
     except Exception as e:
-        print(f"Error during create function: {e}")
+        logger.error("Error during create function: %s", e)
         messagebox.showerror("Database Error", f"An error occurred while inserting the entry: {str(e)}")
         raise
 
-def read(cnx, table_name: str, select: str = "*", where: str = "*"):
+@track_call
+def create_many(cnx, table_name: str, rows, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Inserts many entries into the specified table in a single transaction.
+    Rows are sent in batches with executemany(), which the driver turns into
+    multi-row INSERT ... VALUES statements. There is no confirmation dialog,
+    so this can be used for bulk loads outside the GUI.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        rows (iterable): The entries to insert, as dictionaries. Every row must have the same keys.
+            Can be a generator, only one batch is held in memory at a time.
+        batch_size (int): The number of rows sent per statement (default: DEFAULT_BATCH_SIZE).
+
+    Returns:
+        list: One dict per batch, with "batch" (index), "rows" (rows inserted) and "seconds" (time taken).
+
+    Raises:
+        ValueError: If the database connection is not available, or a row has different keys.
+        Exception: If the insertion fails. No rows are inserted in this case.
+    """
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot create entries.")
+
+    try:
+        return _execute_batches(cnx, rows, batch_size, lambda columns: _insert_statement(table_name, columns))
+    finally:
+        invalidate_cache(table_name)
+
+@track_call
+def update_many(cnx, table_name: str, rows, key_columns: list = None, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Updates many existing entries in the specified table in a single transaction, using bound parameters.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        rows (iterable): The updated entries, as dictionaries. Each row holds its key columns
+            and the columns to change. Every row must have the same keys.
+        key_columns (list): The columns identifying each entry (default: the table's primary key).
+        batch_size (int): The number of rows sent per statement (default: DEFAULT_BATCH_SIZE).
+
+    Returns:
+        list: One dict per batch, with "batch" (index), "rows" (rows sent) and "seconds" (time taken).
+
+    Raises:
+        ValueError: If the database connection is not available, or the rows are missing key columns.
+        Exception: If the update fails. No rows are changed in this case.
+    """
+    from sqlalchemy import text
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot update entries.")
+
+    key_columns = key_columns or get_table_info(cnx, table_name)["primary_key"]
+
+    def build_query(columns):
+        if any(key not in columns for key in key_columns):
+            raise ValueError(f"Every row must include the key columns {key_columns}.")
+        set_columns = [col for col in columns if col not in key_columns]
+        if not set_columns:
+            raise ValueError("Rows have no columns to update.")
+
+        return text(f"""
+            UPDATE {table_name}
+            SET {_set_clause(set_columns)}
+            WHERE {" AND ".join(f"`{key}` = :{key}" for key in key_columns)}
+        """)
+
+    try:
+        return _execute_batches(cnx, rows, batch_size, build_query)
+    finally:
+        invalidate_cache(table_name)
+
+@track_call
+def upsert_many(cnx, table_name: str, rows, key_columns: list = None, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Inserts many entries into the specified table, updating entries whose key already exists.
+    Uses INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT ... DO UPDATE on SQLite)
+    in a single transaction, with bound parameters.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        rows (iterable): The entries, as dictionaries. Every row must have the same keys.
+        key_columns (list): The key columns, which are never overwritten (default: the table's primary key).
+        batch_size (int): The number of rows sent per statement (default: DEFAULT_BATCH_SIZE).
+
+    Returns:
+        list: One dict per batch, with "batch" (index), "rows" (rows sent) and "seconds" (time taken).
+
+    Raises:
+        ValueError: If the database connection is not available, or a row has different keys.
+        Exception: If the upsert fails. No rows are changed in this case.
+    """
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot upsert entries.")
+
+    key_columns = key_columns or get_table_info(cnx, table_name)["primary_key"]
+
+    try:
+        return _execute_batches(cnx, rows, batch_size,
+                                lambda columns: upsert_statement(cnx, table_name, columns, key_columns))
+    finally:
+        invalidate_cache(table_name)
+
+def upsert_statement(cnx, table_name: str, columns, key_columns: list = None):
+    """
+    Builds the statement upsert_many() runs, for upserting inside a transaction that is already open.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        columns (list): The columns given for each row, as :column placeholders.
+        key_columns (list): The key columns, which are never overwritten (default: the table's primary key).
+
+    Returns:
+        TextClause: The INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT ... DO UPDATE on SQLite) statement.
+    """
+    from sqlalchemy import text
+
+    key_columns = key_columns or get_table_info(cnx, table_name)["primary_key"]
+    update_columns = [col for col in columns if col not in key_columns]
+
+    if is_sqlite(cnx):
+        conflict_target = ", ".join(f"`{key}`" for key in key_columns)
+        if update_columns:
+            conflict_action = "DO UPDATE SET " + ", ".join(f"`{col}` = excluded.`{col}`" for col in update_columns)
+        else:
+            conflict_action = "DO NOTHING"
+        return text(f"""
+            {_insert_statement(table_name, columns).text}
+            ON CONFLICT ({conflict_target}) {conflict_action}
+        """)
+
+    # With nothing to update, re-assigning the first key column turns duplicates into no-ops
+    update_clause = ", ".join(f"`{col}` = VALUES(`{col}`)" for col in update_columns or key_columns[:1])
+
+    return text(f"""
+        {_insert_statement(table_name, columns).text}
+        ON DUPLICATE KEY UPDATE {update_clause}
+    """)
+
+@track_call
+def read(cnx, table_name: str, select: str = "*", where: str = "*", params: dict = None, use_cache: bool = True):
     """
     Reads data from the specified table.
+    If the result cache is enabled (see configure_result_cache()), repeated reads are served from it.
 
     Parameters:
         cnx: The database connection object.
         table_name (str): The name of the table.
         select (str): The SELECT clause (default: all columns).
         where (str): The WHERE clause (default: no condition).
+        params (dict): Values for any :name placeholders in the WHERE clause.
+        use_cache (bool): Set to False to always query the database.
 
     Returns:
         DataFrame: The result of the query.
@@ -265,6 +721,8 @@ def read(cnx, table_name: str, select: str = "*", where: str = "*"):
     Raises:
         ValueError: If the database connection is not available.
     """
+    from sqlalchemy import text
+    import pandas as pd
     if not cnx:
         raise ValueError("Database connection is not available. Cannot read entries.")
 
@@ -282,11 +740,392 @@ def read(cnx, table_name: str, select: str = "*", where: str = "*"):
 
     query += ";"
 
-    with cnx.connect() as connection:
-        query_result = pd.read_sql(query, connection)
+    cache = _result_cache if use_cache else None
+    if cache:
+        cache_key = (_cache_token(cnx), table_name.lower(), select, where, tuple(sorted((params or {}).items())))
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            return cached_result.copy()
+
+    with checkout(cnx) as connection:
+        query_result = pd.read_sql(text(query), connection, params=params)
+
+    if cache:
+        cache.put(cache_key, table_name, query_result.copy())
     return query_result
 
+@track_call
+def fetch_all(cnx, table_name: str, select: str = "*", where: str = "*", params: dict = None):
+    """
+    Reads data from the specified table as lightweight rows, without building a DataFrame.
+    Rows are namedtuples (no per-row dict), filled straight from the database cursor.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        select (str): The SELECT clause (default: all columns).
+        where (str): The WHERE clause (default: no condition).
+        params (dict): Values for any :name placeholders in the WHERE clause.
+
+    Returns:
+        list: The rows. Columns can be read by name (row.MRN) or position (row[0]).
+
+    Raises:
+        ValueError: If the database connection is not available.
+    """
+    return _fetch_rows(cnx, table_name, select, where, params)
+
+@track_call
+def fetch_one(cnx, table_name: str, select: str = "*", where: str = "*", params: dict = None):
+    """
+    Reads a single row from the specified table, such as one patient by MRN. See fetch_all().
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        select (str): The SELECT clause (default: all columns).
+        where (str): The WHERE clause (default: no condition).
+        params (dict): Values for any :name placeholders in the WHERE clause.
+
+    Returns:
+        namedtuple: The first matching row, or None if nothing matched.
+
+    Raises:
+        ValueError: If the database connection is not available.
+    """
+    rows = _fetch_rows(cnx, table_name, select, where, params, limit=1)
+    return rows[0] if rows else None
+
+@track_call
+def fetch_by_keys(cnx, table_name: str, key_column: str, keys, select: str = "*", batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Reads the rows whose key is in a list of keys, such as many patients by MRN, in a few SELECT ... IN queries.
+    Keys that match no row are left out. See fetch_all().
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        key_column (str): The column the keys are matched against.
+        keys (iterable): The keys to look up.
+        select (str): The SELECT clause (default: all columns).
+        batch_size (int): The number of keys sent per query (default: DEFAULT_BATCH_SIZE).
+
+    Returns:
+        list: The rows, in no particular order.
+
+    Raises:
+        ValueError: If the database connection is not available.
+    """
+    from sqlalchemy import text, bindparam
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot read entries.")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+
+    query = text(f"SELECT {select} FROM {table_name} WHERE {key_column} IN :keys").bindparams(
+        bindparam("keys", expanding=True))
+
+    keys = iter(keys)
+    rows = []
+    with checkout(cnx) as connection:
+        while True:
+            batch = list(islice(keys, batch_size))
+            if not batch:
+                break
+
+            result = connection.execute(query, {"keys": batch})
+            cursor = result.cursor
+            row_type = _row_type(tuple(column[0] for column in cursor.description))
+            rows.extend(map(row_type._make, cursor.fetchall()))
+            result.close()
+
+    return rows
+
+@track_call
+def search_entries(cnx, table_name: str, search: str = "", limit: int = DEFAULT_SEARCH_LIMIT):
+    """
+    Finds entries whose key or name starts with the search text, for search-as-you-type pickers.
+    Each search column (see SEARCH_COLUMNS) is queried with an indexed prefix match and a LIMIT,
+    so the time taken doesn't grow with the size of the table. Text matches ignore case.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        search (str): The start of the key or name. Empty returns the first entries by primary key.
+        limit (int): The most entries returned (default: DEFAULT_SEARCH_LIMIT).
+
+    Returns:
+        list: namedtuple rows of the table's first two columns (the key and the name, for most tables),
+            matches on earlier search columns first.
+
+    Raises:
+        ValueError: If the database connection is not available, or the table has no primary key.
+    """
+    table = get_table_info(cnx, table_name)
+    if not table["primary_key"]:
+        raise ValueError(f"No primary key found for table {table_name}")
+
+    select = ", ".join(f"`{column.Field}`" for column in table["columns"][:2])
+    search = search.strip()
+    if not search:
+        return _fetch_rows(cnx, table["name"], select, "*", limit=limit, order_by=f"`{table['primary_key'][0]}`")
+
+    columns = {column.Field.lower(): column for column in table["columns"]}
+    default_columns = [table["primary_key"][0], "name"]
+    rows = []
+    for name in SEARCH_COLUMNS.get(table_name.lower(), default_columns):
+        column = columns.get(name.lower())
+        if column is None:
+            continue
+
+        if _is_integer_column(column):
+            # A number prefix, such as MRN "12", matches the ranges 12, 120-129, 1200-1299, ...
+            if not search.isdigit():
+                continue
+            ranges = _number_prefix_ranges(int(search))
+            where = " OR ".join(f"(`{column.Field}` >= :_low_{i} AND `{column.Field}` < :_high_{i})"
+                                for i in range(len(ranges)))
+            params = {}
+            for i, (low, high) in enumerate(ranges):
+                params[f"_low_{i}"] = low
+                params[f"_high_{i}"] = high
+            order_by = f"`{column.Field}`"
+        else:
+            where = f"`{column.Field}` LIKE :_prefix ESCAPE '!'"
+            params = {"_prefix": _like_prefix(search)}
+            # Sort in the same (case-insensitive) order as the index, so the first matches are read straight from it
+            order_by = f"`{column.Field}` COLLATE NOCASE" if is_sqlite(cnx) else f"`{column.Field}`"
+
+        for row in _fetch_rows(cnx, table["name"], select, where, params, limit=limit, order_by=order_by):
+            if row not in rows:
+                rows.append(row)
+        if len(rows) >= limit:
+            break
+
+    return rows[:limit]
+
+Page = namedtuple("Page", ["rows", "first_key", "last_key", "has_more"])
+
+@track_call
+def read_page(cnx, table_name: str, sort_by: str = None, descending: bool = False, filter_column: str = None,
+              filter_value: str = "", after: tuple = None, before: tuple = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Reads one page of a table, for browsing it in a grid. Pages are found with keyset pagination
+    (WHERE (sort, key) > last row seen ORDER BY sort, key LIMIT n), so every page takes the same time,
+    however far into the table it is. Sorting and filtering are done by the database.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        sort_by (str): The column to sort by (default: the primary key). Must be a NOT NULL column.
+        descending (bool): Sort from largest to smallest.
+        filter_column (str): Only return rows where this column matches filter_value.
+        filter_value (str): Number columns must equal it, other columns must start with it.
+        after (tuple): The last_key of the current page, to read the next page.
+        before (tuple): The first_key of the current page, to read the previous page.
+        limit (int): The rows per page (default: DEFAULT_PAGE_SIZE).
+
+    Returns:
+        Page: namedtuple of "rows" (namedtuple rows, in display order), "first_key" and "last_key"
+            (for the after and before arguments), and "has_more" (True if there are more rows
+            past this page in the direction read).
 
+    Raises:
+        ValueError: If the database connection is not available, the table has no primary key,
+            or sort_by or filter_column isn't a usable column.
+    """
+    table = get_table_info(cnx, table_name)
+    columns = {column.Field.lower(): column for column in table["columns"]}
+    if not table["primary_key"]:
+        raise ValueError(f"No primary key found for table {table_name}")
+
+    # Sort by the chosen column, then by the primary key so that every row has a unique position
+    order_columns = list(table["primary_key"])
+    if sort_by:
+        column = columns.get(sort_by.lower())
+        if column is None:
+            raise ValueError(f"{table['name']} has no column named {sort_by}")
+        if column.Null != "NO":
+            raise ValueError(f"Can't sort by {column.Field}, because it can be empty")
+        order_columns = [column.Field] + [key for key in order_columns if key != column.Field]
+
+    conditions = []
+    params = {}
+    if filter_column and filter_value.strip():
+        column = columns.get(filter_column.lower())
+        if column is None:
+            raise ValueError(f"{table['name']} has no column named {filter_column}")
+        conditions.append(_filter_condition(column, filter_value.strip(), params))
+
+    # The previous page is read backwards from the first row of the current page, then put back in order
+    backward = before is not None
+    boundary = before if backward else after
+    reverse = descending != backward
+    if boundary is not None:
+        conditions.append(_keyset_condition(order_columns, reverse))
+        params.update({f"_last_{i}": value for i, value in enumerate(boundary)})
+
+    direction = "DESC" if reverse else "ASC"
+    order_by = ", ".join(f"`{column}` {direction}" for column in order_columns)
+    where = " AND ".join(conditions) if conditions else "*"
+
+    # One extra row shows whether there's another page
+    rows = _fetch_rows(cnx, table["name"], "*", where, params, limit=limit + 1, order_by=order_by)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    if not rows:
+        return Page(rows, None, None, has_more)
+
+    positions = [rows[0]._fields.index(column) for column in order_columns]
+    first_key = tuple(rows[0][position] for position in positions)
+    last_key = tuple(rows[-1][position] for position in positions)
+    return Page(rows, first_key, last_key, has_more)
+
+@track_call
+def read_iter(cnx, table_name: str, select: str = "*", where: str = "*", params: dict = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, as_frame: bool = True):
+    """
+    Reads data from the specified table in chunks, so large tables can be processed in constant memory.
+    Chunks are fetched with keyset pagination on the primary key (WHERE key > last key ORDER BY key LIMIT n),
+    so every chunk is an index range scan, and each chunk is streamed with a server-side (unbuffered) cursor.
+    The connection is returned to the pool between chunks.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        select (str): The SELECT clause (default: all columns). Must include the primary key columns.
+        where (str): The WHERE clause (default: no condition).
+        params (dict): Values for any :name placeholders in the WHERE clause.
+        chunk_size (int): The number of rows per chunk (default: DEFAULT_CHUNK_SIZE).
+        as_frame (bool): Yield DataFrames if True, otherwise lists of tuples.
+
+    Yields:
+        DataFrame or list: The next chunk of rows, in primary key order.
+
+    Raises:
+        ValueError: If the database connection is not available, or select leaves out the primary key.
+    """
+    from sqlalchemy import text
+    import pandas as pd
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot read entries.")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1.")
+
+    key_columns = get_table_info(cnx, table_name)["primary_key"]
+    if not key_columns:
+        raise ValueError(f"No primary key found for table {table_name}")
+
+    order_by = ", ".join(f"`{key}`" for key in key_columns)
+    params = dict(params or {})
+    params["_chunk_size"] = chunk_size
+    last_key = None
+    key_positions = None
+
+    while True:
+        conditions = []
+        if where != "*":
+            conditions.append(f"({where})")
+        if last_key is not None:
+            conditions.append(_keyset_condition(key_columns))
+            params.update({f"_last_{i}": value for i, value in enumerate(last_key)})
+
+        query = f"SELECT {select} FROM {table_name}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {order_by} LIMIT :_chunk_size"
+
+        with checkout(cnx) as connection:
+            result = connection.execution_options(stream_results=True).execute(text(query), params)
+            columns = list(result.keys())
+            rows = [tuple(row) for row in result]
+
+        if not rows:
+            return
+
+        if key_positions is None:
+            missing = [key for key in key_columns if key not in columns]
+            if missing:
+                raise ValueError(f"select must include the primary key columns {missing}.")
+            key_positions = [columns.index(key) for key in key_columns]
+
+        yield pd.DataFrame.from_records(rows, columns=columns) if as_frame else rows
+
+        if len(rows) < chunk_size:
+            return
+        last_key = [rows[-1][position] for position in key_positions]
+
+@track_call
+def find_reports(cnx, MRN: int = None, start_date=None, end_date=None, min_weight_kg: float = None,
+                 max_weight_kg: float = None, min_WHO_REE: float = None, max_WHO_REE: float = None,
+                 select: str = "*", descending: bool = False, limit: int = None):
+    """
+    Finds saved reports by patient, date, weight or WHO REE, such as "all reports with a weight under 10 kg last month".
+    These use the columns Reports copies out of the report JSON (report_date, weight_kg, Holliday_Segar_m,
+    Holliday_Segar_s and WHO_REE), which are indexed, so the database reads an index range instead of every report.
+    Every limit is optional and inclusive. Reports whose field isn't a number (or date) don't match a limit on it.
+    Rows saved as the changes from an earlier report (snapshot_id isn't NULL, see report_history.py) only hold
+    the changed fields in report; report_history.rebuild_reports() rebuilds the whole reports.
+
+    Parameters:
+        cnx: The database connection object.
+        MRN (int): Only this patient's reports.
+        start_date, end_date (date): The first and last report date.
+        min_weight_kg, max_weight_kg (float): The weight range.
+        min_WHO_REE, max_WHO_REE (float): The WHO REE range.
+        select (str): The SELECT clause (default: all columns, including the copied ones).
+        descending (bool): Newest reports first.
+        limit (int): The most reports returned (default: all).
+
+    Returns:
+        list: namedtuple rows, in report date order.
+
+    Raises:
+        ValueError: If the database connection is not available.
+    """
+    arguments = {"MRN": MRN, "min_date": start_date, "max_date": end_date, "min_weight_kg": min_weight_kg,
+                 "max_weight_kg": max_weight_kg, "min_WHO_REE": min_WHO_REE, "max_WHO_REE": max_WHO_REE}
+
+    conditions = []
+    params = {}
+    if MRN is not None:
+        conditions.append("`MRN` = :MRN")
+        params["MRN"] = MRN
+    for suffix, column in REPORT_RANGE_COLUMNS:
+        for bound, operator in (("min", ">="), ("max", "<=")):
+            value = arguments[f"{bound}_{suffix}"]
+            if value is not None:
+                conditions.append(f"`{column}` {operator} :{bound}_{suffix}")
+                # Dates are compared as YYYY-MM-DD, which SQLite stores them as
+                params[f"{bound}_{suffix}"] = value.strftime("%Y-%m-%d") if hasattr(value, "strftime") else value
+
+    direction = "DESC" if descending else "ASC"
+    where = " AND ".join(conditions) if conditions else "*"
+    return _fetch_rows(cnx, "Reports", select, where, params, limit=limit,
+                       order_by=f"`report_date` {direction}, `Reports_id` {direction}")
+
+@track_call
+def get_report_history(cnx, MRN: int, start_date=None, end_date=None):
+    """
+    Reads one patient's saved reports, oldest first, optionally between two dates. See find_reports().
+    For the whole reports, and what changed in each, use report_history.get_report_timeline().
+
+    Parameters:
+        cnx: The database connection object.
+        MRN (int): The patient.
+        start_date, end_date (date): The first and last report date (default: no limit).
+
+    Returns:
+        list: namedtuple rows, in report date order.
+
+    Raises:
+        ValueError: If the database connection is not available.
+    """
+    return find_reports(cnx, MRN=MRN, start_date=start_date, end_date=end_date)
+
+@track_call
 def update(cnx, parent_window, table_name: str, id: int, content: dict):
     """
     Updates an entry in the specified table.
@@ -302,6 +1141,7 @@ def update(cnx, parent_window, table_name: str, id: int, content: dict):
         ValueError: If the database connection is not available or invalid ID.
         Exception: If the update operation fails.
     """
+    from sqlalchemy import text
     if not cnx:
         raise ValueError("Database connection is not available. Cannot update entries.")
 
@@ -309,25 +1149,27 @@ def update(cnx, parent_window, table_name: str, id: int, content: dict):
     if not p_key_name or id == -1:
         raise ValueError("Invalid table or ID provided for update.")
 
-    set_statement = dict_to_string_Update(content)
+    set_statement = _set_clause(content.keys())
 
     query = text(f"""
         UPDATE {table_name} 
         SET {set_statement} 
-        WHERE {p_key_name} = :id
+        WHERE {p_key_name} = :_key_value
     """)
 
     try:
-        with cnx.connect() as connection:
+        with checkout(cnx) as connection:
             connection.execution_options(isolation_level="AUTOCOMMIT")
-            print(f"Executing query: {query}, with ID: {id} and content: {content}")
-            connection.execute(query, {"id": id})
+            logger.debug("Executing query: %s, with ID: %s and content: %s", query, id, content)
+            connection.execute(query, {**content, "_key_value": id})
             connection.commit()
-            print(f"Entry with ID {id} updated successfully in table {table_name}.")
+            invalidate_cache(table_name)
+            logger.info("Entry with ID %s updated successfully in table %s.", id, table_name)
     except Exception as e:
-        print(f"Error during update operation: {e}")
+        logger.error("Error during update operation: %s", e)
         raise
 
+@track_call
 def delete(cnx, parent_window, table_name: str, entry_id: int, primary_key: str):
     """
     Deletes an entry from the specified table.
@@ -343,6 +1185,8 @@ def delete(cnx, parent_window, table_name: str, entry_id: int, primary_key: str)
         ValueError: If the database connection is not available or entry does not exist.
         Exception: If the deletion operation fails.
     """
+    from sqlalchemy import text
+    from tkinter import messagebox
     if not cnx:
         raise ValueError("Database connection is not available. Cannot delete entries.")
 
@@ -352,27 +1196,83 @@ def delete(cnx, parent_window, table_name: str, entry_id: int, primary_key: str)
     """)
 
     try:
-        with cnx.connect() as connection:
+        with checkout(cnx) as connection:
             connection.execution_options(isolation_level="AUTOCOMMIT")
-            print(f"Executing DELETE query: {delete_query}, Parameters: {{entry_id: {entry_id}}}")
+            logger.debug("Executing DELETE query: %s, Parameters: {entry_id: %s}", delete_query, entry_id)
             result = connection.execute(delete_query, {"entry_id": entry_id})
+            invalidate_cache(table_name)
 
             if result.rowcount == 0:
                 raise ValueError(f"Entry with ID {entry_id} does not exist in {table_name}.")
 
             if commit_db_changes(cnx, parent_window):
-                print(f"Entry {entry_id} successfully deleted from {table_name}.")
+                logger.info("Entry %s successfully deleted from %s.", entry_id, table_name)
                 messagebox.showinfo("Success", f"Entry with ID {entry_id} deleted successfully.")
     except Exception as e:
-        print(f"Error during delete operation: {e}")
+        logger.error("Error during delete operation: %s", e)
         messagebox.showerror("Error", f"Failed to delete entry: {str(e)}")
 
 
 
+@track_call
+def delete_many(cnx, table_name: str, ids, primary_key: str = None, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Deletes many entries from the specified table in a single transaction.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+        ids (iterable): The IDs of the entries to delete.
+        primary_key (str): The primary key column name (default: looked up in the schema catalog).
+        batch_size (int): The number of IDs sent per DELETE ... IN statement (default: DEFAULT_BATCH_SIZE).
+
+    Returns:
+        list: One dict per batch, with "batch" (index), "rows" (rows deleted) and "seconds" (time taken).
+
+    Raises:
+        ValueError: If the database connection is not available.
+        Exception: If the deletion fails. No rows are deleted in this case.
+    """
+    from sqlalchemy import text, bindparam
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot delete entries.")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+
+    primary_key = primary_key or get_primary_key(cnx, table_name)
+
+    delete_query = text(f"""
+        DELETE FROM {table_name}
+        WHERE {primary_key} IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+
+    ids = iter(ids)
+    batch_stats = []
+
+    try:
+        with checkout(cnx) as connection:
+            with connection.begin():
+                while True:
+                    batch = list(islice(ids, batch_size))
+                    if not batch:
+                        break
+
+                    start = time.perf_counter()
+                    result = connection.execute(delete_query, {"ids": batch})
+                    batch_stats.append({
+                        "batch": len(batch_stats),
+                        "rows": result.rowcount,
+                        "seconds": time.perf_counter() - start,
+                    })
+    finally:
+        invalidate_cache(table_name)
+
+    return batch_stats
+
 # Supporting functions ------------------------------
 def get_table_names(cnx, config):
     """
-    Retrieves the names of tables in the database.
+    Retrieves the names of the tables users edit: not the link ("has") tables, or INTERNAL_TABLES.
 
     Parameters:
         cnx: The database connection object.
@@ -384,23 +1284,13 @@ def get_table_names(cnx, config):
     Raises:
         ValueError: If the database connection is not available.
     """
+    import pandas as pd
     if not cnx:
         raise ValueError("Database connection is not available. Cannot retrieve table names.")
 
-    query = (f"""
-        SELECT 
-             table_name
-        FROM 
-             information_schema.tables
-        WHERE 
-             table_schema = '{config['database']}'
-             AND table_name NOT LIKE "%has%";
-        """)
-
-    warnings.filterwarnings('ignore')
-    with cnx.connect() as connection:
-        query_result = pd.read_sql(query, connection)
-    return query_result
+    table_names = [table for table in get_catalog_tables(cnx)
+                   if "has" not in table.lower() and table.lower() not in INTERNAL_TABLES]
+    return pd.DataFrame({"TABLE_NAME": table_names})
 
 def get_table_names_interface(cnx, config):
     """
@@ -553,15 +1443,553 @@ def dict_to_string_Update(content: dict):
     # return
     return final_str
 
+def _insert_statement(table_name: str, columns):
+    """
+    Builds a parameterized INSERT statement, with one named placeholder per column.
+    """
+    from sqlalchemy import text
+    col_names = ", ".join(f"`{col}`" for col in columns)
+    placeholders = ", ".join([f":{col}" for col in columns])
+
+    return text(f"""
+        INSERT INTO {table_name} ({col_names}) 
+        VALUES ({placeholders})
+    """)
+
+def _fetch_rows(cnx, table_name: str, select: str, where: str, params: dict = None, limit: int = None,
+                order_by: str = None):
+    """
+    Runs a SELECT and builds namedtuple rows from the DBAPI cursor. Used by fetch_one(), fetch_all() and search_entries().
+    """
+    from sqlalchemy import text
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot read entries.")
+
+    query = f"SELECT {select} FROM {table_name}"
+    if where != "*":
+        query += f" WHERE {where}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+
+    with checkout(cnx) as connection:
+        result = connection.execute(text(query), params or {})
+        cursor = result.cursor
+        row_type = _row_type(tuple(column[0] for column in cursor.description))
+        rows = list(map(row_type._make, cursor.fetchall()))
+        result.close()
+
+    return rows
+
+def _filter_condition(column, value: str, params: dict):
+    """
+    Builds the condition for a grid filter, adding its value to params as :_filter.
+    Number columns must equal the value; other columns must start with it (an index-friendly LIKE 'value%').
+    """
+    if _is_integer_column(column) or column.data_type in ("float", "double", "decimal", "real", "numeric"):
+        try:
+            params["_filter"] = int(value) if _is_integer_column(column) else float(value)
+        except ValueError:
+            return "1 = 0"  # not a number, so nothing matches
+        return f"`{column.Field}` = :_filter"
+
+    params["_filter"] = _like_prefix(value)
+    return f"`{column.Field}` LIKE :_filter ESCAPE '!'"
+
+def _like_prefix(text: str):
+    """
+    Returns the LIKE pattern matching values that start with text, escaping % and _ with "!".
+    Used with ESCAPE '!', which MySQL and SQLite both accept.
+    """
+    return re.sub(r"([!%_])", r"!\1", text) + "%"
+
+def _is_integer_column(column):
+    return column.data_type.endswith("int") or column.data_type == "integer"
+
+def _number_prefix_ranges(prefix: int, max_digits: int = 10):
+    """
+    Returns the [low, high) ranges of the numbers that start with prefix, up to max_digits digits long.
+    Used by search_entries(), so a number prefix can be matched with index range scans.
+    """
+    if prefix == 0:
+        return [(0, 1)]
+
+    ranges = []
+    low, high = prefix, prefix + 1
+    while len(str(low)) <= max_digits:
+        ranges.append((low, high))
+        low, high = low * 10, high * 10
+    return ranges
+
+@lru_cache(maxsize=256)
+def _row_type(columns: tuple):
+    """
+    Returns a namedtuple class for a set of column names, reused for every query with the same columns.
+    Column names that aren't valid identifiers are renamed to _0, _1, etc.
+    """
+    return namedtuple("Row", columns, rename=True)
+
+def _keyset_condition(key_columns, descending: bool = False):
+    """
+    Builds the condition selecting rows after the last key seen, for keyset pagination.
+    Expanded form (a > :a) OR (a = :a AND b > :b), so composite keys still use the index.
+    With descending=True, selects the rows before it ("<") instead, for descending order.
+    The last key values are bound as :_last_0, :_last_1, etc.
+    """
+    operator = "<" if descending else ">"
+    terms = []
+    for i, key in enumerate(key_columns):
+        equal = [f"`{prev}` = :_last_{j}" for j, prev in enumerate(key_columns[:i])]
+        terms.append("(" + " AND ".join(equal + [f"`{key}` {operator} :_last_{i}"]) + ")")
+
+    return "(" + " OR ".join(terms) + ")"
+
+def _set_clause(columns):
+    """
+    Builds the SET clause of a parameterized UPDATE statement, e.g. "`name` = :name, `kcal` = :kcal".
+    """
+    return ", ".join(f"`{col}` = :{col}" for col in columns)
+
+def _execute_batches(cnx, rows, batch_size: int, build_query):
+    """
+    Runs a statement over many rows in a single transaction, batch_size rows per executemany() call.
+    Used by create_many(), update_many() and upsert_many().
+
+    Parameters:
+        cnx: The database connection object.
+        rows (iterable): Row dictionaries. Every row must have the same keys.
+        batch_size (int): The number of rows sent per call.
+        build_query (function): Takes the list of column names, returns the statement to run.
+
+    Returns:
+        list: One dict per batch, with "batch" (index), "rows" (rows sent) and "seconds" (time taken).
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+
+    rows = iter(rows)
+    batch_stats = []
+
+    with checkout(cnx) as connection:
+        with connection.begin():
+            columns = None
+            query = None
+
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                if columns is None:
+                    columns = list(batch[0].keys())
+                    query = build_query(columns)
+                for row in batch:
+                    if len(row) != len(columns) or any(col not in row for col in columns):
+                        raise ValueError(f"Every row must have the columns {columns}, got {list(row.keys())}.")
+
+                start = time.perf_counter()
+                connection.execute(query, batch)
+                batch_stats.append({
+                    "batch": len(batch_stats),
+                    "rows": len(batch),
+                    "seconds": time.perf_counter() - start,
+                })
+
+    return batch_stats
+
+@track_call
 def get_primary_key(cnx, table_name):
     """
     Returns the primary key column name for a given table.
+    For tables with a composite key, this is the first key column.
+    Looked up in the schema catalog, so no query is run once the catalog is loaded.
     """
-    query = f"SHOW KEYS FROM {table_name} WHERE Key_name = 'PRIMARY'"
-    with cnx.connect() as connection:
-        result = pd.read_sql(query, connection)
+    primary_key = get_table_info(cnx, table_name)["primary_key"]
 
-    if not result.empty:
-        return result['Column_name'].iloc[0]  # Returns the primary key column
+    if primary_key:
+        return primary_key[0]  # Returns the primary key column
     else:
-        raise ValueError(f"No primary key found for table {table_name}")
\ No newline at end of file
+        raise ValueError(f"No primary key found for table {table_name}")
+
+# Result cache ------------------------------
+class ResultCache:
+    """
+    LRU cache of read() results, with an optional time-to-live per table.
+    Entries for a table are dropped whenever the table is written to through this module.
+    """
+
+    def __init__(self, max_entries: int = 256, default_ttl: float = None, table_ttl: dict = None):
+        """
+        Parameters:
+            max_entries (int): The most results kept. The least recently used result is dropped first.
+            default_ttl (float): Seconds a result stays valid (default: None, until invalidated).
+            table_ttl (dict): Per-table overrides of default_ttl, keyed by table name.
+                A TTL of 0 turns caching off for that table.
+        """
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.table_ttl = {name.lower(): ttl for name, ttl in (table_ttl or {}).items()}
+        self._entries = OrderedDict()  # key -> (table, expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            table, expires_at, value = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, table_name: str, value):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+        """
+        table = table_name.lower()
+        ttl = self.table_ttl.get(table, self.default_ttl)
+        if ttl == 0:
+            return
+
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (table, expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table_name: str = None):
+        """
+        Drops every entry for a table, or the whole cache if no table is given.
+        """
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+                return
+
+            table = table_name.lower()
+            for key in [key for key, entry in self._entries.items() if entry[0] == table]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+# The cache used by read(). None while caching is off.
+_result_cache = None
+
+# Each connection's (engine's) number in the cache keys, see _cache_token()
+_cache_tokens = weakref.WeakKeyDictionary()
+_next_cache_token = count(1)
+
+def _cache_token(cnx):
+    """
+    Returns the number that stands for a connection (engine) in read()'s cache keys. Unlike id(cnx), it is never
+    given to another engine, so an engine made after one was closed can't be served the old engine's results.
+    """
+    token = _cache_tokens.get(cnx)
+    if token is None:
+        token = _cache_tokens.setdefault(cnx, next(_next_cache_token))
+    return token
+
+def configure_result_cache(enabled: bool = True, max_entries: int = 256, default_ttl: float = None, table_ttl: dict = None):
+    """
+    Turns the read() result cache on or off. Called by start_database() with the cache keys from config.json.
+
+    Parameters:
+        enabled (bool): False turns the cache off and drops its contents.
+        max_entries (int): The most results kept.
+        default_ttl (float): Seconds a result stays valid (default: None, until invalidated).
+        table_ttl (dict): Per-table TTL overrides, keyed by table name. 0 turns caching off for a table.
+
+    Returns:
+        ResultCache: The new cache, or None if it was turned off.
+    """
+    global _result_cache
+    _result_cache = ResultCache(max_entries, default_ttl, table_ttl) if enabled else None
+    return _result_cache
+
+def invalidate_cache(table_name: str = None):
+    """
+    Drops cached read() results for a table, or all of them if no table is given.
+    The CRUD functions call this automatically after writing to a table.
+    """
+    if _result_cache:
+        _result_cache.invalidate(table_name)
+
+def get_cache_stats():
+    """
+    Returns the result cache's hit/miss counters, or None if caching is off.
+    """
+    return _result_cache.stats() if _result_cache else None
+
+# Schema catalog ------------------------------
+# Table, column, type, enum and key metadata for the whole schema, loaded from
+# information_schema in one query. Keyed by engine, then by lowercase table name.
+_schema_catalogs = weakref.WeakKeyDictionary()
+
+# One column of a table. The first six fields match the output of DESCRIBE.
+Column = namedtuple("Column", ["Field", "Type", "Null", "Key", "Default", "Extra", "data_type", "enum_values"])
+
+@track_call
+def load_schema_catalog(cnx, table_name: str = None):
+    """
+    Loads table and column metadata for the connected schema from information_schema.
+    Called by start_database(), and again after invalidate_schema_catalog().
+    Generated columns (such as the ones Reports copies out of its JSON) are left out, since they can't be written.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): Only (re)load this table (default: all tables).
+
+    Returns:
+        dict: The catalog, keyed by lowercase table name. Each value holds the table "name",
+            its "columns" (list of Column) and its "primary_key" (list of column names, in key order).
+
+    Raises:
+        ValueError: If the database connection is not available.
+    """
+    from sqlalchemy import text
+    if not cnx:
+        raise ValueError("Database connection is not available. Cannot load the schema catalog.")
+
+    if is_sqlite(cnx):
+        return _load_sqlite_catalog(cnx, table_name)
+
+    query = """
+        SELECT
+            c.TABLE_NAME AS table_name,
+            c.COLUMN_NAME AS column_name,
+            c.COLUMN_TYPE AS column_type,
+            c.IS_NULLABLE AS is_nullable,
+            c.COLUMN_KEY AS column_key,
+            c.COLUMN_DEFAULT AS column_default,
+            c.EXTRA AS extra,
+            c.DATA_TYPE AS data_type,
+            k.ORDINAL_POSITION AS pk_position
+        FROM
+            information_schema.COLUMNS c
+            LEFT JOIN information_schema.KEY_COLUMN_USAGE k
+                ON k.TABLE_SCHEMA = c.TABLE_SCHEMA
+                AND k.TABLE_NAME = c.TABLE_NAME
+                AND k.COLUMN_NAME = c.COLUMN_NAME
+                AND k.CONSTRAINT_NAME = 'PRIMARY'
+        WHERE
+            c.TABLE_SCHEMA = DATABASE()
+            AND (c.GENERATION_EXPRESSION IS NULL OR c.GENERATION_EXPRESSION = '')
+    """
+    params = {}
+    if table_name:
+        query += " AND c.TABLE_NAME = :table_name"
+        params["table_name"] = table_name
+    query += " ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION"
+
+    with checkout(cnx) as connection:
+        rows = connection.execute(text(query), params).fetchall()
+
+    tables = {}
+    for row in rows:
+        table = tables.setdefault(row.table_name.lower(), {"name": row.table_name, "columns": [], "primary_key": []})
+        column_type = _as_str(row.column_type)
+        table["columns"].append(Column(
+            Field=row.column_name,
+            Type=column_type,
+            Null=row.is_nullable,
+            Key=row.column_key,
+            Default=row.column_default,
+            Extra=row.extra or "",
+            data_type=_as_str(row.data_type).lower(),
+            enum_values=_parse_enum(column_type),
+        ))
+        if row.pk_position is not None:
+            table["primary_key"].append((row.pk_position, row.column_name))
+
+    return _store_catalog(cnx, tables, table_name)
+
+def _load_sqlite_catalog(cnx, table_name: str = None):
+    """
+    SQLite version of load_schema_catalog(), reading sqlite_master and pragma_table_info in one query.
+    """
+    from sqlalchemy import text
+    query = """
+        SELECT
+            m.name AS table_name,
+            p.name AS column_name,
+            p.type AS column_type,
+            p."notnull" AS not_null,
+            p.dflt_value AS column_default,
+            p.pk AS pk_position,
+            m.sql AS table_sql
+        FROM
+            sqlite_master m
+            JOIN pragma_table_info(m.name) p
+        WHERE
+            m.type = 'table'
+            AND m.name NOT LIKE 'sqlite_%'
+    """
+    params = {}
+    if table_name:
+        query += " AND m.name = :table_name COLLATE NOCASE"
+        params["table_name"] = table_name
+    query += " ORDER BY m.name, p.cid"
+
+    with checkout(cnx) as connection:
+        rows = connection.execute(text(query), params).fetchall()
+
+    tables = {}
+    for row in rows:
+        table = tables.setdefault(row.table_name.lower(), {"name": row.table_name, "columns": [], "primary_key": []})
+        column_type = row.column_type
+        if column_type.upper() == "ENUM":
+            # ENUM values are listed in the column's CHECK (`col` IN (...)) constraint
+            enum_check = re.search(rf"`{re.escape(row.column_name)}`\s+IN\s*\(([^)]*)\)", row.table_sql, re.IGNORECASE)
+            if enum_check:
+                column_type = "enum(" + ",".join(value.strip() for value in enum_check.group(1).split(",")) + ")"
+        # INTEGER PRIMARY KEY AUTOINCREMENT is SQLite's AUTO_INCREMENT
+        auto_increment = row.pk_position == 1 and column_type.upper() == "INTEGER" and "AUTOINCREMENT" in row.table_sql.upper()
+        table["columns"].append(Column(
+            Field=row.column_name,
+            Type=column_type,
+            Null="NO" if row.not_null or row.pk_position else "YES",
+            Key="PRI" if row.pk_position else "",
+            Default=row.column_default,
+            Extra="auto_increment" if auto_increment else "",
+            data_type=column_type.split("(")[0].strip().lower(),
+            enum_values=_parse_enum(column_type),
+        ))
+        if row.pk_position:
+            table["primary_key"].append((row.pk_position, row.column_name))
+
+    return _store_catalog(cnx, tables, table_name)
+
+def _store_catalog(cnx, tables: dict, table_name: str = None):
+    """
+    Puts loaded table metadata into the catalog for cnx. Used by load_schema_catalog().
+    """
+    for table in tables.values():
+        table["primary_key"] = [name for _, name in sorted(table["primary_key"])]
+
+    catalog = _schema_catalogs.setdefault(cnx, {})
+    if table_name:
+        catalog.pop(table_name.lower(), None)
+    else:
+        catalog.clear()
+    catalog.update(tables)
+
+    return catalog
+
+def invalidate_schema_catalog(cnx, table_name: str = None):
+    """
+    Drops cached metadata, so it is reloaded on next use. Call this after changing the schema.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): Only invalidate this table (default: the whole catalog).
+    """
+    catalog = _schema_catalogs.get(cnx)
+    if catalog is None:
+        return
+
+    if table_name:
+        catalog.pop(table_name.lower(), None)
+    else:
+        _schema_catalogs.pop(cnx, None)
+
+def get_table_info(cnx, table_name: str):
+    """
+    Returns the catalog entry for a table, loading it on first use.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table (not case sensitive).
+
+    Returns:
+        dict: "name", "columns" and "primary_key", as described in load_schema_catalog().
+
+    Raises:
+        ValueError: If the table does not exist.
+    """
+    catalog = _schema_catalogs.get(cnx)
+    if catalog is None:
+        catalog = load_schema_catalog(cnx)
+
+    if table_name.lower() not in catalog:
+        catalog = load_schema_catalog(cnx, table_name)
+        if table_name.lower() not in catalog:
+            raise ValueError(f"Table {table_name} does not exist")
+
+    return catalog[table_name.lower()]
+
+def get_table_columns(cnx, table_name: str):
+    """
+    Returns the columns of a table from the schema catalog. Replaces DESCRIBE.
+
+    Parameters:
+        cnx: The database connection object.
+        table_name (str): The name of the table.
+
+    Returns:
+        list: Column namedtuples, in table order.
+    """
+    return get_table_info(cnx, table_name)["columns"]
+
+def get_catalog_tables(cnx):
+    """
+    Returns the names of all tables in the schema catalog. Replaces SHOW TABLES.
+
+    Parameters:
+        cnx: The database connection object.
+
+    Returns:
+        list: Table names, sorted.
+    """
+    catalog = _schema_catalogs.get(cnx)
+    if catalog is None:
+        catalog = load_schema_catalog(cnx)
+
+    return sorted(table["name"] for table in catalog.values())
+
+def _parse_enum(column_type: str):
+    """
+    Extracts the allowed values from an ENUM column type, e.g. "enum('g','mg')" -> ["g", "mg"].
+    Returns None for other column types.
+    """
+    if not column_type.lower().startswith("enum("):
+        return None
+
+    return [value.strip().strip("'\"") for value in column_type[5:-1].split(",")]
+
+def _as_str(value):
+    """
+    information_schema returns some columns as bytes, depending on the server version.
+    """
+    return value.decode() if isinstance(value, bytes) else value
@@ -20,7 +20,8 @@ USE `supplicore_db` ;
 CREATE TABLE IF NOT EXISTS `supplicore_db`.`Medical_conditions` (
   `Medical_conditions_id` INT NOT NULL AUTO_INCREMENT,
   `name` VARCHAR(45) NOT NULL,
-  PRIMARY KEY (`Medical_conditions_id`))
+  PRIMARY KEY (`Medical_conditions_id`),
+  INDEX `Medical_conditions_name_idx` (`name` ASC) VISIBLE)
 ENGINE = InnoDB;
 
 
@@ -33,7 +34,8 @@ CREATE TABLE IF NOT EXISTS `supplicore_db`.`Supplements` (
   `kcal` FLOAT NOT NULL,
   `displacement` FLOAT NULL,
   `notes` VARCHAR(300) NULL,
-  PRIMARY KEY (`Supplements_id`))
+  PRIMARY KEY (`Supplements_id`),
+  INDEX `Supplements_name_idx` (`name` ASC) VISIBLE)
 ENGINE = InnoDB;
 
 
@@ -45,7 +47,8 @@ CREATE TABLE IF NOT EXISTS `supplicore_db`.`Nutrients` (
   `name` VARCHAR(45) NOT NULL,
   `units` ENUM("g", "mg") NOT NULL,
   `goals_chart` JSON NULL,
-  PRIMARY KEY (`Nutrients_id`))
+  PRIMARY KEY (`Nutrients_id`),
+  INDEX `Nutrients_name_idx` (`name` ASC) VISIBLE)
 ENGINE = InnoDB;
 
 
@@ -63,6 +66,8 @@ CREATE TABLE IF NOT EXISTS `supplicore_db`.`Patients` (
   `Medical_conditions_id` INT NOT NULL,
   PRIMARY KEY (`MRN`),
   INDEX `fk_Patients_Medical_conditions1_idx` (`Medical_conditions_id` ASC) VISIBLE,
+  INDEX `Patients_l_name_idx` (`l_name` ASC, `f_name` ASC) VISIBLE,
+  INDEX `Patients_f_name_idx` (`f_name` ASC) VISIBLE,
   CONSTRAINT `fk_Patients_Medical_conditions1`
     FOREIGN KEY (`Medical_conditions_id`)
     REFERENCES `supplicore_db`.`Medical_conditions` (`Medical_conditions_id`)
@@ -141,23 +146,83 @@ CREATE TABLE IF NOT EXISTS `supplicore_db`.`Reports` (
   `MRN` INT NOT NULL,
   `date` TIMESTAMP NOT NULL,
   `report` JSON NOT NULL,
+  -- The rest of the report, compressed (see report_codec.py), when compression is on
+  `report_data` MEDIUMBLOB NULL,
+  -- NULL for a whole report; otherwise the whole report this one only saves the changes from (see report_history.py)
+  `snapshot_id` INT NULL,
+  -- Fields copied out of the report JSON, so reports can be searched by them with indexes.
+  -- Reports saved from the report page hold the calculations as "Label: value" text, so the label is dropped.
+  `report_date` DATE GENERATED ALWAYS AS (CASE WHEN `report` ->> '$.current_date' REGEXP '^[0-9]{4}-[0-9]{2}-[0-9]{2}$' THEN CAST(`report` ->> '$.current_date' AS DATE) END) STORED,
+  `weight_kg` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.weight_kg', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.weight_kg', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  `Holliday_Segar_m` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_m', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_m', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  `Holliday_Segar_s` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_s', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_s', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  `WHO_REE` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.WHO_REE', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.WHO_REE', ':', -1)) AS DECIMAL(10,2)) END) STORED,
   PRIMARY KEY (`Reports_id`),
   INDEX `fk_Reports_Patients1_idx` (`MRN` ASC) VISIBLE,
+  INDEX `Reports_MRN_report_date_idx` (`MRN` ASC, `report_date` ASC) VISIBLE,
+  INDEX `Reports_report_date_idx` (`report_date` ASC) VISIBLE,
+  INDEX `Reports_weight_kg_idx` (`weight_kg` ASC, `report_date` ASC) VISIBLE,
+  INDEX `Reports_WHO_REE_idx` (`WHO_REE` ASC, `report_date` ASC) VISIBLE,
+  INDEX `Reports_snapshot_id_idx` (`snapshot_id` ASC) VISIBLE,
   CONSTRAINT `fk_Reports_Patients1`
     FOREIGN KEY (`MRN`)
     REFERENCES `supplicore_db`.`Patients` (`MRN`)
     ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Reports_snapshot`
+    FOREIGN KEY (`snapshot_id`)
+    REFERENCES `supplicore_db`.`Reports` (`Reports_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB;
+
+
+-- -----------------------------------------------------
+-- Table `supplicore_db`.`Latest_reports`
+-- Each patient's latest report, whole, kept up to date by report_history.save_report()
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `supplicore_db`.`Latest_reports` (
+  `MRN` INT NOT NULL,
+  `Reports_id` INT NOT NULL,
+  `report_date` DATE NULL,
+  `report` JSON NOT NULL,
+  `report_data` MEDIUMBLOB NULL,
+  PRIMARY KEY (`MRN`),
+  INDEX `Latest_reports_report_date_idx` (`report_date` ASC) VISIBLE,
+  INDEX `fk_Latest_reports_Reports1_idx` (`Reports_id` ASC) VISIBLE,
+  CONSTRAINT `fk_Latest_reports_Patients1`
+    FOREIGN KEY (`MRN`)
+    REFERENCES `supplicore_db`.`Patients` (`MRN`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Latest_reports_Reports1`
+    FOREIGN KEY (`Reports_id`)
+    REFERENCES `supplicore_db`.`Reports` (`Reports_id`)
+    ON DELETE CASCADE
     ON UPDATE NO ACTION)
 ENGINE = InnoDB;
 
 
+-- -----------------------------------------------------
+-- Table `supplicore_db`.`Report_dictionaries`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `supplicore_db`.`Report_dictionaries` (
+  `dictionary_id` INT UNSIGNED NOT NULL,
+  `method` VARCHAR(10) NOT NULL,
+  `dictionary` MEDIUMBLOB NOT NULL,
+  `created` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`dictionary_id`))
+ENGINE = InnoDB;
+
+
 -- -----------------------------------------------------
 -- Table `supplicore_db`.`Medications`
 -- -----------------------------------------------------
 CREATE TABLE IF NOT EXISTS `supplicore_db`.`Medications` (
   `Medications_id` INT NOT NULL AUTO_INCREMENT,
   `name` VARCHAR(45) NOT NULL,
-  PRIMARY KEY (`Medications_id`))
+  PRIMARY KEY (`Medications_id`),
+  INDEX `Medications_name_idx` (`name` ASC) VISIBLE)
 ENGINE = InnoDB;
 
 
@@ -0,0 +1,244 @@
+-- SQLite version of db_setup.sql
+-- Used by the "sqlite" backend (see README). Keep in step with db_setup.sql.
+--
+-- Differences from the MySQL schema:
+-- * AUTO_INCREMENT keys are INTEGER PRIMARY KEY AUTOINCREMENT
+-- * ENUM columns are declared as ENUM with a CHECK (`col` IN (...)) listing the values, which the schema catalog reads
+-- * JSON columns are stored as text, with a json_valid() CHECK in place of MySQL's JSON validation
+-- * Indexes are created with separate CREATE INDEX statements. Name indexes are COLLATE NOCASE,
+--   so case-insensitive LIKE 'prefix%' searches can use them, as they do in MySQL
+
+PRAGMA foreign_keys = ON;
+
+-- -----------------------------------------------------
+-- Table `Medical_conditions`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Medical_conditions` (
+  `Medical_conditions_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS `Medical_conditions_name_idx` ON `Medical_conditions` (`name` COLLATE NOCASE ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Supplements`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Supplements` (
+  `Supplements_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL,
+  `kcal` FLOAT NOT NULL,
+  `displacement` FLOAT NULL,
+  `notes` VARCHAR(300) NULL
+);
+
+CREATE INDEX IF NOT EXISTS `Supplements_name_idx` ON `Supplements` (`name` COLLATE NOCASE ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Nutrients`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Nutrients` (
+  `Nutrients_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL,
+  `units` ENUM NOT NULL CHECK (`units` IN ('g', 'mg')),
+  `goals_chart` JSON NULL CHECK (`goals_chart` IS NULL OR json_valid(`goals_chart`))
+);
+
+CREATE INDEX IF NOT EXISTS `Nutrients_name_idx` ON `Nutrients` (`name` COLLATE NOCASE ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Patients`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Patients` (
+  `MRN` INT NOT NULL,
+  `f_name` VARCHAR(45) NOT NULL,
+  `m_name` VARCHAR(45) NULL,
+  `l_name` VARCHAR(45) NOT NULL,
+  `sex` VARCHAR(1) NOT NULL,
+  `DOB` DATE NOT NULL,
+  `weight_kg` FLOAT NOT NULL,
+  `Medical_conditions_id` INT NOT NULL,
+  PRIMARY KEY (`MRN`),
+  CONSTRAINT `fk_Patients_Medical_conditions1`
+    FOREIGN KEY (`Medical_conditions_id`)
+    REFERENCES `Medical_conditions` (`Medical_conditions_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `fk_Patients_Medical_conditions1_idx` ON `Patients` (`Medical_conditions_id` ASC);
+CREATE INDEX IF NOT EXISTS `Patients_l_name_idx` ON `Patients` (`l_name` COLLATE NOCASE ASC, `f_name` COLLATE NOCASE ASC);
+CREATE INDEX IF NOT EXISTS `Patients_f_name_idx` ON `Patients` (`f_name` COLLATE NOCASE ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Supplements_has_Nutrients`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Supplements_has_Nutrients` (
+  `Supplements_id` INT NOT NULL,
+  `Nutrients_id` INT NOT NULL,
+  PRIMARY KEY (`Supplements_id`, `Nutrients_id`),
+  CONSTRAINT `fk_Supplements_has_Nutrients_Supplements`
+    FOREIGN KEY (`Supplements_id`)
+    REFERENCES `Supplements` (`Supplements_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Supplements_has_Nutrients_Nutrients1`
+    FOREIGN KEY (`Nutrients_id`)
+    REFERENCES `Nutrients` (`Nutrients_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `fk_Supplements_has_Nutrients_Nutrients1_idx` ON `Supplements_has_Nutrients` (`Nutrients_id` ASC);
+CREATE INDEX IF NOT EXISTS `fk_Supplements_has_Nutrients_Supplements_idx` ON `Supplements_has_Nutrients` (`Supplements_id` ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Medical_conditions_has_Nutrients`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Medical_conditions_has_Nutrients` (
+  `Medical_conditions_id` INT NOT NULL,
+  `Nutrients_id` INT NOT NULL,
+  PRIMARY KEY (`Medical_conditions_id`, `Nutrients_id`),
+  CONSTRAINT `fk_Medical_conditions_has_Nutrients_Medical_conditions1`
+    FOREIGN KEY (`Medical_conditions_id`)
+    REFERENCES `Medical_conditions` (`Medical_conditions_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Medical_conditions_has_Nutrients_Nutrients1`
+    FOREIGN KEY (`Nutrients_id`)
+    REFERENCES `Nutrients` (`Nutrients_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `fk_Medical_conditions_has_Nutrients_Nutrients1_idx` ON `Medical_conditions_has_Nutrients` (`Nutrients_id` ASC);
+CREATE INDEX IF NOT EXISTS `fk_Medical_conditions_has_Nutrients_Medical_conditions1_idx` ON `Medical_conditions_has_Nutrients` (`Medical_conditions_id` ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Reference_charts`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Reference_charts` (
+  `Reference_charts_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL,
+  `chart` JSON NOT NULL CHECK (json_valid(`chart`)),
+  `Medical_conditions_id` INT NOT NULL,
+  CONSTRAINT `fk_Reference_charts_Medical_conditions1`
+    FOREIGN KEY (`Medical_conditions_id`)
+    REFERENCES `Medical_conditions` (`Medical_conditions_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `fk_Reference_charts_Medical_conditions1_idx` ON `Reference_charts` (`Medical_conditions_id` ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Reports`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Reports` (
+  `Reports_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `MRN` INT NOT NULL,
+  `date` TIMESTAMP NOT NULL,
+  `report` JSON NOT NULL CHECK (json_valid(`report`)),
+  -- The rest of the report, compressed (see report_codec.py), when compression is on
+  `report_data` BLOB NULL,
+  -- NULL for a whole report; otherwise the whole report this one only saves the changes from (see report_history.py)
+  `snapshot_id` INT NULL REFERENCES `Reports` (`Reports_id`),
+  -- Fields copied out of the report JSON, so reports can be searched by them with indexes.
+  -- Reports saved from the report page hold the calculations as "Label: value" text, so the label is dropped.
+  `report_date` DATE GENERATED ALWAYS AS (date(json_extract(`report`, '$.current_date'))) VIRTUAL,
+  `weight_kg` REAL GENERATED ALWAYS AS (CASE WHEN trim(substr(json_extract(`report`, '$.weight_kg'), instr(json_extract(`report`, '$.weight_kg'), ':') + 1)) GLOB '*[0-9]*' AND NOT trim(substr(json_extract(`report`, '$.weight_kg'), instr(json_extract(`report`, '$.weight_kg'), ':') + 1)) GLOB '*[^0-9.-]*' THEN CAST(trim(substr(json_extract(`report`, '$.weight_kg'), instr(json_extract(`report`, '$.weight_kg'), ':') + 1)) AS REAL) END) VIRTUAL,
+  `Holliday_Segar_m` REAL GENERATED ALWAYS AS (CASE WHEN trim(substr(json_extract(`report`, '$.Holliday_Segar_m'), instr(json_extract(`report`, '$.Holliday_Segar_m'), ':') + 1)) GLOB '*[0-9]*' AND NOT trim(substr(json_extract(`report`, '$.Holliday_Segar_m'), instr(json_extract(`report`, '$.Holliday_Segar_m'), ':') + 1)) GLOB '*[^0-9.-]*' THEN CAST(trim(substr(json_extract(`report`, '$.Holliday_Segar_m'), instr(json_extract(`report`, '$.Holliday_Segar_m'), ':') + 1)) AS REAL) END) VIRTUAL,
+  `Holliday_Segar_s` REAL GENERATED ALWAYS AS (CASE WHEN trim(substr(json_extract(`report`, '$.Holliday_Segar_s'), instr(json_extract(`report`, '$.Holliday_Segar_s'), ':') + 1)) GLOB '*[0-9]*' AND NOT trim(substr(json_extract(`report`, '$.Holliday_Segar_s'), instr(json_extract(`report`, '$.Holliday_Segar_s'), ':') + 1)) GLOB '*[^0-9.-]*' THEN CAST(trim(substr(json_extract(`report`, '$.Holliday_Segar_s'), instr(json_extract(`report`, '$.Holliday_Segar_s'), ':') + 1)) AS REAL) END) VIRTUAL,
+  `WHO_REE` REAL GENERATED ALWAYS AS (CASE WHEN trim(substr(json_extract(`report`, '$.WHO_REE'), instr(json_extract(`report`, '$.WHO_REE'), ':') + 1)) GLOB '*[0-9]*' AND NOT trim(substr(json_extract(`report`, '$.WHO_REE'), instr(json_extract(`report`, '$.WHO_REE'), ':') + 1)) GLOB '*[^0-9.-]*' THEN CAST(trim(substr(json_extract(`report`, '$.WHO_REE'), instr(json_extract(`report`, '$.WHO_REE'), ':') + 1)) AS REAL) END) VIRTUAL,
+  CONSTRAINT `fk_Reports_Patients1`
+    FOREIGN KEY (`MRN`)
+    REFERENCES `Patients` (`MRN`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `fk_Reports_Patients1_idx` ON `Reports` (`MRN` ASC);
+CREATE INDEX IF NOT EXISTS `Reports_MRN_report_date_idx` ON `Reports` (`MRN` ASC, `report_date` ASC);
+CREATE INDEX IF NOT EXISTS `Reports_report_date_idx` ON `Reports` (`report_date` ASC);
+CREATE INDEX IF NOT EXISTS `Reports_weight_kg_idx` ON `Reports` (`weight_kg` ASC, `report_date` ASC);
+CREATE INDEX IF NOT EXISTS `Reports_WHO_REE_idx` ON `Reports` (`WHO_REE` ASC, `report_date` ASC);
+CREATE INDEX IF NOT EXISTS `Reports_snapshot_id_idx` ON `Reports` (`snapshot_id` ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Latest_reports`
+-- Each patient's latest report, whole, kept up to date by report_history.save_report()
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Latest_reports` (
+  `MRN` INTEGER PRIMARY KEY,
+  `Reports_id` INT NOT NULL,
+  `report_date` DATE NULL,
+  `report` JSON NOT NULL CHECK (json_valid(`report`)),
+  `report_data` BLOB NULL,
+  CONSTRAINT `fk_Latest_reports_Patients1`
+    FOREIGN KEY (`MRN`)
+    REFERENCES `Patients` (`MRN`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Latest_reports_Reports1`
+    FOREIGN KEY (`Reports_id`)
+    REFERENCES `Reports` (`Reports_id`)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `Latest_reports_report_date_idx` ON `Latest_reports` (`report_date` ASC);
+CREATE INDEX IF NOT EXISTS `fk_Latest_reports_Reports1_idx` ON `Latest_reports` (`Reports_id` ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Report_dictionaries`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Report_dictionaries` (
+  `dictionary_id` INTEGER PRIMARY KEY,
+  `method` VARCHAR(10) NOT NULL,
+  `dictionary` BLOB NOT NULL,
+  `created` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+
+-- -----------------------------------------------------
+-- Table `Medications`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Medications` (
+  `Medications_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` VARCHAR(45) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS `Medications_name_idx` ON `Medications` (`name` COLLATE NOCASE ASC);
+
+
+-- -----------------------------------------------------
+-- Table `Patients_has_Medications`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `Patients_has_Medications` (
+  `Medications_id` INT NOT NULL,
+  `MRN` INT NOT NULL,
+  `dosage` VARCHAR(45) NOT NULL,
+  `notes` VARCHAR(300) NULL,
+  PRIMARY KEY (`Medications_id`, `MRN`),
+  CONSTRAINT `fk_Medications_has_Patients_Medications1`
+    FOREIGN KEY (`Medications_id`)
+    REFERENCES `Medications` (`Medications_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Medications_has_Patients_Patients1`
+    FOREIGN KEY (`MRN`)
+    REFERENCES `Patients` (`MRN`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION
+);
+
+CREATE INDEX IF NOT EXISTS `fk_Medications_has_Patients_Patients1_idx` ON `Patients_has_Medications` (`MRN` ASC);
+CREATE INDEX IF NOT EXISTS `fk_Medications_has_Patients_Medications1_idx` ON `Patients_has_Medications` (`Medications_id` ASC);
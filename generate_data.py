@@ -0,0 +1,342 @@
+"""
+generate_data.py
+Fills the database with realistic, made-up data for scale testing.
+
+Every table in db_setup.sql gets rows, with all foreign keys pointing at rows that exist.
+The same seed always makes the same data. Rows are streamed to the database in multi-row
+INSERT statements through create_many(), committing every --commit-every rows.
+
+Examples:
+$> python generate_data.py --sqlite scale_test.db
+$> python generate_data.py --config --scale 1 --seed 7
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+import time
+from itertools import islice
+
+from db_interface import start_database, close_database, load_config, create_many, fetch_one, invalidate_cache
+from app import date_format
+from calculations import calculate_ages, holliday_segar, who_ree
+from report_history import refresh_latest_reports
+
+# Rows made per table at --scale 1
+FULL_SCALE_COUNTS = {
+    "Medical_conditions": 500,
+    "Nutrients": 5_000,
+    "Supplements": 50_000,
+    "Medications": 10_000,
+    "Patients": 1_000_000,
+}
+
+# Links and child rows made per parent row (minimum, maximum)
+SUPPLEMENT_NUTRIENTS = (1, 8)
+CONDITION_NUTRIENTS = (2, 12)
+CONDITION_CHARTS = (1, 3)
+PATIENT_MEDICATIONS = (0, 4)
+PATIENT_REPORTS = (0, 6)
+
+# Patients whose report calculations are done together
+REPORT_BATCH_SIZE = 10_000
+
+# Rows per transaction
+DEFAULT_COMMIT_EVERY = 50_000
+
+# Reports are dated on or before this day, so that a seed always makes the same data
+DEFAULT_AS_OF = datetime.date(2024, 6, 30)
+
+FIRST_NAMES = ["Olivia", "Liam", "Emma", "Noah", "Amelia", "Oliver", "Ava", "Elijah", "Sophia", "Mateo",
+               "Isabella", "Lucas", "Mia", "Levi", "Evelyn", "Asher", "Harper", "James", "Luna", "Leo",
+               "Camila", "Grayson", "Gianna", "Ezra", "Elizabeth", "Luca", "Eleanor", "Ethan", "Ella", "Aiden"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+              "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson"]
+CONDITION_WORDS = ["Cystic fibrosis", "Short bowel syndrome", "Phenylketonuria", "Epilepsy", "Failure to thrive",
+                   "Cerebral palsy", "Crohn's disease", "Celiac disease", "Prematurity", "Chronic kidney disease",
+                   "Congenital heart disease", "Glycogen storage disease", "Maple syrup urine disease", "Dysphagia"]
+NUTRIENT_WORDS = ["Protein", "Calcium", "Iron", "Zinc", "Vitamin A", "Vitamin C", "Vitamin D", "Vitamin E",
+                  "Vitamin K", "Thiamin", "Riboflavin", "Niacin", "Folate", "Vitamin B12", "Magnesium", "Sodium",
+                  "Potassium", "Phosphorus", "Selenium", "Iodine", "Copper", "Fiber", "Fat", "Carbohydrate"]
+SUPPLEMENT_WORDS = ["Formula", "Powder", "Liquid", "Drops", "Chewable", "Modular", "Elemental", "Peptide", "Plus"]
+MEDICATION_WORDS = ["Omeprazole", "Levetiracetam", "Ursodiol", "Pancrelipase", "Ferrous sulfate", "Cholecalciferol",
+                    "Lansoprazole", "Baclofen", "Furosemide", "Spironolactone", "Ranitidine", "Cyproheptadine"]
+FEEDING_SCHEDULES = ["Every 3 hours", "Every 4 hours", "Continuous overnight", "5 meals and 2 snacks", "On demand"]
+DELIVERY_METHODS = ["Oral", "NG tube", "G tube", "GJ tube", "NJ tube"]
+
+class DataGenerator:
+    """
+    Makes the rows for each table. Each table draws from its own random generator,
+    so changing the number of rows in one table doesn't change the rows made for the others.
+    """
+    def __init__(self, seed=0, scale=0.01, as_of=DEFAULT_AS_OF, first_ids=None):
+        self.seed = seed
+        self.as_of = as_of
+        self.counts = {table: max(1, int(count * scale)) for table, count in FULL_SCALE_COUNTS.items()}
+        # The first ID used in each table, so rows can be added to a database that already has data
+        self.first_ids = {table: 1 for table in FULL_SCALE_COUNTS}
+        self.first_ids.update(first_ids or {})
+
+    def rng(self, table):
+        return random.Random(f"{self.seed}-{table}")
+
+    def ids(self, table):
+        return range(self.first_ids[table], self.first_ids[table] + self.counts[table])
+
+    def medical_conditions(self):
+        rng = self.rng("Medical_conditions")
+        for id in self.ids("Medical_conditions"):
+            yield {"Medical_conditions_id": id, "name": f"{rng.choice(CONDITION_WORDS)} {id}"[:45]}
+
+    def nutrients(self):
+        rng = self.rng("Nutrients")
+        for id in self.ids("Nutrients"):
+            units = rng.choice(("g", "mg"))
+            goal = round(rng.uniform(1, 100) if units == "g" else rng.uniform(1, 2000), 1)
+            yield {
+                "Nutrients_id": id,
+                "name": f"{rng.choice(NUTRIENT_WORDS)} {id}"[:45],
+                "units": units,
+                "goals_chart": json.dumps({"0-12 months": goal, "1-3 years": goal * 1.5, "4-18 years": goal * 2})
+                               if rng.random() < 0.7 else None,
+            }
+
+    def supplements(self):
+        rng = self.rng("Supplements")
+        for id in self.ids("Supplements"):
+            yield {
+                "Supplements_id": id,
+                "name": f"{rng.choice(NUTRIENT_WORDS)} {rng.choice(SUPPLEMENT_WORDS)} {id}"[:45],
+                "kcal": round(rng.uniform(0, 5), 2),
+                "displacement": round(rng.uniform(0.5, 0.9), 2) if rng.random() < 0.6 else None,
+                "notes": rng.choice((None, "Mix with water", "Take with food", "Refrigerate after opening")),
+            }
+
+    def medications(self):
+        rng = self.rng("Medications")
+        for id in self.ids("Medications"):
+            yield {"Medications_id": id, "name": f"{rng.choice(MEDICATION_WORDS)} {id}"[:45]}
+
+    def supplements_has_nutrients(self):
+        rng = self.rng("Supplements_has_Nutrients")
+        nutrient_ids = self.ids("Nutrients")
+        for supplement_id in self.ids("Supplements"):
+            for nutrient_id in _sample(rng, nutrient_ids, SUPPLEMENT_NUTRIENTS):
+                yield {"Supplements_id": supplement_id, "Nutrients_id": nutrient_id}
+
+    def medical_conditions_has_nutrients(self):
+        rng = self.rng("Medical_conditions_has_Nutrients")
+        nutrient_ids = self.ids("Nutrients")
+        for condition_id in self.ids("Medical_conditions"):
+            for nutrient_id in _sample(rng, nutrient_ids, CONDITION_NUTRIENTS):
+                yield {"Medical_conditions_id": condition_id, "Nutrients_id": nutrient_id}
+
+    def reference_charts(self):
+        rng = self.rng("Reference_charts")
+        for condition_id in self.ids("Medical_conditions"):
+            for chart in range(rng.randint(*CONDITION_CHARTS)):
+                ages = list(range(0, 216, 12))
+                yield {
+                    "name": f"Weight for age {condition_id}-{chart}",
+                    "chart": json.dumps({"age_months": ages,
+                                         "weight_kg": [round(3.3 + age * rng.uniform(0.2, 0.3), 1) for age in ages]}),
+                    "Medical_conditions_id": condition_id,
+                }
+
+    def patients(self):
+        """
+        Makes the patients. DOBs are spread over the 18 years before as_of, since the program is for children.
+        """
+        rng = self.rng("Patients")
+        condition_ids = self.ids("Medical_conditions")
+        for mrn in self.ids("Patients"):
+            dob = self.as_of - datetime.timedelta(days=rng.randint(0, 365 * 18))
+            age_years = (self.as_of - dob).days / 365.25
+            yield {
+                "MRN": mrn,
+                "f_name": rng.choice(FIRST_NAMES),
+                "m_name": rng.choice(FIRST_NAMES) if rng.random() < 0.5 else None,
+                "l_name": rng.choice(LAST_NAMES),
+                "sex": rng.choice(("M", "F")),
+                "DOB": dob,
+                "weight_kg": round(max(2.0, 3.5 + age_years * rng.uniform(2.0, 4.0)), 1),
+                "Medical_conditions_id": rng.choice(condition_ids),
+            }
+
+    def patients_has_medications(self):
+        rng = self.rng("Patients_has_Medications")
+        medication_ids = self.ids("Medications")
+        for mrn in self.ids("Patients"):
+            for medication_id in _sample(rng, medication_ids, PATIENT_MEDICATIONS):
+                yield {
+                    "Medications_id": medication_id,
+                    "MRN": mrn,
+                    "dosage": f"{rng.choice((1, 2, 2.5, 5, 10, 20))} mg/kg",
+                    "notes": None,
+                }
+
+    def reports(self):
+        """
+        Makes reports in the layout saved by the report page (PageReportEditing.get_report_input()),
+        for visits between each patient's birth and as_of. The calculations are done a batch of patients at a time.
+        """
+        rng = self.rng("Reports")
+        patients = self.patients()
+        while True:
+            visits = []
+            for patient in islice(patients, REPORT_BATCH_SIZE):
+                dob = patient["DOB"]
+                for _ in range(rng.randint(*PATIENT_REPORTS)):
+                    visit = dob + datetime.timedelta(days=rng.randint(0, (self.as_of - dob).days))
+                    report = self._report(rng, patient, visit)
+                    visit_time = datetime.datetime.combine(visit, datetime.time(rng.randint(8, 17), rng.randint(0, 59)))
+                    visits.append((patient, visit, visit_time, report))
+            if not visits:
+                return
+
+            ages, age_units = calculate_ages([visit[0]["DOB"] for visit in visits], [visit[1] for visit in visits])
+            weights = [visit[0]["weight_kg"] for visit in visits]
+            maintenance, sick_day = holliday_segar(weights)
+            WHO_REE = who_ree(weights, [visit[0]["sex"] for visit in visits], ages)
+
+            for i, (patient, visit, visit_time, report) in enumerate(visits):
+                # The same label text as a report saved from the report page
+                report["age"] = f"Age: {ages[i]} {age_units[i]}"
+                report["Holliday_Segar_m"] = f"Maintenance: {float(maintenance[i])}"
+                report["Holliday_Segar_s"] = f"Sick Day: {float(sick_day[i])}"
+                report["WHO_REE"] = f"WHO REE: {float(WHO_REE[i])}"
+                yield {
+                    "MRN": patient["MRN"],
+                    "date": visit_time,
+                    "report": json.dumps(report),
+                }
+
+    def _report(self, rng, patient, visit):
+        """
+        Makes a report with the same keys as one saved from the report page. reports() fills in the age and calculations.
+        """
+        return {
+            "MRN": str(patient["MRN"]),
+            "name": f"{patient['l_name']}, {patient['f_name']}",
+            "sex": patient["sex"],
+            "DOB": patient["DOB"].strftime(date_format),
+            "current_date": visit.strftime(date_format),
+            "age": "",
+            "weight_kg": str(patient["weight_kg"]),
+            "feeding_schedule": rng.choice(FEEDING_SCHEDULES),
+            "method_of_delivery": rng.choice(DELIVERY_METHODS),
+            "home_recipe": "",
+            "fluids": f"{rng.randint(500, 2500)} mL",
+            "solids": rng.choice(("", "Purees", "Soft solids", "Regular diet")),
+            "Holliday_Segar_m": "",
+            "Holliday_Segar_s": "",
+            "WHO_REE": "",
+        }
+
+    def tables(self):
+        """
+        Returns (table name, rows) pairs, with parent tables before the tables that reference them.
+        """
+        return [
+            ("Medical_conditions", self.medical_conditions()),
+            ("Nutrients", self.nutrients()),
+            ("Supplements", self.supplements()),
+            ("Medications", self.medications()),
+            ("Supplements_has_Nutrients", self.supplements_has_nutrients()),
+            ("Medical_conditions_has_Nutrients", self.medical_conditions_has_nutrients()),
+            ("Reference_charts", self.reference_charts()),
+            ("Patients", self.patients()),
+            ("Patients_has_Medications", self.patients_has_medications()),
+            ("Reports", self.reports()),
+        ]
+
+def generate(cnx, seed=0, scale=0.01, commit_every=DEFAULT_COMMIT_EVERY, as_of=DEFAULT_AS_OF):
+    """
+    Adds generated data to every table. IDs continue from the highest ID already in each table.
+    * Parameters:
+        * cnx - the connection to the database
+        * seed: int - the same seed makes the same data
+        * scale: float - fraction of FULL_SCALE_COUNTS to make (1 makes a million patients)
+        * commit_every: int - rows per transaction
+        * as_of: date - the latest date used for reports
+    * Returns:
+        * dict - {table name: rows added}
+    """
+    first_ids = {}
+    for table in FULL_SCALE_COUNTS:
+        key = "MRN" if table == "Patients" else f"{table}_id"
+        highest = fetch_one(cnx, table, select=f"MAX({key}) AS highest").highest
+        first_ids[table] = (highest or 0) + 1
+
+    generator = DataGenerator(seed, scale, as_of, first_ids)
+    added = {}
+
+    for table, rows in generator.tables():
+        start = time.perf_counter()
+        count = 0
+        while True:
+            chunk = list(islice(rows, commit_every))
+            if not chunk:
+                break
+            create_many(cnx, table, chunk)
+            count += len(chunk)
+
+        seconds = time.perf_counter() - start
+        added[table] = count
+        print(f"{table:<34} {count:>10} rows  {seconds:8.1f} s  {count / seconds if seconds else 0:10.0f} rows/s")
+
+    # The generated reports are saved directly, not with save_report(), so their latest reports are found afterwards
+    start = time.perf_counter()
+    count = refresh_latest_reports(cnx, commit_every)
+    seconds = time.perf_counter() - start
+    added["Latest_reports"] = count
+    print(f"{'Latest_reports':<34} {count:>10} rows  {seconds:8.1f} s  {count / seconds if seconds else 0:10.0f} rows/s")
+
+    invalidate_cache()
+    return added
+
+# Supporting functions ----------------------------
+def _sample(rng, ids, count_range):
+    """
+    Picks between count_range[0] and count_range[1] different IDs.
+    """
+    return rng.sample(ids, min(len(ids), rng.randint(*count_range)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the SuppliCore database with generated data.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--config", action="store_true", help="use the database in config.json")
+    target.add_argument("--sqlite", metavar="PATH", help="use (or create) the SQLite database at PATH")
+    parser.add_argument("--seed", type=int, default=0, help="the same seed makes the same data (default: 0)")
+    parser.add_argument("--scale", type=float, default=0.01,
+                        help="fraction of the full size to make; 1 makes 1,000,000 patients (default: 0.01)")
+    parser.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY,
+                        help=f"rows per transaction (default: {DEFAULT_COMMIT_EVERY})")
+    parser.add_argument("--as-of", type=datetime.date.fromisoformat, default=DEFAULT_AS_OF,
+                        help=f"latest report date, as YYYY-MM-DD (default: {DEFAULT_AS_OF})")
+    args = parser.parse_args(argv)
+
+    config = load_config() if args.config else {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1}
+    if not config:
+        parser.error("--config was given, but config.json couldn't be loaded")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database")
+        return 1
+
+    try:
+        start = time.perf_counter()
+        added = generate(cnx, args.seed, args.scale, args.commit_every, args.as_of)
+        seconds = time.perf_counter() - start
+        total = sum(added.values())
+        print(f"{'Total':<34} {total:>10} rows  {seconds:8.1f} s  {total / seconds if seconds else 0:10.0f} rows/s")
+    finally:
+        close_database(cnx)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+-- Adds the name indexes used by the entry search on the database page (db_interface.search_entries()).
+-- Only needed for databases created from an older db_setup.sql; new databases already have them.
+-- Run once, e.g. with: mysql -u root -p < migrations/001_search_indexes.sql
+-- (SQLite databases get these indexes automatically when the program starts.)
+
+USE `supplicore_db` ;
+
+ALTER TABLE `supplicore_db`.`Medical_conditions`
+  ADD INDEX `Medical_conditions_name_idx` (`name` ASC) VISIBLE;
+
+ALTER TABLE `supplicore_db`.`Supplements`
+  ADD INDEX `Supplements_name_idx` (`name` ASC) VISIBLE;
+
+ALTER TABLE `supplicore_db`.`Nutrients`
+  ADD INDEX `Nutrients_name_idx` (`name` ASC) VISIBLE;
+
+ALTER TABLE `supplicore_db`.`Medications`
+  ADD INDEX `Medications_name_idx` (`name` ASC) VISIBLE;
+
+ALTER TABLE `supplicore_db`.`Patients`
+  ADD INDEX `Patients_l_name_idx` (`l_name` ASC, `f_name` ASC) VISIBLE,
+  ADD INDEX `Patients_f_name_idx` (`f_name` ASC) VISIBLE;
@@ -0,0 +1,18 @@
+-- Adds columns to Reports that are copied out of the report JSON (the report's date, weight and calculations),
+-- with indexes, so reports can be searched by them (db_interface.find_reports()). Fills them in for existing reports.
+-- Only needed for databases created from an older db_setup.sql; new databases already have them.
+-- Run once, e.g. with: mysql -u root -p < migrations/002_report_columns.sql
+-- (SQLite databases get these columns automatically when the program starts.)
+
+USE `supplicore_db` ;
+
+ALTER TABLE `supplicore_db`.`Reports`
+  ADD COLUMN `report_date` DATE GENERATED ALWAYS AS (CASE WHEN `report` ->> '$.current_date' REGEXP '^[0-9]{4}-[0-9]{2}-[0-9]{2}$' THEN CAST(`report` ->> '$.current_date' AS DATE) END) STORED,
+  ADD COLUMN `weight_kg` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.weight_kg', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.weight_kg', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  ADD COLUMN `Holliday_Segar_m` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_m', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_m', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  ADD COLUMN `Holliday_Segar_s` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_s', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.Holliday_Segar_s', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  ADD COLUMN `WHO_REE` DECIMAL(10,2) GENERATED ALWAYS AS (CASE WHEN TRIM(SUBSTRING_INDEX(`report` ->> '$.WHO_REE', ':', -1)) REGEXP '^-?[0-9]{1,7}([.][0-9]+)?$' THEN CAST(TRIM(SUBSTRING_INDEX(`report` ->> '$.WHO_REE', ':', -1)) AS DECIMAL(10,2)) END) STORED,
+  ADD INDEX `Reports_MRN_report_date_idx` (`MRN` ASC, `report_date` ASC) VISIBLE,
+  ADD INDEX `Reports_report_date_idx` (`report_date` ASC) VISIBLE,
+  ADD INDEX `Reports_weight_kg_idx` (`weight_kg` ASC, `report_date` ASC) VISIBLE,
+  ADD INDEX `Reports_WHO_REE_idx` (`WHO_REE` ASC, `report_date` ASC) VISIBLE;
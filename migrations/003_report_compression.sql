@@ -0,0 +1,17 @@
+-- Adds the Reports.report_data column and the Report_dictionaries table, for compressed reports (report_codec.py).
+-- Only needed for databases created from an older db_setup.sql; new databases already have them.
+-- Run once, e.g. with: mysql -u root -p < migrations/003_report_compression.sql
+-- (SQLite databases get these automatically when the program starts.)
+
+USE `supplicore_db` ;
+
+ALTER TABLE `supplicore_db`.`Reports`
+  ADD COLUMN `report_data` MEDIUMBLOB NULL AFTER `report`;
+
+CREATE TABLE IF NOT EXISTS `supplicore_db`.`Report_dictionaries` (
+  `dictionary_id` INT UNSIGNED NOT NULL,
+  `method` VARCHAR(10) NOT NULL,
+  `dictionary` MEDIUMBLOB NOT NULL,
+  `created` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`dictionary_id`))
+ENGINE = InnoDB;
@@ -0,0 +1,16 @@
+-- Adds Reports.snapshot_id, so reports can be saved as the changes from an earlier whole report (report_history.py).
+-- Existing reports are whole reports, so they are left as they are.
+-- Only needed for databases created from an older db_setup.sql; new databases already have it.
+-- Run once, e.g. with: mysql -u root -p < migrations/004_report_revisions.sql
+-- (SQLite databases get this column automatically when the program starts.)
+
+USE `supplicore_db` ;
+
+ALTER TABLE `supplicore_db`.`Reports`
+  ADD COLUMN `snapshot_id` INT NULL AFTER `report_data`,
+  ADD INDEX `Reports_snapshot_id_idx` (`snapshot_id` ASC) VISIBLE,
+  ADD CONSTRAINT `fk_Reports_snapshot`
+    FOREIGN KEY (`snapshot_id`)
+    REFERENCES `supplicore_db`.`Reports` (`Reports_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION;
@@ -0,0 +1,28 @@
+-- Adds the Latest_reports table, which holds each patient's latest report (report_history.py).
+-- Only needed for databases created from an older db_setup.sql; new databases already have it.
+-- Run once, e.g. with: mysql -u root -p < migrations/005_latest_reports.sql
+-- then fill it in from the saved reports with: python report_history.py refresh-latest
+-- (SQLite databases get this table automatically when the program starts, but still need the refresh.)
+
+USE `supplicore_db` ;
+
+CREATE TABLE IF NOT EXISTS `supplicore_db`.`Latest_reports` (
+  `MRN` INT NOT NULL,
+  `Reports_id` INT NOT NULL,
+  `report_date` DATE NULL,
+  `report` JSON NOT NULL,
+  `report_data` MEDIUMBLOB NULL,
+  PRIMARY KEY (`MRN`),
+  INDEX `Latest_reports_report_date_idx` (`report_date` ASC) VISIBLE,
+  INDEX `fk_Latest_reports_Reports1_idx` (`Reports_id` ASC) VISIBLE,
+  CONSTRAINT `fk_Latest_reports_Patients1`
+    FOREIGN KEY (`MRN`)
+    REFERENCES `supplicore_db`.`Patients` (`MRN`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_Latest_reports_Reports1`
+    FOREIGN KEY (`Reports_id`)
+    REFERENCES `supplicore_db`.`Reports` (`Reports_id`)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB;
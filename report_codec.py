@@ -0,0 +1,437 @@
+"""
+report_codec.py
+Compressed storage for reports, in the Reports table and in report files.
+
+Reports are small, and most of their text (field names, feeding schedules, recipes) is the same from one report
+to the next, so compressing each report on its own saves little. Compressing with a shared dictionary, trained
+on saved reports, does much better: the compressor can point back into the dictionary as if its text came just
+before the report.
+
+Encoded reports start with a short header naming the method (zlib, or zstd if the "zstandard" package is
+installed) and the dictionary, so a report can always be decoded, even after a newer dictionary is trained.
+Dictionaries are kept in the Report_dictionaries table, and next to compressed report files.
+
+In the database, the fields that Reports copies into indexed columns (see db_setup.sql) stay in the report JSON,
+and the rest of the report is stored compressed in Reports.report_data. Compression of newly saved reports is
+turned on with "report_codec": "zlib" (or "zstd") in config.json, once a dictionary has been trained.
+
+Examples:
+$> python report_codec.py train
+$> python report_codec.py stats --sqlite scale_test.db
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import weakref
+import zlib
+from collections import Counter
+
+from db_interface import (start_database, close_database, load_config, fetch_all, upsert_many, read_iter,
+                          get_table_info, get_table_columns)
+
+logger = logging.getLogger("supplicore.codec")
+
+# Encoded reports start with: "SCZ", the method, and the dictionary ID (0 for none)
+MAGIC = b"SCZ"
+HEADER = struct.Struct("<3sBI")
+METHOD_IDS = {"zlib": 1, "zstd": 2}
+METHODS = {method_id: method for method, method_id in METHOD_IDS.items()}
+
+# Report fields kept as JSON in Reports.report when the rest is compressed: the patient, and the fields
+# the database copies into indexed columns
+INDEXED_FIELDS = ("MRN", "name", "sex", "DOB", "current_date", "age", "weight_kg",
+                  "Holliday_Segar_m", "Holliday_Segar_s", "WHO_REE")
+
+# Dictionary size in bytes. zlib can only look back 32 KB, so bigger dictionaries only help zstd.
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+DEFAULT_TRAINING_SAMPLES = 5000
+
+# The ReportCodec for each connection (engine), see get_codec()
+_codecs = weakref.WeakKeyDictionary()
+
+class ReportCodec:
+    """
+    Encodes reports with one dictionary (or none), and decodes reports encoded with any dictionary it knows.
+    The compressor is set up once, with the dictionary loaded, and copied for each report, which is much faster
+    than loading the dictionary again. Decompressors are cheap to make, so one is made per report.
+    """
+    def __init__(self, method: str = "zlib", dictionary: bytes = None, level: int = None, dictionaries: dict = None):
+        """
+        * Parameters:
+            * method: str - "zlib" or "zstd"
+            * dictionary: bytes - the dictionary new reports are encoded with (default: none)
+            * level: int - the compression level (default: 6 for zlib, 3 for zstd)
+            * dictionaries: dict - other dictionaries to decode with, as {dictionary ID: (method, bytes)}
+        """
+        if method not in METHOD_IDS:
+            raise ValueError(f"Unknown compression method {method!r}, expected one of {tuple(METHOD_IDS)}")
+
+        self.method = method
+        self.level = level if level is not None else (6 if method == "zlib" else 3)
+        self.dictionary = dictionary or b""
+        self.dictionary_id = get_dictionary_id(self.dictionary)
+        self.dictionaries = dict(dictionaries or {})
+        if self.dictionary:
+            self.dictionaries[self.dictionary_id] = (method, self.dictionary)
+
+        # Set by configure_codec(): whether newly saved reports are compressed
+        self.store_compressed = False
+
+        self._header = HEADER.pack(MAGIC, METHOD_IDS[method], self.dictionary_id)
+        self._compress = self._make_compressor()
+        self._decompressors = {}
+
+    def encode(self, report: dict):
+        """
+        Returns the report serialized and compressed, as bytes. Dates are saved as text, as in JSON report files.
+        """
+        data = json.dumps(report, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+        return self._header + self._compress(data)
+
+    def decode(self, data: bytes):
+        """
+        Returns the report in data, made by encode() with this dictionary or any in self.dictionaries.
+        * Raises:
+            * ValueError: if data isn't an encoded report, or its dictionary isn't known
+        """
+        if not is_encoded(data):
+            raise ValueError("Not an encoded report")
+        _, method_id, dictionary_id = HEADER.unpack_from(data)
+
+        decompress = self._decompressors.get((method_id, dictionary_id))
+        if decompress is None:
+            decompress = self._make_decompressor(METHODS[method_id], dictionary_id)
+            self._decompressors[(method_id, dictionary_id)] = decompress
+
+        return json.loads(decompress(memoryview(data)[HEADER.size:]))
+
+    def _make_compressor(self):
+        if self.method == "zstd":
+            zstandard = _import_zstandard()
+            dictionary = zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary, write_dict_id=False)
+            return compressor.compress
+
+        # Raw deflate (no zlib header or checksum), since the header above already says what this is
+        options = {"zdict": self.dictionary} if self.dictionary else {}
+        template = zlib.compressobj(self.level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, **options)
+
+        def compress(data):
+            compressor = template.copy()
+            return compressor.compress(data) + compressor.flush()
+
+        return compress
+
+    def _make_decompressor(self, method: str, dictionary_id: int):
+        dictionary = b""
+        if dictionary_id:
+            if dictionary_id not in self.dictionaries:
+                raise ValueError(f"Report was encoded with dictionary {dictionary_id}, which isn't loaded")
+            dictionary = self.dictionaries[dictionary_id][1]
+
+        if method == "zstd":
+            zstandard = _import_zstandard()
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None)
+            return decompressor.decompress
+
+        options = {"zdict": dictionary} if dictionary else {}
+
+        def decompress(data):
+            decompressor = zlib.decompressobj(-15, **options)
+            return decompressor.decompress(data) + decompressor.flush()
+
+        return decompress
+
+def get_dictionary_id(dictionary: bytes):
+    """
+    Returns the ID a dictionary is stored and referred to by (a CRC-32 of it), or 0 for no dictionary.
+    """
+    return zlib.crc32(dictionary) if dictionary else 0
+
+def is_encoded(data):
+    """
+    Returns True if data is a report encoded by ReportCodec, rather than JSON.
+    """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(MAGIC)]) == MAGIC
+
+def train_dictionary(reports, size: int = DEFAULT_DICTIONARY_SIZE, method: str = "zlib"):
+    """
+    Builds a dictionary from sample reports.
+    zstd trains its own. zlib has no trainer, so its dictionary is the most common "field":value pairs,
+    with the most useful last, since zlib refers to text near the end of the dictionary most cheaply.
+    * Parameters:
+        * reports: list of dict - sample reports, like the ones that will be encoded
+        * size: int - the dictionary's size in bytes, at most
+        * method: str - "zlib" or "zstd"
+    * Returns:
+        * bytes
+    """
+    samples = [json.dumps(report, separators=(",", ":"), ensure_ascii=False).encode("utf-8") for report in reports]
+    if method == "zstd":
+        return _import_zstandard().train_dictionary(size, samples).as_bytes()
+
+    counts = Counter()
+    for report in reports:
+        for key, value in report.items():
+            pair = json.dumps({key: value}, separators=(",", ":"), ensure_ascii=False)[1:-1].encode("utf-8")
+            counts[pair] += 1
+            counts[json.dumps(key).encode("utf-8") + b":"] += 1
+
+    # Pairs that appear once don't help, and are probably unique to one report
+    pieces = sorted((piece for piece, count in counts.items() if count > 1), key=lambda piece: counts[piece] * len(piece))
+    dictionary = []
+    used = 0
+    for piece in reversed(pieces):
+        if used + len(piece) + 1 > size:
+            continue
+        dictionary.append(piece)
+        used += len(piece) + 1
+    return b",".join(reversed(dictionary))
+
+def measure(codec: ReportCodec, reports):
+    """
+    Measures how well and how fast a codec encodes reports, compared with the JSON the Reports table holds.
+    * Parameters:
+        * codec: ReportCodec
+        * reports: list of dict
+    * Returns:
+        * dict - "reports", "json_bytes", "encoded_bytes", "ratio", "encode_MB_per_s" and "decode_MB_per_s"
+    """
+    json_bytes = sum(len(json.dumps(report).encode("utf-8")) for report in reports)
+
+    start = time.perf_counter()
+    encoded = [codec.encode(report) for report in reports]
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in encoded:
+        codec.decode(data)
+    decode_seconds = time.perf_counter() - start
+
+    encoded_bytes = sum(map(len, encoded))
+    return {
+        "reports": len(reports),
+        "json_bytes": json_bytes,
+        "encoded_bytes": encoded_bytes,
+        "ratio": json_bytes / encoded_bytes if encoded_bytes else 0.0,
+        "encode_MB_per_s": json_bytes / encode_seconds / 1_000_000 if encode_seconds else 0.0,
+        "decode_MB_per_s": json_bytes / decode_seconds / 1_000_000 if decode_seconds else 0.0,
+    }
+
+# Database ----------------------------
+def configure_codec(cnx, method: str = None, level: int = None):
+    """
+    Sets up report compression for a connection. Called by start_database() when "report_codec" is set in config.json,
+    and otherwise by get_codec() the first time a report is saved or read.
+    New reports are compressed with the newest dictionary for method, if method is given; otherwise they're saved
+    as plain JSON, and the dictionaries are only loaded when a compressed report needs one (see unpack_report()).
+    Compressed reports can be read either way.
+    * Parameters:
+        * cnx - the connection to the database
+        * method: str - "zlib" or "zstd", or None to save reports uncompressed
+        * level: int - the compression level (default: see ReportCodec)
+    * Returns:
+        * ReportCodec
+    """
+    if method and "report_data" not in [column.Field for column in get_table_columns(cnx, "Reports")]:
+        logger.warning("report_codec is set, but the Reports table has no report_data column; "
+                       "run migrations/003_report_compression.sql. Reports are saved uncompressed.")
+        method = None
+
+    dictionaries = load_dictionaries(cnx) if method else {}
+    newest = [dictionary for dictionary_method, dictionary in dictionaries.values() if dictionary_method == method]
+    codec = ReportCodec(method or "zlib", newest[-1] if newest else None, level, dictionaries)
+    codec.store_compressed = method is not None
+    _codecs[cnx] = codec
+    return codec
+
+def get_codec(cnx):
+    """
+    Returns the ReportCodec for a connection, set up with configure_codec() the first time it's needed.
+    """
+    codec = _codecs.get(cnx)
+    return codec if codec is not None else configure_codec(cnx)
+
+def load_dictionaries(cnx):
+    """
+    Returns the dictionaries in the Report_dictionaries table, oldest first, as {dictionary ID: (method, bytes)}.
+    A database made before the table was added (see migrations/003_report_compression.sql) has none.
+    """
+    try:
+        get_table_info(cnx, "Report_dictionaries")
+    except ValueError:
+        return {}
+
+    rows = fetch_all(cnx, "Report_dictionaries", select="dictionary_id, method, dictionary, created")
+    rows.sort(key=lambda row: (row.created, row.dictionary_id))
+    return {row.dictionary_id: (row.method, bytes(row.dictionary)) for row in rows}
+
+def save_dictionary(cnx, dictionary: bytes, method: str = "zlib"):
+    """
+    Stores a dictionary in the Report_dictionaries table, and makes the connection's codec use it for new reports.
+    * Returns:
+        * int - the dictionary ID
+    """
+    dictionary_id = get_dictionary_id(dictionary)
+    upsert_many(cnx, "Report_dictionaries", [{"dictionary_id": dictionary_id, "method": method, "dictionary": dictionary}])
+    codec = get_codec(cnx)
+    configure_codec(cnx, method if codec.store_compressed else None, codec.level if codec.method == method else None)
+    return dictionary_id
+
+def pack_report(cnx, report: dict):
+    """
+    Returns the "report" and "report_data" values a report is saved to the Reports table with.
+    If compression is on (see configure_codec()), report holds the INDEXED_FIELDS as JSON, and report_data the
+    rest of the report, compressed. Otherwise report holds the whole report and report_data is None.
+    """
+    codec = get_codec(cnx)
+    if not codec.store_compressed:
+        return {"report": json.dumps(report), "report_data": None}
+
+    indexed = {key: value for key, value in report.items() if key in INDEXED_FIELDS}
+    rest = {key: value for key, value in report.items() if key not in INDEXED_FIELDS}
+    return {"report": json.dumps(indexed), "report_data": codec.encode(rest)}
+
+def unpack_report(cnx, report, report_data=None):
+    """
+    Returns the whole report from a Reports row's "report" and "report_data" values, as made by pack_report().
+    * Parameters:
+        * cnx - the connection to the database
+        * report: str of JSON, or dict
+        * report_data: bytes, or None
+    * Returns:
+        * dict
+    """
+    if isinstance(report, str):
+        report = json.loads(report)
+    if report_data is None:
+        return report
+
+    codec = get_codec(cnx)
+    if is_encoded(report_data):
+        dictionary_id = HEADER.unpack_from(report_data)[2]
+        if dictionary_id and dictionary_id not in codec.dictionaries:
+            codec.dictionaries.update(load_dictionaries(cnx))
+
+    # The compressed fields come after the indexed ones, so the order can differ from the report as made
+    return {**report, **codec.decode(report_data)}
+
+# Files ----------------------------
+def dictionary_path(directory: str, dictionary_id: int):
+    """
+    Returns where the dictionary for compressed report files in directory is kept.
+    """
+    return os.path.join(directory, f"report-dictionary-{dictionary_id}.zdict")
+
+def write_dictionary_file(directory: str, codec: ReportCodec):
+    """
+    Saves the codec's dictionary next to the report files it compresses, so they can be read without the database.
+    """
+    if not codec.dictionary:
+        return None
+    path = dictionary_path(directory, codec.dictionary_id)
+    if not os.path.exists(path):
+        os.makedirs(directory or ".", exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(codec.dictionary)
+    return path
+
+def read_report_file(path: str):
+    """
+    Reads a report file, either JSON or compressed by ReportCodec (with its dictionary file next to it).
+    * Returns:
+        * dict
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if not is_encoded(data):
+        return json.loads(data)
+
+    _, method_id, dictionary_id = HEADER.unpack_from(data)
+    dictionary = None
+    if dictionary_id:
+        with open(dictionary_path(os.path.dirname(path), dictionary_id), "rb") as file:
+            dictionary = file.read()
+    return ReportCodec(METHODS[method_id], dictionary).decode(data)
+
+# Supporting functions ----------------------------
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd compression needs the "zstandard" package: pip install zstandard') from None
+    return zstandard
+
+def _sample_reports(cnx, count: int):
+    """
+    Returns up to count saved reports, spread over the whole Reports table (every nth report).
+    """
+    total = fetch_all(cnx, "Reports", select="COUNT(*) AS total")[0].total
+    step = max(1, total // count)
+    reports = []
+    position = 0
+    for chunk in read_iter(cnx, "Reports", select="Reports_id, report, report_data", as_frame=False):
+        for _, report, report_data in chunk:
+            if position % step == 0 and len(reports) < count:
+                reports.append(unpack_report(cnx, report, report_data))
+            position += 1
+    return reports
+
+def print_stats(name: str, stats: dict):
+    print(f"{name:<26} {stats['json_bytes'] / stats['reports']:7.0f} -> {stats['encoded_bytes'] / stats['reports']:5.0f} bytes/report"
+          f"  ratio {stats['ratio']:5.2f}  encode {stats['encode_MB_per_s']:6.1f} MB/s  decode {stats['decode_MB_per_s']:6.1f} MB/s")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and measure the dictionaries used to compress saved reports.")
+    parser.add_argument("command", choices=("train", "stats"),
+                        help="train: build a dictionary from saved reports and store it; stats: compare the codecs")
+    parser.add_argument("--method", choices=tuple(METHOD_IDS), default="zlib", help="the compression method (default: zlib)")
+    parser.add_argument("--size", type=int, default=DEFAULT_DICTIONARY_SIZE,
+                        help=f"the dictionary size in bytes (default: {DEFAULT_DICTIONARY_SIZE})")
+    parser.add_argument("--samples", type=int, default=DEFAULT_TRAINING_SAMPLES,
+                        help=f"saved reports to train and measure on (default: {DEFAULT_TRAINING_SAMPLES})")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite database at PATH instead of config.json")
+    args = parser.parse_args(argv)
+
+    config = {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1} if args.sqlite else load_config()
+    if not config:
+        parser.error("config.json couldn't be loaded; use --sqlite to pick a SQLite database")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database")
+        return 1
+
+    try:
+        reports = _sample_reports(cnx, args.samples)
+        if not reports:
+            print("There are no saved reports to work from")
+            return 1
+
+        if args.command == "train":
+            dictionary = train_dictionary(reports, args.size, args.method)
+            dictionary_id = save_dictionary(cnx, dictionary, args.method)
+            print(f"Saved {args.method} dictionary {dictionary_id} ({len(dictionary)} bytes), "
+                  f"trained on {len(reports)} reports")
+            print(f'Set "report_codec": "{args.method}" in config.json to compress newly saved reports with it')
+
+        print_stats(f"{args.method}, no dictionary", measure(ReportCodec(args.method), reports))
+        newest = [dictionary for method, dictionary in load_dictionaries(cnx).values() if method == args.method]
+        if newest:
+            dictionary_codec = ReportCodec(args.method, newest[-1])
+            print_stats(f"{args.method}, dictionary", measure(dictionary_codec, reports))
+            print_stats(f"{args.method}, dictionary (stored)",
+                        measure(dictionary_codec, [{key: value for key, value in report.items() if key not in INDEXED_FIELDS}
+                                                   for report in reports]))
+    finally:
+        close_database(cnx)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
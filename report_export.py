@@ -0,0 +1,289 @@
+"""
+report_export.py
+Exports many reports to JSON, compressed JSON or PDF files in report_out/ without the GUI, spread over every CPU core.
+
+The main process makes or reads the reports and hands them to a pool of worker processes in batches.
+The workers serialize (or compress, see report_codec.py, or render, see report_pdf.py) the reports and write the files. Only a few batches per worker are queued at a time,
+so a slow disk holds back the reading instead of filling memory. Every file is written under a temporary
+name and renamed into place, so report_out/ never holds a half-written report.
+
+Reports can come from:
+* generate_reports(), for the MRNs in a file or on stdin (one per line), or for --all patients
+* the Reports table (--saved), exported as they were saved, one file per saved report
+* the Latest_reports table (--latest), each patient's latest saved report
+
+Examples:
+$> python report_export.py mrns.txt
+$> python report_export.py --all --workers 8 --out-dir nightly/2024-06-30
+$> python report_export.py --all --format pdf
+$> python report_export.py --all --format jsonz
+$> python report_export.py --saved --where "date >= '2024-01-01'" --sqlite scale_test.db
+$> python report_export.py --latest --where "report_date < '2024-01-01'"
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from db_interface import start_database, close_database, load_config, read_iter, DEFAULT_BATCH_SIZE
+from db_instrumentation import setup_logging
+from report_codec import (ReportCodec, get_codec, get_dictionary_id, load_dictionaries, unpack_report,
+                          write_dictionary_file)
+from report_history import rebuild_reports
+from app import generate_reports, report_filename, write_report_file, date_format, REPORT_DIR
+from batch_reports import read_MRNs, all_MRNs
+
+logger = logging.getLogger("supplicore.export")
+
+# Reports sent to a worker at a time
+DEFAULT_EXPORT_BATCH = 250
+
+# Batches queued per worker, waiting to be written
+PENDING_BATCHES_PER_WORKER = 2
+
+# "jsonz" is JSON compressed by report_codec, with the dictionary saved next to the files
+FILE_FORMATS = ("json", "jsonz", "pdf")
+
+# Worker processes' codecs, by (method, dictionary ID), so each is set up once per process
+_worker_codecs = {}
+
+def export_reports(reports, out_dir: str = REPORT_DIR, workers: int = None, batch_size: int = DEFAULT_EXPORT_BATCH,
+                   progress_every: float = 1.0, progress=None, file_format: str = "json", layout_path: str = None,
+                   codec=None):
+    """
+    Writes reports to JSON, compressed JSON or PDF files with a pool of worker processes.
+    * Parameters:
+        * reports: iterable of (filename, report) - report is a dict, or a str of JSON already serialized.
+          filename can be None, to use report_filename().
+        * out_dir: str - the folder the reports are written to
+        * workers: int - worker processes (default: one per CPU core)
+        * batch_size: int - reports sent to a worker at a time
+        * progress_every: float - seconds between calls to progress
+        * progress: function taking the stats so far (default: print a line to stderr)
+        * file_format: str - "json", "jsonz" or "pdf"
+        * layout_path: str - for PDFs, a JSON layout file (default: report_pdf.DEFAULT_LAYOUT)
+        * codec: ReportCodec - for "jsonz", the codec to compress with (default: no dictionary)
+    * Returns:
+        * dict - "reports", "bytes", "failed", "seconds", "reports_per_s" and "MB_per_s"
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unknown file format {file_format!r}, expected one of {FILE_FORMATS}")
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * PENDING_BATCHES_PER_WORKER
+    progress = progress or print_progress
+
+    # Workers get the method and dictionary, and set up their own codec once
+    codec_settings = None
+    if file_format == "jsonz":
+        codec = codec or ReportCodec()
+        write_dictionary_file(out_dir, codec)
+        codec_settings = (codec.method, codec.dictionary, codec.level)
+
+    stats = {"reports": 0, "bytes": 0, "failed": 0, "seconds": 0.0, "reports_per_s": 0.0, "MB_per_s": 0.0}
+    start = time.perf_counter()
+    last_progress = start
+
+    def collect(futures):
+        nonlocal last_progress
+        for future in futures:
+            written, written_bytes, failures = future.result()
+            stats["reports"] += written
+            stats["bytes"] += written_bytes
+            stats["failed"] += len(failures)
+            for filename, error in failures:
+                logger.error("Couldn't write %s: %s", filename, error)
+
+        now = time.perf_counter()
+        _update_rates(stats, now - start)
+        if now - last_progress >= progress_every:
+            progress(stats)
+            last_progress = now
+
+    reports = iter(reports)
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        while True:
+            batch = list(islice(reports, batch_size))
+            if not batch:
+                break
+
+            # Wait for a worker to finish a batch before queueing another
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(_write_batch, batch, out_dir, file_format, layout_path, codec_settings))
+
+        collect(wait(pending).done)
+
+    _update_rates(stats, time.perf_counter() - start)
+    return stats
+
+def generated_reports(cnx, MRNs, chunk_size: int = DEFAULT_BATCH_SIZE, curr_date=None):
+    """
+    Yields (filename, report) pairs for export_reports() from generate_reports().
+    """
+    for report in generate_reports(cnx, MRNs, chunk_size, curr_date):
+        yield None, report
+
+def saved_reports(cnx, out_dir: str = REPORT_DIR, where: str = "*", params: dict = None, extension: str = ".json"):
+    """
+    Yields (filename, report) pairs for export_reports() from the Reports table, with the report JSON as saved.
+    Compressed reports (see report_codec.py) are decoded, and reports saved as changes (see report_history.py)
+    are rebuilt, so every file holds a whole report.
+    Files are named "<MRN>-(<date>)-<Reports_id>.json", since a patient can have several reports on one day.
+    """
+    for chunk in read_iter(cnx, "Reports", select="Reports_id, MRN, date, snapshot_id, report, report_data",
+                           where=where, params=params, as_frame=False):
+        # Whole, uncompressed reports are passed on as the JSON text they were saved as
+        snapshot_ids = {row[3] for row in chunk if row[3] is not None}
+        stored = [(report_id, snapshot_id, report, report_data)
+                  for report_id, _, _, snapshot_id, report, report_data in chunk
+                  if snapshot_id is not None or report_data is not None or report_id in snapshot_ids]
+        rebuilt = dict(zip((row[0] for row in stored), rebuild_reports(cnx, stored)))
+
+        for report_id, MRN, date, _, report, _ in chunk:
+            if isinstance(date, str):
+                date = datetime.datetime.fromisoformat(date)
+            if report_id in rebuilt:
+                report = rebuilt[report_id]
+            elif not isinstance(report, str):
+                report = json.dumps(report)
+            yield os.path.join(out_dir, f"{MRN}-({date.strftime(date_format)})-{report_id}{extension}"), report
+
+def latest_reports(cnx, out_dir: str = REPORT_DIR, where: str = "*", params: dict = None, extension: str = ".json"):
+    """
+    Yields (filename, report) pairs for export_reports() from the Latest_reports table, each patient's latest report.
+    Files are named like saved_reports() names them.
+    """
+    for chunk in read_iter(cnx, "Latest_reports", select="MRN, Reports_id, report_date, report, report_data",
+                           where=where, params=params, as_frame=False):
+        for MRN, report_id, report_date, report, report_data in chunk:
+            if report_data is not None:
+                report = unpack_report(cnx, report, report_data)
+            elif not isinstance(report, str):
+                report = json.dumps(report)
+            yield os.path.join(out_dir, f"{MRN}-({report_date})-{report_id}{extension}"), report
+
+def print_progress(stats):
+    print(f"Exported {stats['reports']} reports ({stats['reports_per_s']:.0f} reports/s, "
+          f"{stats['MB_per_s']:.1f} MB/s)", file=sys.stderr)
+
+# Supporting functions ----------------------------
+def _write_batch(batch, out_dir, file_format="json", layout_path=None, codec_settings=None):
+    """
+    Runs in a worker process. Serializes (or compresses, or renders) and writes a batch of reports.
+    Returns the reports written, their size in bytes and a list of (filename, error) for the ones that failed.
+    """
+    if file_format == "pdf":
+        from report_pdf import render_report
+    elif file_format == "jsonz":
+        codec = _worker_codec(*codec_settings)
+
+    written = 0
+    written_bytes = 0
+    failures = []
+    for filename, report in batch:
+        try:
+            filename = filename or report_filename(report, out_dir, f".{file_format}")
+            if file_format == "pdf":
+                data = render_report(report, layout_path)
+            elif file_format == "jsonz":
+                data = codec.encode(json.loads(report) if isinstance(report, str) else report)
+            else:
+                # Written as UTF-8 bytes, so the size counted is the size on disk
+                data = (report if isinstance(report, str) else json.dumps(report, default=str)).encode("utf-8")
+            write_report_file(data, out_dir, filename)
+        except (OSError, TypeError, ValueError, KeyError) as error:
+            failures.append((filename, str(error)))
+            continue
+        written += 1
+        written_bytes += len(data)
+    return written, written_bytes, failures
+
+def _worker_codec(method, dictionary, level):
+    key = (method, get_dictionary_id(dictionary), level)
+    if key not in _worker_codecs:
+        _worker_codecs[key] = ReportCodec(method, dictionary, level)
+    return _worker_codecs[key]
+
+def _update_rates(stats, seconds):
+    stats["seconds"] = seconds
+    stats["reports_per_s"] = stats["reports"] / seconds if seconds else 0.0
+    stats["MB_per_s"] = stats["bytes"] / seconds / 1_000_000 if seconds else 0.0
+
+def _file_codec(cnx):
+    """
+    Returns a codec for compressed report files, with the newest dictionary in the database (or none).
+    """
+    codec = get_codec(cnx)
+    if codec.dictionary:
+        return codec
+    newest = list(load_dictionaries(cnx).values())
+    return ReportCodec(*newest[-1]) if newest else ReportCodec()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export SuppliCore reports to JSON files, using every CPU core.")
+    parser.add_argument("mrn_file", nargs="?", default="-", help="file with one MRN per line (default: stdin)")
+    parser.add_argument("--all", action="store_true", help="generate and export a report for every patient")
+    parser.add_argument("--saved", action="store_true", help="export the reports saved in the Reports table")
+    parser.add_argument("--latest", action="store_true", help="export each patient's latest saved report")
+    parser.add_argument("--where", default="*", help="--saved, --latest: only export reports matching this WHERE clause")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="the generated reports' date (default: today)")
+    parser.add_argument("--format", choices=FILE_FORMATS, default="json", help="the file format; jsonz is compressed JSON (default: json)")
+    parser.add_argument("--layout", help="--format pdf: a JSON layout file (default: the built-in layout)")
+    parser.add_argument("--out-dir", default=REPORT_DIR, help=f"the folder written to (default: {REPORT_DIR})")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU core)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_EXPORT_BATCH,
+                        help=f"reports sent to a worker at a time (default: {DEFAULT_EXPORT_BATCH})")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite database at PATH instead of config.json")
+    args = parser.parse_args(argv)
+
+    setup_logging("WARNING")
+
+    config = {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1} if args.sqlite else load_config()
+    if not config:
+        parser.error("config.json couldn't be loaded; use --sqlite to pick a SQLite database")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database", file=sys.stderr)
+        return 1
+
+    mrn_file = None
+    try:
+        if args.saved:
+            reports = saved_reports(cnx, args.out_dir, args.where, extension=f".{args.format}")
+        elif args.latest:
+            reports = latest_reports(cnx, args.out_dir, args.where, extension=f".{args.format}")
+        elif args.all:
+            reports = generated_reports(cnx, all_MRNs(cnx), curr_date=args.date)
+        else:
+            mrn_file = sys.stdin if args.mrn_file == "-" else open(args.mrn_file)
+            reports = generated_reports(cnx, read_MRNs(mrn_file), curr_date=args.date)
+
+        stats = export_reports(reports, args.out_dir, args.workers, args.batch_size, file_format=args.format,
+                               layout_path=args.layout, codec=_file_codec(cnx) if args.format == "jsonz" else None)
+    except ValueError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if mrn_file not in (None, sys.stdin):
+            mrn_file.close()
+        close_database(cnx)
+
+    print(f"Exported {stats['reports']} reports to {args.out_dir} in {stats['seconds']:.1f} s "
+          f"({stats['reports_per_s']:.0f} reports/s, {stats['MB_per_s']:.1f} MB/s)")
+    if stats["failed"]:
+        print(f"{stats['failed']} reports couldn't be written, see the log above")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
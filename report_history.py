@@ -0,0 +1,460 @@
+"""
+report_history.py
+Saves reports as revisions: a full report now and then, and in between only the fields that changed.
+
+Every row of the Reports table is a revision of a patient's report. A snapshot row (snapshot_id is NULL) holds
+the whole report. A delta row holds the fields that are copied into indexed columns (INDEXED_FIELDS in
+report_codec.py), so reports can still be searched by them, plus only the other fields that are different from
+its snapshot, the row snapshot_id points to. The fields removed since the snapshot are listed under "_removed"
+(REMOVED_KEY), so fields that are null in the report stay null.
+Every delta is against a snapshot rather than the revision before it, so any revision is rebuilt from at most
+two rows, which are read together in one query.
+
+A new snapshot is saved every SNAPSHOT_INTERVAL revisions of a patient, or sooner when the changes would be
+more than SNAPSHOT_RATIO of the report's size. Saving a report that is the same as the patient's last
+revision doesn't add a row.
+
+Deltas point at their snapshot with a foreign key, so a snapshot that deltas use can't be deleted on its own
+(the database refuses, with an IntegrityError). Delete revisions with delete_reports(), which first turns the
+snapshot's oldest remaining delta into a snapshot and saves the others against it.
+
+Revisions are in report date order. The revision on a date is read from the (MRN, report_date) index.
+Each patient's latest report is also kept whole in the Latest_reports table, updated in the same transaction
+that saves the revision, so reading it is one primary key lookup. Reports added without save_report()
+(generate_data.py, bulk_io.py imports) are added to it by refresh_latest_reports().
+
+Example:
+$> python report_history.py refresh-latest --sqlite scale_test.db
+"""
+import argparse
+import datetime
+import json
+import logging
+import sys
+import weakref
+from itertools import islice
+
+from db_interface import (start_database, close_database, load_config, checkout, fetch_one, fetch_by_keys, read_iter,
+                          upsert_many, upsert_statement, invalidate_cache, get_table_info, DEFAULT_BATCH_SIZE)
+from db_instrumentation import track_call
+from report_codec import INDEXED_FIELDS, pack_report, unpack_report
+
+# from sqlalchemy import text # imported in the functions that run queries, so SQLAlchemy doesn't slow down startup
+
+logger = logging.getLogger("supplicore.history")
+
+# Revisions per patient between snapshots, at most
+SNAPSHOT_INTERVAL = 20
+
+# A snapshot is saved instead of a delta when the changed fields are more than this fraction of the report
+SNAPSHOT_RATIO = 0.5
+
+# The key a delta lists the fields removed since its snapshot under. Report fields never start with "_".
+REMOVED_KEY = "_removed"
+
+# Revisions with their snapshot (for deltas) in the same row
+_REVISION_QUERY = """
+    SELECT r.Reports_id, r.MRN, r.report_date, r.snapshot_id, r.report, r.report_data,
+           s.report AS snapshot_report, s.report_data AS snapshot_report_data
+    FROM Reports r LEFT JOIN Reports s ON s.Reports_id = r.snapshot_id
+    WHERE {where}
+    ORDER BY {order_by}
+"""
+
+# Whether each connection's (engine's) database has the Latest_reports table, see _has_latest_reports()
+_latest_tables = weakref.WeakKeyDictionary()
+
+@track_call
+def save_report(cnx, report: dict):
+    """
+    Saves a report from the report page as a new revision, and as the patient's latest report in Latest_reports
+    unless the patient has a report with a later date (or the database doesn't have Latest_reports), in one transaction.
+    * Parameters:
+        * cnx - the connection to the database
+        * report: dict - as given by PageReportEditing.get_report_input()
+    * Returns:
+        * int - the new revision's Reports_id, or None if the report is the same as the patient's last revision
+    * Raises:
+        * ValueError: if the MRN or current_date isn't valid
+    """
+    from sqlalchemy import text
+
+    MRN = int(report["MRN"])
+    report_date = datetime.datetime.strptime(report["current_date"], "%Y-%m-%d").date()
+    date = report_date.strftime("%Y-%m-%d %H:%M:%S")
+    has_latest = _has_latest_reports(cnx)
+
+    try:
+        with checkout(cnx) as connection, connection.begin():
+            # The patient's last saved revision, and its snapshot
+            query = text(_REVISION_QUERY.format(where="r.MRN = :MRN", order_by="r.Reports_id DESC") + " LIMIT 1")
+            last = connection.execute(query, {"MRN": MRN}).first()
+
+            snapshot_id = None
+            stored = report
+            if last is not None:
+                snapshot, previous = _rebuild(cnx, last)
+                if previous == report:
+                    return None
+
+                snapshot_id = last.snapshot_id or last.Reports_id
+                changes = diff_reports(snapshot, report)
+                deltas = connection.execute(text("SELECT COUNT(*) FROM Reports WHERE snapshot_id = :snapshot_id"),
+                                            {"snapshot_id": snapshot_id}).scalar()
+                if deltas + 1 >= SNAPSHOT_INTERVAL or _size(changes) > _size(_unindexed(report)) * SNAPSHOT_RATIO:
+                    snapshot_id = None
+                else:
+                    stored = {**{key: value for key, value in report.items() if key in INDEXED_FIELDS}, **changes}
+
+            row = {"MRN": MRN, "date": date, "snapshot_id": snapshot_id, **pack_report(cnx, stored)}
+            result = connection.execute(text(
+                "INSERT INTO Reports (MRN, date, snapshot_id, report, report_data) "
+                "VALUES (:MRN, :date, :snapshot_id, :report, :report_data)"), row)
+            report_id = result.lastrowid
+            if not has_latest:
+                return report_id
+
+            latest = connection.execute(text("SELECT report_date FROM Latest_reports WHERE MRN = :MRN"),
+                                        {"MRN": MRN}).first()
+            if latest is None or latest.report_date is None or _as_date(latest.report_date) <= report_date:
+                latest_row = _latest_row(cnx, MRN, report_id, report_date, report)
+                connection.execute(upsert_statement(cnx, "Latest_reports", list(latest_row)), latest_row)
+            return report_id
+    finally:
+        invalidate_cache("Reports")
+        invalidate_cache("Latest_reports")
+
+@track_call
+def delete_reports(cnx, report_ids):
+    """
+    Deletes revisions from the Reports table in one transaction. Each deleted snapshot's oldest remaining delta is
+    saved whole as a new snapshot, and its other deltas are saved again as the changes from that one, so every
+    other revision stays the same. A patient whose latest revision is deleted drops out of Latest_reports
+    (ON DELETE CASCADE), so their latest report is read from the revisions left (see get_latest_report()).
+    * Parameters:
+        * cnx - the connection to the database
+        * report_ids: iterable of int - the Reports_ids
+    * Returns:
+        * int - the number of revisions deleted
+    """
+    from sqlalchemy import text, bindparam
+
+    report_ids = sorted(set(report_ids))
+    if not report_ids:
+        return 0
+
+    deltas_query = text(_REVISION_QUERY.format(where="r.snapshot_id IN :ids AND r.Reports_id NOT IN :ids",
+                                               order_by="r.snapshot_id, r.Reports_id")
+                        ).bindparams(bindparam("ids", expanding=True))
+    update_query = text("UPDATE Reports SET snapshot_id = :snapshot_id, report = :report, report_data = :report_data "
+                        "WHERE Reports_id = :Reports_id")
+
+    try:
+        with checkout(cnx) as connection, connection.begin():
+            # The deltas that would be left without their snapshot
+            groups = {}
+            for row in connection.execute(deltas_query, {"ids": report_ids}):
+                groups.setdefault(row.snapshot_id, []).append((row.Reports_id, _rebuild(cnx, row)[1]))
+
+            for revisions in groups.values():
+                snapshot_id, snapshot = revisions[0]
+                updates = [{"Reports_id": snapshot_id, "snapshot_id": None, **pack_report(cnx, snapshot)}]
+                for report_id, report in revisions[1:]:
+                    stored = {**{key: value for key, value in report.items() if key in INDEXED_FIELDS},
+                              **diff_reports(snapshot, report)}
+                    updates.append({"Reports_id": report_id, "snapshot_id": snapshot_id, **pack_report(cnx, stored)})
+                connection.execute(update_query, updates)
+
+            # Deltas before snapshots, for databases that check the foreign key after every row (MySQL)
+            deleted = 0
+            for condition in ("snapshot_id IS NOT NULL", "snapshot_id IS NULL"):
+                query = text(f"DELETE FROM Reports WHERE Reports_id IN :ids AND {condition}").bindparams(
+                    bindparam("ids", expanding=True))
+                deleted += connection.execute(query, {"ids": report_ids}).rowcount
+            return deleted
+    finally:
+        invalidate_cache("Reports")
+        invalidate_cache("Latest_reports")
+
+@track_call
+def get_latest_report(cnx, MRN: int):
+    """
+    Returns a patient's latest report (the newest report date, then the last saved), or None if there are none.
+    Read from Latest_reports, or from the patient's revisions if Latest_reports doesn't have the patient
+    (such as after the latest report was deleted) or the database doesn't have Latest_reports.
+    """
+    if not _has_latest_reports(cnx):
+        return get_report_at(cnx, MRN)
+    row = fetch_one(cnx, "Latest_reports", select="report, report_data", where="MRN = :MRN", params={"MRN": MRN})
+    if row is not None:
+        return unpack_report(cnx, row.report, row.report_data)
+    return get_report_at(cnx, MRN)
+
+@track_call
+def get_latest_reports(cnx, MRNs):
+    """
+    Returns many patients' latest reports from Latest_reports, in a few queries. Like get_latest_report(), the
+    patients Latest_reports doesn't have (such as after their latest report was deleted) are read from their revisions.
+    * Parameters:
+        * cnx - the connection to the database
+        * MRNs: iterable of int
+    * Returns:
+        * dict - {MRN: report}, without the patients that have no reports. Empty if the database doesn't have
+          Latest_reports (see migrations/005_latest_reports.sql), so reports are made without a previous report.
+    """
+    if not _has_latest_reports(cnx):
+        return {}
+    MRNs = set(MRNs)
+    rows = fetch_by_keys(cnx, "Latest_reports", "MRN", MRNs, select="MRN, report, report_data")
+    reports = {row.MRN: unpack_report(cnx, row.report, row.report_data) for row in rows}
+
+    missing = MRNs - reports.keys()
+    if missing:
+        latest = _latest_report_ids(fetch_by_keys(cnx, "Reports", "MRN", missing,
+                                                  select="Reports_id, MRN, report_date"))
+        rows = fetch_by_keys(cnx, "Reports", "Reports_id", [report_id for _, report_id in latest.values()],
+                             select="Reports_id, MRN, snapshot_id, report, report_data")
+        revisions = rebuild_reports(cnx, [(row.Reports_id, row.snapshot_id, row.report, row.report_data) for row in rows])
+        reports.update((row.MRN, report) for row, report in zip(rows, revisions))
+    return reports
+
+@track_call
+def refresh_latest_reports(cnx, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Fills in Latest_reports from the Reports table, for reports that weren't saved with save_report().
+    The Reports table is read once, keeping only the (report date, Reports_id) of each patient's latest report.
+    * Parameters:
+        * cnx - the connection to the database
+        * batch_size: int - patients rebuilt and written at a time
+    * Returns:
+        * int - the number of patients written (0 if the database doesn't have Latest_reports)
+    """
+    if not _has_latest_reports(cnx):
+        logger.warning("The database has no Latest_reports table; run migrations/005_latest_reports.sql")
+        return 0
+
+    latest = {}
+    for chunk in read_iter(cnx, "Reports", select="Reports_id, MRN, report_date", as_frame=False):
+        _latest_report_ids(chunk, latest)
+
+    count = 0
+    report_ids = iter([report_id for _, report_id in latest.values()])
+    while True:
+        batch = list(islice(report_ids, batch_size))
+        if not batch:
+            break
+
+        rows = fetch_by_keys(cnx, "Reports", "Reports_id", batch,
+                             select="Reports_id, MRN, report_date, snapshot_id, report, report_data")
+        reports = rebuild_reports(cnx, [(row.Reports_id, row.snapshot_id, row.report, row.report_data) for row in rows])
+        upsert_many(cnx, "Latest_reports", [_latest_row(cnx, row.MRN, row.Reports_id, _as_date(row.report_date), report)
+                                            for row, report in zip(rows, reports)])
+        count += len(rows)
+    return count
+
+@track_call
+def get_report_at(cnx, MRN: int, at=None):
+    """
+    Returns a patient's report as it was on a date: the last revision saved with a report date on or before it.
+    * Parameters:
+        * cnx - the connection to the database
+        * MRN: int - the patient
+        * at: date - the date (default: the latest revision)
+    * Returns:
+        * dict, or None if the patient has no reports by then
+    """
+    from sqlalchemy import text
+
+    where = "r.MRN = :MRN"
+    params = {"MRN": MRN}
+    if at is not None:
+        where += " AND r.report_date <= :at"
+        params["at"] = at.strftime("%Y-%m-%d")
+
+    with checkout(cnx) as connection:
+        query = text(_REVISION_QUERY.format(where=where, order_by=_date_order("DESC")) + " LIMIT 1")
+        row = connection.execute(query, params).first()
+    return _rebuild(cnx, row)[1] if row is not None else None
+
+@track_call
+def get_report_timeline(cnx, MRN: int, start_date=None, end_date=None):
+    """
+    Returns a patient's revisions in report date order, optionally between two dates, with what changed in each.
+    * Parameters:
+        * cnx - the connection to the database
+        * MRN: int - the patient
+        * start_date, end_date: date - the first and last report date (default: no limit)
+    * Returns:
+        * list of dict
+            * Reports_id: int
+            * report_date: date, or None if the report's date isn't valid
+            * snapshot: bool - whether the revision is saved as a whole report
+            * changed: list of str - the fields that are different from the revision before it
+              (every field, for the first revision returned)
+            * report: dict - the whole report
+    """
+    from sqlalchemy import text
+
+    where = "r.MRN = :MRN"
+    params = {"MRN": MRN}
+    for bound, operator, value in (("start_date", ">=", start_date), ("end_date", "<=", end_date)):
+        if value is not None:
+            where += f" AND r.report_date {operator} :{bound}"
+            params[bound] = value.strftime("%Y-%m-%d")
+
+    with checkout(cnx) as connection:
+        query = text(_REVISION_QUERY.format(where=where, order_by=_date_order("ASC")))
+        rows = connection.execute(query, params).all()
+
+    timeline = []
+    previous = {}
+    for row in rows:
+        report = _rebuild(cnx, row)[1]
+        changed = [key for key in report if previous.get(key) != report[key]]
+        changed += [key for key in previous if key not in report]
+        timeline.append({
+            "Reports_id": row.Reports_id,
+            "report_date": _as_date(row.report_date),
+            "snapshot": row.snapshot_id is None,
+            "changed": changed,
+            "report": report,
+        })
+        previous = report
+    return timeline
+
+def rebuild_reports(cnx, rows):
+    """
+    Rebuilds the whole reports of many Reports rows, such as a chunk from read_iter(), fetching the snapshots the
+    deltas need that aren't among the rows in one query.
+    * Parameters:
+        * cnx - the connection to the database
+        * rows: list of (Reports_id, snapshot_id, report, report_data)
+    * Returns:
+        * list of dict - in the same order as rows
+    """
+    stored = {report_id: (report, report_data) for report_id, snapshot_id, report, report_data in rows
+              if snapshot_id is None}
+    missing = {row[1] for row in rows if row[1] is not None} - stored.keys()
+    for row in fetch_by_keys(cnx, "Reports", "Reports_id", missing, select="Reports_id, report, report_data"):
+        stored[row.Reports_id] = (row.report, row.report_data)
+
+    snapshots = {}
+    reports = []
+    for report_id, snapshot_id, report, report_data in rows:
+        report = unpack_report(cnx, report, report_data)
+        if snapshot_id is not None:
+            if snapshot_id not in snapshots:
+                snapshots[snapshot_id] = unpack_report(cnx, *stored[snapshot_id])
+            report = apply_changes(snapshots[snapshot_id], report)
+        reports.append(report)
+    return reports
+
+def diff_reports(snapshot: dict, report: dict):
+    """
+    Returns the fields of report, other than INDEXED_FIELDS, that are different from snapshot,
+    and under REMOVED_KEY the list of fields snapshot has that report doesn't (if there are any).
+    """
+    changes = {key: value for key, value in report.items()
+               if key not in INDEXED_FIELDS and (key not in snapshot or snapshot[key] != value)}
+    removed = [key for key in snapshot if key not in report]
+    if removed:
+        changes[REMOVED_KEY] = removed
+    return changes
+
+def apply_changes(snapshot: dict, delta: dict):
+    """
+    Returns the report a delta row stands for: its snapshot with the delta's fields, leaving out the fields
+    listed under REMOVED_KEY.
+    """
+    removed = set(delta.get(REMOVED_KEY, ()))
+    report = {**snapshot, **delta}
+    return {key: value for key, value in report.items() if key not in removed and key != REMOVED_KEY}
+
+# Supporting functions ----------------------------
+def _rebuild(cnx, row):
+    """
+    Returns (snapshot, report) for a row of _REVISION_QUERY. For a snapshot row, both are the row's report.
+    """
+    report = unpack_report(cnx, row.report, row.report_data)
+    if row.snapshot_id is None:
+        return report, report
+    snapshot = unpack_report(cnx, row.snapshot_report, row.snapshot_report_data)
+    return snapshot, apply_changes(snapshot, report)
+
+def _latest_row(cnx, MRN: int, report_id: int, report_date, report: dict):
+    """
+    Returns the Latest_reports row for a patient's latest report, with the report packed like in Reports.
+    """
+    return {
+        "MRN": MRN,
+        "Reports_id": report_id,
+        "report_date": report_date.strftime("%Y-%m-%d") if report_date else None,
+        **pack_report(cnx, report),
+    }
+
+def _latest_report_ids(rows, latest=None):
+    """
+    Returns {MRN: (report date, Reports_id)} of each patient's latest revision among rows of
+    (Reports_id, MRN, report_date), the order get_report_at() uses, updating latest if it's given.
+    """
+    latest = {} if latest is None else latest
+    for report_id, MRN, report_date in rows:
+        key = (_as_date(report_date) or datetime.date.min, report_id)
+        if MRN not in latest or key > latest[MRN]:
+            latest[MRN] = key
+    return latest
+
+def _has_latest_reports(cnx):
+    """
+    Returns True if the database has the Latest_reports table. Databases made before it was added still work,
+    reading patients' latest reports from their revisions. Checked once per connection.
+    """
+    exists = _latest_tables.get(cnx)
+    if exists is None:
+        try:
+            get_table_info(cnx, "Latest_reports")
+            exists = True
+        except ValueError:
+            exists = False
+        _latest_tables[cnx] = exists
+    return exists
+
+def _date_order(direction: str):
+    return f"r.report_date {direction}, r.Reports_id {direction}"
+
+def _unindexed(report: dict):
+    return {key: value for key, value in report.items() if key not in INDEXED_FIELDS}
+
+def _size(fields: dict):
+    return len(json.dumps(fields))
+
+def _as_date(value):
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the report history tables.")
+    parser.add_argument("command", choices=("refresh-latest",),
+                        help="refresh-latest: fill in Latest_reports from the saved reports")
+    parser.add_argument("--sqlite", metavar="PATH", help="use the SQLite database at PATH instead of config.json")
+    args = parser.parse_args(argv)
+
+    config = {"backend": "sqlite", "sqlite_path": args.sqlite, "pool_warmup": 1} if args.sqlite else load_config()
+    if not config:
+        parser.error("config.json couldn't be loaded; use --sqlite to pick a SQLite database")
+
+    cnx = start_database(config, interactive=False)
+    if not cnx:
+        print("Couldn't connect to the database")
+        return 1
+
+    try:
+        count = refresh_latest_reports(cnx)
+        print(f"Updated the latest report of {count} patients")
+    finally:
+        close_database(cnx)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
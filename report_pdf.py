@@ -0,0 +1,262 @@
+"""
+report_pdf.py
+Renders reports as one-page PDF files, using only the standard library.
+
+A layout (the default one below, or a JSON file in the same format) is compiled once into a ReportLayout.
+Everything that is the same on every page (titles, labels, lines, fonts and the PDF objects around the page)
+is built at that point, and each field gets a fixed place with a fixed number of lines. Rendering a report
+then only wraps, escapes and places its values. Compiled layouts are cached by get_layout(), so each
+process compiles a layout once however many reports it renders.
+
+The text uses the standard Helvetica fonts, which every PDF reader has, so no font files are embedded.
+
+Examples:
+$> python report_pdf.py "report_out/123456-(2024-06-30).json"
+$> python report_pdf.py report_out/*.json --out-dir pdf_out --workers 4
+$> python report_pdf.py report_out/*.jsonz
+$> python report_export.py --all --format pdf
+"""
+import argparse
+import json
+import os
+import sys
+from functools import lru_cache
+
+# Page sizes in points (1/72 inch)
+PAGE_SIZES = {"letter": (612, 792), "a4": (595, 842)}
+
+DEFAULT_LAYOUT = {
+    "page_size": "letter",
+    "margin": 54,
+    "font_size": 10,
+    "title": "SuppliCore Nutrition Report",
+    "sections": [
+        {"title": "Patient", "columns": 2, "fields": [
+            {"label": "Name", "key": "name"},
+            {"label": "MRN", "key": "MRN"},
+            {"label": "Sex", "key": "sex"},
+            {"label": "DOB", "key": "DOB"},
+            {"label": "Date", "key": "current_date"},
+            {"label": "Age", "key": "age"},
+            {"label": "Weight (kg)", "key": "weight_kg"},
+        ]},
+        {"title": "Feeding", "columns": 1, "fields": [
+            {"label": "Feeding schedule", "key": "feeding_schedule", "lines": 3},
+            {"label": "Method of delivery", "key": "method_of_delivery", "lines": 2},
+            {"label": "Home recipe", "key": "home_recipe", "lines": 6},
+            {"label": "Fluids", "key": "fluids", "lines": 3},
+            {"label": "Solids", "key": "solids", "lines": 3},
+        ]},
+        {"title": "Calculations", "columns": 1, "label_width": 220, "fields": [
+            {"label": "Holliday-Segar - Maintenance (mL/day)", "key": "maintenance"},
+            {"label": "Holliday-Segar - Sick Day (mL/day)", "key": "sick_day"},
+            {"label": "WHO REE (kcal/day)", "key": "WHO_REE"},
+        ]},
+    ],
+}
+
+# Widths of the characters " " to "~" in Helvetica, in 1/1000 of the font size (from the font's AFM metrics)
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+
+# Width of every WinAnsi character code. Characters outside " " to "~" are given the width of a digit.
+CHARACTER_WIDTHS = [556] * 32 + list(_HELVETICA_WIDTHS) + [556] * 129
+
+# Report keys shown as "Label: value" text in reports saved from the report page, and the layout key for each
+_LABELLED_KEYS = {"age": "age", "Holliday_Segar_m": "maintenance", "Holliday_Segar_s": "sick_day", "WHO_REE": "WHO_REE"}
+
+class ReportLayout:
+    """
+    A layout compiled for fast rendering. Made by get_layout().
+    """
+    def __init__(self, layout: dict):
+        page_width, page_height = PAGE_SIZES[layout.get("page_size", "letter")]
+        margin = layout.get("margin", 54)
+        font_size = layout.get("font_size", 10)
+        line_height = font_size * 1.35
+        label_width = layout.get("label_width", 150)
+
+        static = [f"0.6 G 0.75 w\nBT /F2 16 Tf 1 0 0 1 {margin} {page_height - margin - 16} Tm ({_escape(layout.get('title', ''))}) Tj ET"]
+        self.fields = []  # (key, max width, [text position per line])
+
+        y = page_height - margin - 16 - line_height * 2
+        for section in layout["sections"]:
+            # Section title, with a line under it
+            static.append(f"BT /F2 {font_size + 2} Tf 1 0 0 1 {margin} {y:.2f} Tm ({_escape(section['title'])}) Tj ET")
+            static.append(f"{margin} {y - 4:.2f} m {page_width - margin} {y - 4:.2f} l S")
+            y -= line_height * 1.6
+
+            columns = section.get("columns", 1)
+            column_width = (page_width - margin * 2) / columns
+            field_label_width = min(section.get("label_width", label_width), column_width / 2)
+            for start in range(0, len(section["fields"]), columns):
+                row = section["fields"][start:start + columns]
+                row_lines = max(field.get("lines", 1) for field in row)
+                for column, field in enumerate(row):
+                    x = margin + column * column_width
+                    static.append(f"BT /F2 {font_size} Tf 1 0 0 1 {x:.2f} {y:.2f} Tm ({_escape(field['label'])}:) Tj ET")
+                    positions = [f"1 0 0 1 {x + field_label_width:.2f} {y - line * line_height:.2f} Tm (".encode()
+                                 for line in range(field.get("lines", 1))]
+                    self.fields.append((field["key"], column_width - field_label_width - 6, positions))
+                y -= row_lines * line_height
+            y -= line_height
+
+        self.font_size = font_size
+        self.value_font = f"BT /F1 {font_size} Tf\n".encode()
+        self.static_stream = ("\n".join(static) + "\n").encode()
+
+        # The PDF objects before the page contents never change, so they are built once with their offsets
+        objects = [
+            "<< /Type /Catalog /Pages 2 0 R >>",
+            "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+            "/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>",
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ]
+        head = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(head))
+            head += f"{number} 0 obj\n{body}\nendobj\n".encode()
+        self.head = head
+        self.xref_entries = b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+
+    def render(self, report: dict):
+        """
+        Returns the report as the bytes of a PDF file.
+        """
+        values = report_values(report)
+        stream = [self.static_stream, self.value_font]
+        for key, max_width, positions in self.fields:
+            text = values.get(key, "")
+            if not text:
+                continue
+            for position, line in zip(positions, wrap_text(text, max_width, self.font_size, len(positions))):
+                stream.append(position)
+                stream.append(line)
+                stream.append(b") Tj\n")
+        stream.append(b"ET\n")
+        stream = b"".join(stream)
+
+        contents = b"6 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n" % (len(stream), stream)
+        xref_offset = len(self.head) + len(contents)
+        contents_offset = b"%010d 00000 n \n" % len(self.head)
+        return b"".join((
+            self.head, contents,
+            b"xref\n0 7\n0000000000 65535 f \n", self.xref_entries, contents_offset,
+            b"trailer\n<< /Size 7 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % xref_offset,
+        ))
+
+@lru_cache(maxsize=16)
+def get_layout(path: str = None):
+    """
+    Returns a compiled layout, reading and compiling it only the first time it is asked for.
+    * Parameters:
+        * path: str - a JSON layout file in the format of DEFAULT_LAYOUT (default: DEFAULT_LAYOUT)
+    * Returns:
+        * ReportLayout
+    """
+    if path is None:
+        return ReportLayout(DEFAULT_LAYOUT)
+    with open(path) as file:
+        return ReportLayout(json.load(file))
+
+def render_report(report, layout_path: str = None):
+    """
+    Renders a report as a PDF.
+    * Parameters:
+        * report: dict, or str of JSON - from generate_report(), or from the report page
+        * layout_path: str - a JSON layout file (default: DEFAULT_LAYOUT)
+    * Returns:
+        * bytes - the PDF file
+    """
+    if isinstance(report, str):
+        report = json.loads(report)
+    return get_layout(layout_path).render(report)
+
+def report_values(report: dict):
+    """
+    Returns the text shown for each layout key, for both report layouts: the one made by generate_report(),
+    and the flat one saved from the report page, whose age and calculations are "Label: value" text.
+    """
+    if "header" not in report:
+        values = {key: str(value) for key, value in report.items()}
+        for report_key, key in _LABELLED_KEYS.items():
+            text = values.pop(report_key, "")
+            values[key] = text.partition(": ")[2] if ": " in text else text
+        return values
+
+    values = {key: str(value) for key, value in report["header"].items()}
+    values["age"] = f"{report['header']['age']} {report['header']['age_unit']}"
+    values["maintenance"] = _number(report["calculations"]["Holliday-Segar"]["maintenance"])
+    values["sick_day"] = _number(report["calculations"]["Holliday-Segar"]["sick_day"])
+    values["WHO_REE"] = _number(report["calculations"]["WHO_REE"])
+    return values
+
+def wrap_text(text: str, max_width: float, font_size: float, max_lines: int):
+    """
+    Splits text into at most max_lines lines that fit in max_width points, ending with "..." if it doesn't fit.
+    * Returns:
+        * list of bytes - the lines, encoded and escaped for a PDF string
+    """
+    max_units = max_width * 1000 / font_size
+    lines = []
+    for paragraph in text.encode("cp1252", "replace").split(b"\n"):
+        line = b""
+        line_units = 0
+        for word in paragraph.split():
+            word_units = sum(CHARACTER_WIDTHS[character] for character in word)
+            space_units = CHARACTER_WIDTHS[32] if line else 0
+            if line and line_units + space_units + word_units > max_units:
+                lines.append(line)
+                line, line_units, space_units = b"", 0, 0
+            line = line + b" " + word if line else word
+            line_units += space_units + word_units
+        lines.append(line)
+
+    if len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] = lines[-1] + b"..."
+    return [_escape_bytes(line) for line in lines]
+
+# Supporting functions ----------------------------
+def _number(value):
+    return str(round(value, 2)) if isinstance(value, float) else str(value)
+
+def _escape(text: str):
+    return _escape_bytes(text.encode("cp1252", "replace")).decode("cp1252")
+
+def _escape_bytes(text: bytes):
+    return text.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)").replace(b"\r", b"")
+
+def main(argv=None):
+    from report_export import export_reports
+    from report_codec import read_report_file
+
+    parser = argparse.ArgumentParser(description="Render SuppliCore reports saved as JSON files as PDF files.")
+    parser.add_argument("files", nargs="+", help="the report .json files, or compressed .jsonz files")
+    parser.add_argument("--out-dir", help="the folder the PDFs are written to (default: next to each report)")
+    parser.add_argument("--layout", help="a JSON layout file (default: the built-in layout)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU core)")
+    args = parser.parse_args(argv)
+
+    def reports():
+        for path in args.files:
+            out_dir = args.out_dir or os.path.dirname(path)
+            pdf_path = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+            yield pdf_path, read_report_file(path)
+
+    get_layout(args.layout)  # reports a bad layout file before any work is done
+    stats = export_reports(reports(), args.out_dir or ".", args.workers, file_format="pdf", layout_path=args.layout)
+    print(f"Rendered {stats['reports']} reports in {stats['seconds']:.1f} s ({stats['reports_per_s']:.0f} pages/s)")
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
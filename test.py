@@ -1,22 +1,760 @@
+import csv
+import datetime
+import gc
+import json
+import os
+import random
+import re
+import tempfile
+import time
 import unittest
 
 # Import the module or functions you want to test
-from app import *
-from GUI import *
+from app import calculate_age, apply_calculations, empty_report
+from calculations import calculate_ages, holliday_segar, who_ree
+from db_interface import (start_database, close_database, create_many, upsert_many, delete_many, fetch_all,
+                          read_page, search_entries, get_table_info, get_table_names, get_pool_stats, _keyset_condition,
+                          _number_prefix_ranges, create_sqlite_engine, read, update, raw_sql, configure_result_cache,
+                          get_cache_stats, _cache_token, find_reports)
+from db_instrumentation import QueryMetrics, metrics, normalize_sql, LATENCY_BUCKETS
+from bulk_io import coerce_chunk, import_table
+from report_codec import ReportCodec, train_dictionary, configure_codec, pack_report, unpack_report
+from analytics_export import export_snapshot, read_snapshot
+from report_pdf import render_report, wrap_text, CHARACTER_WIDTHS
+from report_history import (save_report, delete_reports, get_latest_report, get_latest_reports, get_report_at,
+                            get_report_timeline)
 
-class TestApp(unittest.TestCase):
+def start_test_database():
+    """
+    Returns a connection to a new, empty in-memory SQLite database, with one medical condition for patients to refer to.
+    """
+    cnx = start_database({"backend": "sqlite", "sqlite_path": ":memory:", "pool_warmup": 1})
+    create_many(cnx, "Medical_conditions", [{"name": "None"}])
+    return cnx
+
+def add_patients(cnx, MRNs, last_names=("Smith",)):
+    """
+    Adds a patient for each MRN, with last names taken in turn from last_names.
+    """
+    create_many(cnx, "Patients", [{
+        "MRN": MRN, "f_name": f"First{MRN}", "m_name": None, "l_name": last_names[i % len(last_names)], "sex": "F",
+        "DOB": datetime.date(2015, 1, 1), "weight_kg": 20.0, "Medical_conditions_id": 1,
+    } for i, MRN in enumerate(MRNs)])
+
+def sample_report(MRN, day, **fields):
+    """
+    Returns a report in the layout saved from the report page.
+    """
+    report = {
+        "MRN": str(MRN), "name": "Smith, Ann", "sex": "F", "DOB": "2015-01-01",
+        "current_date": (datetime.date(2024, 1, 1) + datetime.timedelta(days=day)).strftime("%Y-%m-%d"),
+        "age": "Age: 9 years", "weight_kg": "20.0", "feeding_schedule": "Every 3 hours", "method_of_delivery": "Oral",
+        "home_recipe": "", "fluids": "1500 mL", "solids": "Purees",
+        "Holliday_Segar_m": "Maintenance: 1500.0", "Holliday_Segar_s": "Sick Day: 2250.0", "WHO_REE": "WHO REE: 949.0",
+    }
+    report.update(fields)
+    return report
+
+class TestCalculations(unittest.TestCase):
     def setUp(self):
         """
-        This method is called before each test. Used to set up any preconditions or variables.
+        This method is called before each test. Dates on each side of the day, month and year boundaries,
+        including leap days and the ends of months.
         """
-        self.sample_data = {"key": "value"}
+        self.today = datetime.date(2024, 3, 1)
+        births = [datetime.date(2024, 3, 1), datetime.date(2024, 2, 29), datetime.date(2024, 2, 1),
+                  datetime.date(2024, 1, 31), datetime.date(2023, 3, 2), datetime.date(2023, 3, 1),
+                  datetime.date(2023, 2, 28), datetime.date(2020, 2, 29), datetime.date(2013, 3, 2),
+                  datetime.date(2013, 3, 1), datetime.date(2010, 12, 31)]
+        rng = random.Random(17)
+        births += [self.today - datetime.timedelta(days=rng.randint(0, 20 * 365)) for _ in range(2000)]
+        self.births = births
+
+    def test_ages_match(self):
+        ages, units = calculate_ages(self.births, self.today)
+        for DOB, age, unit in zip(self.births, ages, units):
+            self.assertEqual(calculate_age(DOB, self.today), {"age": int(age), "age_unit": str(unit)}, DOB)
+
+    def test_ages_match_on_many_dates(self):
+        # Every day of a leap year, for births on month ends and a leap day
+        days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(366)]
+        for DOB in (datetime.date(2023, 1, 31), datetime.date(2023, 12, 31), datetime.date(2020, 2, 29)):
+            ages, units = calculate_ages([DOB] * len(days), days)
+            for day, age, unit in zip(days, ages, units):
+                self.assertEqual(calculate_age(DOB, day), {"age": int(age), "age_unit": str(unit)}, (DOB, day))
+
+    def test_calculations_match(self):
+        # The Holliday-Segar bands change at 10 and 20 kg, and WHO REE at ages 3 and 10
+        weights = [0.5, 9.99, 10.0, 10.01, 19.99, 20.0, 20.01, 75.3]
+        patients = [(weight, sex, age) for weight in weights for sex in ("M", "F", "X") for age in (0, 3, 4, 10, 11)]
+        maintenance, sick_day = holliday_segar([patient[0] for patient in patients])
+        WHO_REE = who_ree(*zip(*patients))
+        for i, (weight, sex, age) in enumerate(patients):
+            report = empty_report()
+            report["header"].update({"weight_kg": weight, "sex": sex, "age": age})
+            calculations = apply_calculations(report)["calculations"]
+            self.assertAlmostEqual(calculations["Holliday-Segar"]["maintenance"], maintenance[i])
+            self.assertAlmostEqual(calculations["Holliday-Segar"]["sick_day"], sick_day[i])
+            self.assertAlmostEqual(calculations["WHO_REE"], WHO_REE[i])
+
+class TestPool(unittest.TestCase):
+    def test_wait_stats_per_engine(self):
+        first, second = start_test_database(), start_test_database()
+        try:
+            before = get_pool_stats(second)["checkouts"]
+            for _ in range(5):
+                fetch_all(first, "Medications")
+            self.assertEqual(get_pool_stats(second)["checkouts"], before)
+            self.assertGreaterEqual(get_pool_stats(first)["checkouts"], 5)
+        finally:
+            close_database(first)
+            close_database(second)
+
+class TestStartDatabase(unittest.TestCase):
+    def test_not_interactive(self):
+        # Errors are only logged, with no popup waiting for an answer
+        with tempfile.TemporaryDirectory() as directory:
+            config = {"backend": "sqlite", "sqlite_path": os.path.join(directory, "missing", "supplicore.db")}
+            with self.assertLogs("supplicore.db", "ERROR"):
+                self.assertIsNone(start_database(config, interactive=False))
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+        create_many(self.cnx, "Medications", [{"name": "Drug A"}, {"name": "Drug B"}])
+
+    def tearDown(self):
+        configure_result_cache(enabled=False)
+        close_database(self.cnx)
+
+    def names(self, cnx=None, where="*"):
+        return read(cnx or self.cnx, "Medications", select="name", where=where)["name"].tolist()
+
+    def stats(self, *keys):
+        stats = get_cache_stats()
+        return tuple(stats[key] for key in keys)
+
+    def test_repeated_read_is_a_hit(self):
+        configure_result_cache()
+        first = read(self.cnx, "Medications")
+        first.loc[0, "name"] = "Changed"  # results are copies, so this doesn't change the cache
+        self.assertEqual(read(self.cnx, "Medications")["name"].tolist(), ["Drug A", "Drug B"])
+        self.assertEqual(self.stats("hits", "misses", "hit_rate", "entries"), (1, 1, 0.5, 1))
+
+        read(self.cnx, "Medications", use_cache=False)
+        self.assertEqual(self.stats("hits", "misses"), (1, 1))
+
+    def test_writes_invalidate(self):
+        configure_result_cache()
+        self.names()
+        create_many(self.cnx, "Medications", [{"name": "Drug C"}])
+        self.assertEqual(self.names(), ["Drug A", "Drug B", "Drug C"])
+        update(self.cnx, None, "Medications", 1, {"name": "Renamed"})
+        self.assertEqual(self.names(), ["Renamed", "Drug B", "Drug C"])
+        delete_many(self.cnx, "Medications", [2])
+        self.assertEqual(self.names(), ["Renamed", "Drug C"])
+        self.assertEqual(self.stats("hits", "misses"), (0, 4))
+
+        # raw_sql() can change any table, so anything but a read drops the whole cache
+        self.names()
+        raw_sql(self.cnx, "SELECT COUNT(*) FROM Medications")
+        self.assertEqual(self.stats("entries"), (1,))
+        with self.assertRaises(Exception):
+            raw_sql(self.cnx, "UPDATE Medications SET name = 'Raw'")  # doesn't return rows
+        self.assertEqual(self.stats("entries"), (0,))
+
+    def test_least_recently_used_is_evicted(self):
+        configure_result_cache(max_entries=2)
+        for where in ("Medications_id = 1", "Medications_id = 2", "Medications_id = 1", "Medications_id > 0"):
+            self.names(where=where)
+        self.assertEqual(self.stats("hits", "misses", "evictions", "entries"), (1, 3, 1, 2))
+        self.names(where="Medications_id = 1")
+        self.names(where="Medications_id = 2")
+        self.assertEqual(self.stats("hits", "misses", "evictions"), (2, 4, 2))
+
+    def test_ttl(self):
+        configure_result_cache(default_ttl=0.05, table_ttl={"medications": 0})
+        self.names()
+        self.names()
+        self.assertEqual(self.stats("hits", "misses", "entries"), (0, 2, 0))
+
+        read(self.cnx, "Medical_conditions")
+        read(self.cnx, "Medical_conditions")
+        time.sleep(0.06)
+        read(self.cnx, "Medical_conditions")
+        self.assertEqual(self.stats("hits", "misses", "expirations"), (1, 4, 1))
+
+    def test_engines_are_cached_separately(self):
+        configure_result_cache()
+        other = start_test_database()
+        try:
+            self.names()
+            self.assertEqual(self.names(other), [])
+        finally:
+            close_database(other)
+
+        # A closed engine's key isn't given to a new one, as its id() can be
+        token = _cache_token(other)
+        del other
+        gc.collect()
+        other = start_test_database()
+        try:
+            self.assertNotIn(_cache_token(other), (token, _cache_token(self.cnx)))
+        finally:
+            close_database(other)
+
+class TestInstrumentation(unittest.TestCase):
+    def test_normalize_sql(self):
+        self.assertEqual(normalize_sql("SELECT *\n  FROM `Table2`\n WHERE name = 'O''Brien' AND x = -1.5;"),
+                         "SELECT * FROM `Table2` WHERE name = ? AND x = ?")
+        self.assertEqual(normalize_sql("SELECT * FROM Patients WHERE MRN IN (1, 2, 3) AND l_name = :l_name"),
+                         "SELECT * FROM Patients WHERE MRN IN (...) AND l_name = ?")
+        # Lists of any length are the same statement
+        self.assertEqual(normalize_sql("SELECT * FROM Patients WHERE MRN IN (?, ?)"),
+                         normalize_sql("SELECT * FROM Patients WHERE MRN IN (%s, %s, %s, %s)"))
+        self.assertEqual(normalize_sql("INSERT INTO t (a, b) VALUES (%(a)s, %(b)s), (%(a_1)s, %(b_1)s)"),
+                         "INSERT INTO t (a, b) VALUES (...)")
+
+    def test_grouped_by_function(self):
+        cnx = start_test_database()
+        try:
+            metrics.reset()
+            add_patients(cnx, [1, 2, 3])
+            fetch_all(cnx, "Patients")
+            fetch_all(cnx, "Patients", where="MRN = :MRN", params={"MRN": 2})
+            read(cnx, "Medications")
+        finally:
+            close_database(cnx)
+
+        stats = metrics.to_dict()
+        self.assertEqual(stats["by_caller"]["fetch_all"]["count"], 2)
+        self.assertEqual(stats["by_caller"]["create_many"]["rows"], 3)
+        self.assertEqual(stats["by_caller"]["read"]["count"], 1)
+        self.assertIn("SELECT * FROM Patients WHERE MRN = ?", stats["by_statement"])
+
+    def test_slow_queries(self):
+        query_metrics = QueryMetrics(slow_query_ms=10, slow_log_size=2)
+        with self.assertLogs("supplicore.db", "WARNING") as logs:
+            for seconds in (0.005, 0.02, 0.03, 0.04):
+                query_metrics.record("SELECT * FROM Patients WHERE MRN = 5", "fetch_one", seconds, 1)
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual([entry["ms"] for entry in query_metrics.slow_queries], [30.0, 40.0])
+        self.assertEqual(query_metrics.slow_queries[0]["statement"], "SELECT * FROM Patients WHERE MRN = ?")
+
+        query_metrics = QueryMetrics(slow_query_ms=None)
+        query_metrics.record("SELECT 1", "raw_sql", 10.0)
+        self.assertEqual(len(query_metrics.slow_queries), 0)
+
+    def test_exposition_formats(self):
+        query_metrics = QueryMetrics()
+        for seconds in (0.0005, 0.003, 0.003, 7.0):
+            query_metrics.record("SELECT * FROM Patients WHERE l_name = 'Lee'", 'say "hi"\\', seconds, 2)
+
+        lines = query_metrics.to_prometheus().splitlines()
+        metric = "supplicore_db_query_duration_seconds_by_caller"
+        self.assertEqual(lines[:2], [f"# HELP {metric} Database statement latency, grouped by caller.",
+                                     f"# TYPE {metric} histogram"])
+        label = 'caller="say \\"hi\\"\\\\"'
+        buckets = [line for line in lines if line.startswith(f"{metric}_bucket{{{label},")]
+        self.assertEqual(len(buckets), len(LATENCY_BUCKETS))
+        self.assertEqual(buckets[0], f'{metric}_bucket{{{label},le="0.001"}} 1')
+        self.assertEqual(buckets[2], f'{metric}_bucket{{{label},le="0.005"}} 3')
+        self.assertEqual(buckets[-1], f'{metric}_bucket{{{label},le="+Inf"}} 4')
+        self.assertIn(f"{metric}_count{{{label}}} 4", lines)
+        self.assertIn("supplicore_db_query_duration_seconds_by_statement_count"
+                      '{statement="SELECT * FROM Patients WHERE l_name = ?"} 4', lines)
+        self.assertIn(f"supplicore_db_rows_total{{{label}}} 8", lines)
+        self.assertEqual(lines[-1], "supplicore_db_slow_queries 1")
+
+        stats = json.loads(query_metrics.to_json())
+        self.assertEqual(stats["by_caller"]['say "hi"\\']["buckets"]["+Inf"], 1)
+        self.assertAlmostEqual(stats["by_caller"]['say "hi"\\']["max_ms"], 7000.0)
+
+class TestKeysetPagination(unittest.TestCase):
+    def setUp(self):
+        """
+        50 patients sharing 3 last names, so sorting by last name has many ties, broken by MRN.
+        """
+        self.cnx = start_test_database()
+        add_patients(self.cnx, range(1, 51), ("Brown", "Adams", "Clark"))
+        self.expected = [row.MRN for row in fetch_all(self.cnx, "Patients", select="MRN, l_name")]
+        self.expected.sort(key=lambda MRN: (("Brown", "Adams", "Clark")[(MRN - 1) % 3], MRN))
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def test_keyset_condition(self):
+        self.assertEqual(_keyset_condition(["a"]), "((`a` > :_last_0))")
+        self.assertEqual(_keyset_condition(["a", "b"]),
+                         "((`a` > :_last_0) OR (`a` = :_last_0 AND `b` > :_last_1))")
+        self.assertEqual(_keyset_condition(["a", "b"], descending=True),
+                         "((`a` < :_last_0) OR (`a` = :_last_0 AND `b` < :_last_1))")
+
+    def test_pages_forward_and_backward(self):
+        pages = [read_page(self.cnx, "Patients", sort_by="l_name", limit=7)]
+        while pages[-1].has_more:
+            pages.append(read_page(self.cnx, "Patients", sort_by="l_name", after=pages[-1].last_key, limit=7))
+        self.assertEqual([row.MRN for page in pages for row in page.rows], self.expected)
+
+        # Reading back from each page gives the page before it
+        for previous, page in zip(pages, pages[1:]):
+            back = read_page(self.cnx, "Patients", sort_by="l_name", before=page.first_key, limit=7)
+            self.assertEqual(back.rows, previous.rows)
+        first = read_page(self.cnx, "Patients", sort_by="l_name", before=pages[0].first_key, limit=7)
+        self.assertEqual((first.rows, first.has_more), ([], False))
+
+    def test_pages_descending(self):
+        rows = []
+        page = read_page(self.cnx, "Patients", sort_by="l_name", descending=True, limit=9)
+        rows += page.rows
+        while page.has_more:
+            page = read_page(self.cnx, "Patients", sort_by="l_name", descending=True, after=page.last_key, limit=9)
+            rows += page.rows
+        self.assertEqual([row.MRN for row in rows], self.expected[::-1])
+
+class TestCatalog(unittest.TestCase):
+    def test_table_names(self):
+        cnx = start_test_database()
+        try:
+            names = get_table_names(cnx, {})["TABLE_NAME"].tolist()
+        finally:
+            close_database(cnx)
+        self.assertIn("Patients", names)
+        for name in ("Patients_has_Medications", "Supplements_has_Nutrients", "Latest_reports", "Report_dictionaries"):
+            self.assertNotIn(name, names)
+
+class TestSQLite(unittest.TestCase):
+    def test_file_that_cant_be_opened(self):
+        from sqlalchemy.exc import OperationalError
+
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(OperationalError):
+                create_sqlite_engine(os.path.join(directory, "missing", "supplicore.db"))
+
+class TestBulkWrites(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def names(self):
+        return {row.Medications_id: row.name for row in fetch_all(self.cnx, "Medications")}
+
+    def test_create_upsert_delete(self):
+        batches = create_many(self.cnx, "Medications", ({"name": f"Drug {i}"} for i in range(25)), batch_size=10)
+        self.assertEqual([batch["rows"] for batch in batches], [10, 10, 5])
+        names = self.names()
+        self.assertEqual(sorted(names.values()), sorted(f"Drug {i}" for i in range(25)))
+
+        # Existing IDs are updated, new ones are added
+        ids = sorted(names)
+        upsert_many(self.cnx, "Medications", [{"Medications_id": ids[0], "name": "Renamed"},
+                                              {"Medications_id": 1000, "name": "New"}])
+        names = self.names()
+        self.assertEqual((names[ids[0]], names[1000], len(names)), ("Renamed", "New", 26))
+
+        delete_many(self.cnx, "Medications", ids[:20] + [1000], batch_size=7)
+        self.assertEqual(sorted(self.names()), ids[20:])
+
+    def test_failed_batch_changes_nothing(self):
+        create_many(self.cnx, "Medications", [{"name": "Kept"}])
+        with self.assertRaises(Exception):
+            create_many(self.cnx, "Medications", [{"name": "Added"}, {"name": None}])
+        self.assertEqual(list(self.names().values()), ["Kept"])
+
+class TestBulkIO(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+        self.columns = {column.Field.lower(): column for column in get_table_info(self.cnx, "Patients")["columns"]}
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        close_database(self.cnx)
+        self.directory.cleanup()
+
+    def test_coerce_chunk(self):
+        import pandas as pd
+
+        chunk = pd.DataFrame({
+            "MRN": ["1", "2.5", "x", "4"],
+            "f_name": ["Ann", "Bob", "Cy", "D" * 46],
+            "l_name": ["Lee", "", "Lee", "Lee"],
+            "sex": ["F", "M", "F", "M"],
+            "DOB": ["2020-02-29", "2020-02-30", "2020-01-01", "2020-01-01"],
+            "weight_kg": ["12.5", "ten", "3", "4"],
+            "Medical_conditions_id": ["1", "1", "1", "1"],
+        })
+        values, errors = coerce_chunk(chunk, self.columns)
+        self.assertEqual(errors[0], "")
+        self.assertEqual((values["MRN"][0], values["DOB"][0], values["weight_kg"][0]),
+                         (1, datetime.date(2020, 2, 29), 12.5))
+        for message in ("MRN: not a valid INT", "l_name: a value is required", "DOB: not a valid DATE",
+                        "weight_kg: not a valid FLOAT"):
+            self.assertIn(message, errors[1])
+        self.assertIn("MRN: not a valid INT", errors[2])
+        self.assertIn("f_name: not a valid VARCHAR(45)", errors[3])
+
+    def test_import_rejects_rows(self):
+        path = os.path.join(self.directory.name, "patients.csv")
+        fields = ["MRN", "f_name", "l_name", "sex", "DOB", "weight_kg", "Medical_conditions_id"]
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(fields)
+            writer.writerow([1, "Ann", "Lee", "F", "2020-01-01", "12.5", 1])
+            writer.writerow([2, "Bob", "Lee", "M", "not a date", "10", 1])
+            writer.writerow([1, "Ann", "Again", "F", "2020-01-01", "12.5", 1])  # duplicate MRN
+            writer.writerow([3, "Cy", "Lee", "F", "2021-06-30", "8", 1])
+
+        stats = import_table(self.cnx, "Patients", path, chunk_size=2)
+        self.assertEqual((stats["rows"], stats["imported"], stats["rejected"]), (4, 2, 2))
+        self.assertEqual([row.MRN for row in fetch_all(self.cnx, "Patients", select="MRN")], [1, 3])
+
+        with open(stats["error_path"], newline="") as file:
+            rejected = list(csv.DictReader(file))
+        self.assertEqual([row["_line"] for row in rejected], ["3", "4"])
+        self.assertIn("DOB: not a valid DATE", rejected[0]["_error"])
+
+class TestReportCodec(unittest.TestCase):
+    def setUp(self):
+        self.reports = [sample_report(MRN, MRN % 30, fluids=f"{1000 + MRN} mL") for MRN in range(200)]
+        self.cnx = start_test_database()
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def test_round_trip(self):
+        plain = ReportCodec()
+        dictionary = ReportCodec("zlib", train_dictionary(self.reports))
+        for report in self.reports[:20] + [{}, {"text": "é ü 漢字", "nested": {"list": [1, 2.5, None]}}]:
+            self.assertEqual(plain.decode(plain.encode(report)), report)
+            self.assertEqual(dictionary.decode(dictionary.encode(report)), report)
+
+        # The dictionary makes reports smaller, and reports can't be read without it
+        self.assertLess(len(dictionary.encode(self.reports[0])), len(plain.encode(self.reports[0])))
+        with self.assertRaises(ValueError):
+            plain.decode(dictionary.encode(self.reports[0]))
+
+    def test_pack_and_unpack(self):
+        report = self.reports[5]
+        configure_codec(self.cnx, None)
+        packed = pack_report(self.cnx, report)
+        self.assertIsNone(packed["report_data"])
+        self.assertEqual(unpack_report(self.cnx, packed["report"], packed["report_data"]), report)
+
+        configure_codec(self.cnx, "zlib")
+        packed = pack_report(self.cnx, report)
+        self.assertIsNotNone(packed["report_data"])
+        self.assertNotIn("feeding_schedule", packed["report"])
+        self.assertEqual(unpack_report(self.cnx, packed["report"], packed["report_data"]), report)
+
+class TestReportExport(unittest.TestCase):
+    def test_written_bytes(self):
+        from report_export import _write_batch
+
+        with tempfile.TemporaryDirectory() as directory:
+            batch = [(os.path.join(directory, "a.json"), '{"name": "Zoë, 漢字"}'),
+                     (os.path.join(directory, "b.json"), sample_report(1, 0, name="Núñez, José"))]
+            written, written_bytes, failures = _write_batch(batch, directory)
+            self.assertEqual((written, failures), (2, []))
+            self.assertEqual(written_bytes, sum(os.path.getsize(path) for path, _ in batch))
+
+class TestFindReports(unittest.TestCase):
+    def setUp(self):
+        """
+        Reports with the values as saved from the report page ("Label: value"), plain numbers, and text that isn't
+        a number or date, which the database copies into the indexed columns as NULL.
+        """
+        self.cnx = start_test_database()
+        add_patients(self.cnx, [7, 8])
+        values = [
+            ("2024-01-05", "20.0", "WHO REE: 949.0"),
+            ("2024-01-10", "Weight: 9.5", "WHO REE: 1234.5"),
+            ("2024-02-01", "12", "500"),
+            ("2024-02-15", "ten", "WHO REE: n/a"),
+            ("not a date", "", "2250.0 kcal"),
+            ("2024-03-01", None, "WHO REE: -5"),
+        ]
+        reports = [sample_report(7 + i % 2, 0, current_date=date, weight_kg=weight, WHO_REE=WHO_REE)
+                   for i, (date, weight, WHO_REE) in enumerate(values)]
+        create_many(self.cnx, "Reports", [{"MRN": int(report["MRN"]), "date": datetime.datetime(2024, 1, 1),
+                                           "report": json.dumps(report)} for report in reports])
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def ids(self, **limits):
+        return [row.Reports_id for row in find_reports(self.cnx, select="Reports_id", **limits)]
+
+    def test_copied_columns(self):
+        rows = find_reports(self.cnx, select="Reports_id, report_date, weight_kg, Holliday_Segar_m, WHO_REE")
+        columns = {row.Reports_id: (row.report_date, row.weight_kg, row.WHO_REE) for row in rows}
+        self.assertEqual(columns, {
+            1: (datetime.date(2024, 1, 5), 20.0, 949.0),
+            2: (datetime.date(2024, 1, 10), 9.5, 1234.5),
+            3: (datetime.date(2024, 2, 1), 12.0, 500.0),
+            4: (datetime.date(2024, 2, 15), None, None),
+            5: (None, None, None),
+            6: (datetime.date(2024, 3, 1), None, -5.0),
+        })
+        self.assertEqual({row.Holliday_Segar_m for row in rows}, {1500.0})
+
+    def test_range_filters(self):
+        self.assertEqual(self.ids(), [5, 1, 2, 3, 4, 6])  # a NULL date sorts first
+        self.assertEqual(self.ids(start_date=datetime.date(2024, 1, 10), end_date=datetime.date(2024, 2, 15)),
+                         [2, 3, 4])
+        self.assertEqual(self.ids(min_weight_kg=0), [1, 2, 3])
+        self.assertEqual(self.ids(min_weight_kg=9.5, max_weight_kg=12), [2, 3])
+        self.assertEqual(self.ids(max_WHO_REE=949), [1, 3, 6])
+        self.assertEqual(self.ids(min_WHO_REE=500, max_WHO_REE=2000, start_date=datetime.date(2024, 1, 6)), [2, 3])
+        self.assertEqual(self.ids(MRN=8, min_WHO_REE=-10), [2, 6])
+        self.assertEqual(self.ids(min_weight_kg=0, descending=True, limit=2), [3, 2])
+
+class TestReportPDF(unittest.TestCase):
+    def test_xref_offsets(self):
+        for report in (sample_report(7, 0, home_recipe="é ü 漢字\n" * 3), apply_calculations(empty_report())):
+            pdf = render_report(report)
+            xref_offset = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", pdf).group(1))
+            self.assertTrue(pdf[xref_offset:].startswith(b"xref\n0 7\n"))
+
+            entries = pdf[xref_offset:].split(b"\n")[3:9]
+            for number, entry in enumerate(entries, start=1):
+                offset = int(entry.split()[0])
+                self.assertTrue(pdf[offset:].startswith(b"%d 0 obj\n" % number), number)
+
+            length, stream = re.search(rb"<< /Length (\d+) >>\nstream\n(.*)\nendstream", pdf, re.DOTALL).groups()
+            self.assertEqual(int(length), len(stream))
+
+    def test_escaping(self):
+        self.assertEqual(wrap_text("f(x) = a\\b)", 500, 10, 1), [b"f\\(x\\) = a\\\\b\\)"])
+        pdf = render_report(sample_report(7, 0, fluids="(about) 1 L \\ day"))
+        self.assertIn(b"(\\(about\\) 1 L \\\\ day) Tj", pdf)
+
+    def test_wrapping(self):
+        text = " ".join(f"word{i}" for i in range(40))
+        lines = wrap_text(text, 100, 10, 20)
+        self.assertEqual(b" ".join(lines).decode(), text)
+        for line in lines:
+            self.assertLessEqual(sum(CHARACTER_WIDTHS[character] for character in line) * 10 / 1000, 100)
+        self.assertEqual(wrap_text("one\ntwo", 100, 10, 3), [b"one", b"two"])
+
+        # Text that doesn't fit in max_lines is cut off with "..."
+        truncated = wrap_text(text, 100, 10, 3)
+        self.assertEqual(truncated, lines[:2] + [lines[2] + b"..."])
+        # The home recipe has 6 lines in the default layout
+        text = " ".join(f"word{i}" for i in range(200))
+        pdf = render_report(sample_report(7, 0, home_recipe=text))
+        home_recipe = re.findall(rb"\((word[^)]*)\) Tj", pdf)
+        self.assertEqual(len(home_recipe), 6)
+        self.assertTrue(home_recipe[-1].endswith(b"..."))
+        self.assertNotIn(b"word199", pdf)
+
+class TestReportHistory(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+        add_patients(self.cnx, [7])
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def test_revisions_round_trip(self):
+        reports = [sample_report(7, day, fluids=f"{1000 + day} mL") for day in range(45)]
+        reports[10] = sample_report(7, 10, solids="Regular diet", home_recipe="Formula, 20 kcal/oz")
+        reports[20] = {key: value for key, value in sample_report(7, 20).items() if key != "solids"}
+        for report in reports:
+            self.assertIsNotNone(save_report(self.cnx, report))
+        self.assertIsNone(save_report(self.cnx, reports[-1]))
+
+        rows = fetch_all(self.cnx, "Reports", select="Reports_id, snapshot_id")
+        snapshots = [row for row in rows if row.snapshot_id is None]
+        self.assertEqual(len(rows), len(reports))
+        self.assertTrue(1 < len(snapshots) < len(rows))
+
+        for day, report in enumerate(reports):
+            self.assertEqual(get_report_at(self.cnx, 7, datetime.date(2024, 1, 1) + datetime.timedelta(days=day)), report)
+        self.assertEqual([entry["report"] for entry in get_report_timeline(self.cnx, 7)], reports)
+        self.assertEqual(get_latest_report(self.cnx, 7), reports[-1])
+
+    def test_null_and_removed_fields(self):
+        reports = [sample_report(7, 0, extra="x"), sample_report(7, 1, home_recipe=None),
+                   sample_report(7, 2, home_recipe=None)]
+        del reports[2]["fluids"]
+        for report in reports:
+            self.assertIsNotNone(save_report(self.cnx, report))
+        self.assertEqual(len(fetch_all(self.cnx, "Reports", where="snapshot_id IS NOT NULL")), 2)
+
+        # Null fields come back as null, and saving the same report again doesn't add a revision
+        self.assertEqual([entry["report"] for entry in get_report_timeline(self.cnx, 7)], reports)
+        self.assertIsNone(save_report(self.cnx, dict(reports[-1])))
+
+    def test_delete_snapshot(self):
+        from sqlalchemy.exc import IntegrityError
+
+        reports = [sample_report(7, day, fluids=f"{1000 + day} mL") for day in range(8)]
+        reports[5]["home_recipe"] = None
+        ids = [save_report(self.cnx, report) for report in reports]
+        snapshot_ids = {row.snapshot_id for row in fetch_all(self.cnx, "Reports", select="snapshot_id")}
+        self.assertEqual(snapshot_ids, {None, ids[0]})
+
+        # The database refuses to delete a snapshot with deltas on its own
+        with self.assertRaises(IntegrityError):
+            delete_many(self.cnx, "Reports", [ids[0]])
+
+        # Deleting it with one of its deltas: the next delta becomes the snapshot, and the rest stay the same
+        self.assertEqual(delete_reports(self.cnx, [ids[0], ids[2], 12345]), 2)
+        rows = fetch_all(self.cnx, "Reports", select="Reports_id, snapshot_id")
+        self.assertEqual([(row.Reports_id, row.snapshot_id) for row in rows],
+                         [(ids[1], None)] + [(report_id, ids[1]) for report_id in ids[3:]])
+        left = [report for i, report in enumerate(reports) if i not in (0, 2)]
+        self.assertEqual([entry["report"] for entry in get_report_timeline(self.cnx, 7)], left)
+
+        self.assertEqual(delete_reports(self.cnx, [ids[-1]]), 1)
+        self.assertEqual(get_latest_report(self.cnx, 7), reports[-2])
+        self.assertIsNone(save_report(self.cnx, reports[-2]))
+
+    def test_compressed_revisions(self):
+        configure_codec(self.cnx, "zlib")
+        reports = [sample_report(7, day, fluids=f"{1000 + day} mL") for day in range(5)]
+        for report in reports:
+            save_report(self.cnx, report)
+        self.assertEqual([entry["report"] for entry in get_report_timeline(self.cnx, 7)], reports)
+
+    def test_latest_report_deleted(self):
+        # Deleting a patient's latest revision also deletes its Latest_reports row (ON DELETE CASCADE)
+        from app import generate_report
+
+        add_patients(self.cnx, [8])
+        reports = [sample_report(7, day, fluids=f"{1000 + day} mL") for day in range(3)]
+        ids = [save_report(self.cnx, report) for report in reports]
+        save_report(self.cnx, sample_report(8, 0))
+        delete_many(self.cnx, "Reports", [ids[-1]])
+
+        self.assertEqual(get_latest_report(self.cnx, 7), reports[1])
+        self.assertEqual(get_latest_reports(self.cnx, [7, 8, 9]), {7: reports[1], 8: sample_report(8, 0)})
+        self.assertEqual(generate_report(self.cnx, 7)["header"]["fluids"], "1001 mL")
+
+    def test_without_latest_reports(self):
+        # A database that hasn't had migrations/005_latest_reports.sql applied
+        from sqlalchemy import text
+        from db_interface import checkout, invalidate_schema_catalog
+        from app import generate_report
+
+        with checkout(self.cnx) as connection, connection.begin():
+            connection.execute(text("DROP TABLE Latest_reports"))
+        invalidate_schema_catalog(self.cnx)
+
+        report = sample_report(7, 3)
+        self.assertIsNotNone(save_report(self.cnx, report))
+        self.assertEqual(get_latest_report(self.cnx, 7), report)
+        self.assertEqual(get_latest_reports(self.cnx, [7]), {})
+        self.assertEqual(generate_report(self.cnx, 7)["header"]["feeding_schedule"], "")
+
+class TestBatchReports(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+        rng = random.Random(18)
+        create_many(self.cnx, "Patients", [{
+            "MRN": MRN, "f_name": f"First{MRN}", "m_name": None, "l_name": "Smith", "sex": rng.choice("MF"),
+            "DOB": datetime.date.today() - datetime.timedelta(days=rng.randint(0, 18 * 365)),
+            "weight_kg": round(rng.uniform(2, 80), 1), "Medical_conditions_id": 1,
+        } for MRN in range(1, 41)])
+        for MRN in range(1, 41, 3):
+            save_report(self.cnx, sample_report(MRN, 0, fluids=f"{1000 + MRN} mL", solids="Regular diet"))
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def test_matches_generate_report(self):
+        from app import generate_report, generate_reports
+
+        MRNs = [40, 3, 999, 1, 2] + list(range(4, 40))
+        reports = list(generate_reports(self.cnx, MRNs, chunk_size=7))
+        self.assertEqual([report["header"]["MRN"] for report in reports], [MRN for MRN in MRNs if MRN != 999])
+        with self.assertRaises(ValueError):
+            generate_report(self.cnx, 999)
+
+        for report in reports:
+            expected = generate_report(self.cnx, report["header"]["MRN"])
+            self.assertEqual(report["header"], expected["header"])
+            calculations, expected = report["calculations"], expected["calculations"]
+            self.assertAlmostEqual(calculations["Holliday-Segar"]["maintenance"],
+                                   expected["Holliday-Segar"]["maintenance"])
+            self.assertAlmostEqual(calculations["Holliday-Segar"]["sick_day"], expected["Holliday-Segar"]["sick_day"])
+            self.assertAlmostEqual(calculations["WHO_REE"], expected["WHO_REE"])
+        self.assertEqual(reports[0]["header"]["fluids"], "1040 mL")
+
+class TestAnalyticsExport(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+        add_patients(self.cnx, [7, 8])
+        self.directory = tempfile.TemporaryDirectory()
+        self.ids = [save_report(self.cnx, sample_report(7 + day % 2, day, fluids=f"{1000 + day} mL"))
+                    for day in range(0, 40, 3)]
+
+    def tearDown(self):
+        close_database(self.cnx)
+        self.directory.cleanup()
+
+    def test_appends_new_reports(self):
+        import pyarrow as pa
+
+        out_dir = self.directory.name
+        state = export_snapshot(self.cnx, out_dir)
+        self.assertEqual((state["appended"], state["reports"], state["patients"]), (len(self.ids), len(self.ids), 2))
+        self.assertEqual(state["last_Reports_id"], self.ids[-1])
+
+        # Only the reports saved since are appended, including to a month that already has a file
+        new_ids = [save_report(self.cnx, sample_report(7, day, solids="Regular diet")) for day in (41, 70)]
+        state = export_snapshot(self.cnx, out_dir)
+        self.assertEqual((state["appended"], state["reports"], state["last_Reports_id"]),
+                         (2, len(self.ids) + 2, new_ids[-1]))
+        self.assertEqual(export_snapshot(self.cnx, out_dir)["appended"], 0)
+
+        table = read_snapshot(out_dir, as_frame=False)
+        self.assertEqual(sorted(table["Reports_id"].to_pylist()), self.ids + new_ids)
+        types = {"Reports_id": pa.int64(), "MRN": pa.int64(), "report_date": pa.date32(), "DOB": pa.date32(),
+                 "age": pa.int64(), "weight_kg": pa.float64(), "WHO_REE": pa.float64(), "solids": pa.string(),
+                 "report_month": pa.string()}
+        self.assertEqual({name: table.schema.field(name).type for name in types}, types)
+
+        rows = {row["Reports_id"]: row for row in table.to_pylist()}
+        last, first = rows[new_ids[-1]], rows[self.ids[0]]
+        self.assertEqual((last["report_date"], last["report_month"], last["solids"]),
+                         (datetime.date(2024, 3, 11), "2024-03", "Regular diet"))
+        self.assertEqual((first["age"], first["age_unit"], first["WHO_REE"]), (9, "years", 949.0))
+        self.assertEqual(sorted(read_snapshot(out_dir, "patients")["MRN"]), [7, 8])
+
+    def test_mismatched_snapshot(self):
+        out_dir = self.directory.name
+        export_snapshot(self.cnx, out_dir)
+        with self.assertRaises(ValueError):
+            export_snapshot(self.cnx, out_dir, file_format="arrow")
+        with self.assertRaises(ValueError):
+            export_snapshot(self.cnx, out_dir, partition="day")
+
+        # --full starts the snapshot over in the new layout
+        state = export_snapshot(self.cnx, out_dir, file_format="arrow", partition="day", full=True)
+        self.assertEqual(state["appended"], len(self.ids))
+        self.assertEqual(sorted(read_snapshot(out_dir)["Reports_id"]), self.ids)
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.cnx = start_test_database()
+        add_patients(self.cnx, [1, 12, 120, 125, 129, 130, 1200, 1299, 2120, 12000])
+
+    def tearDown(self):
+        close_database(self.cnx)
+
+    def test_number_prefix_ranges(self):
+        self.assertEqual(_number_prefix_ranges(12, max_digits=4), [(12, 13), (120, 130), (1200, 1300)])
+        self.assertEqual(_number_prefix_ranges(9, max_digits=2), [(9, 10), (90, 100)])
+        self.assertEqual(_number_prefix_ranges(0), [(0, 1)])
 
-    def test_function(self):
-        
-        result = function(self.sample_data)
-        expected = "expected_result"
-        self.assertEqual(result, expected, "your_function did not return the expected result")
+    def test_search_by_MRN_prefix(self):
+        self.assertEqual([row[0] for row in search_entries(self.cnx, "Patients", "12")],
+                         [12, 120, 125, 129, 1200, 1299, 12000])
+        self.assertEqual([row[0] for row in search_entries(self.cnx, "Patients", "13")], [130])
+        self.assertEqual([row[0] for row in search_entries(self.cnx, "Patients", "12", limit=3)], [12, 120, 125])
 
- 
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()